@@ -16,6 +16,19 @@ def staged_raw_data():
     """Get the path of staged raw data or None"""
     return os.environ.get('AG_RAW_DATA')
 
+
+_ENA_URL = 'http://www.ebi.ac.uk/ena/data'
+
+
+def ena_url():
+    """Get the base URL of the ENA data service"""
+    return os.environ.get('AG_ENA_URL', _ENA_URL)
+
+
+def is_live_ena():
+    """Whether the ENA data service used is the real one"""
+    return ena_url() == _ENA_URL
+
 __version__ = "0.0.1"
 
 __all__ = ['WORKING_DIR']
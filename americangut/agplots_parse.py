@@ -2,6 +2,8 @@
 
 from numpy import array, argsort, zeros
 
+import americangut.metadata as agmd
+
 __author__ = "Sam Way"
 __copyright__ = "Copyright 2013, The American Gut Project"
 __credits__ = ["Sam Way"]
@@ -31,16 +33,15 @@ def get_filtered_taxa_summary(mapping_file, taxa_summary_file,
         taxa_labels - taxonomic labels (including "Other")
         collapsed_taxa_table - simplified taxonomy table
     """
-    with open(mapping_file, 'rU') as mapping_fp:
-        mapping_dict, comments = parse_mapping_file_to_dict(mapping_fp)
+    md = agmd.load(mapping_file)
 
     with open(taxa_summary_file, 'rU') as taxa_fp:
         sample_ids, taxa_ids, taxa_table = parse_taxa_summary_table(taxa_fp)
 
     taxa_ids = [taxa_id.split('__')[-1] for taxa_id in taxa_ids]
 
-    selected_ids = [key for key in mapping_dict
-                    if mapping_dict[key][metadata_category] == metadata_value]
+    selected_ids = set(md.sample_ids[md.column(metadata_category) ==
+                                     metadata_value])
 
     if len(selected_ids) < 1:
         raise ValueError('No sample ids match metadata_value="%s" in '
@@ -115,33 +116,5 @@ def parse_taxa_summary_table(taxa_summary_fp, cast_as=float):
 def parse_mapping_file_to_dict(mapping_file_fp):
     """ Takes an open mapping file and parses it to a dictionary structure """
 
-    metadata_dict = {}
-    metadata_categories = []
-    comments = []
-
-    for line in mapping_file_fp:
-        line = line.strip()
-        if not line:
-            continue
-
-        if line.startswith('#'):
-            line = line[1:]
-            if not metadata_categories:
-                metadata_categories = line.split('\t')[1:]
-                num_categories = len(metadata_categories)
-            else:
-                comments.append(line)
-        else:
-            line_pieces = line.split('\t')
-            if len(line_pieces[1:]) != num_categories:
-                raise ValueError("Error in mapping file - number of metadata "
-                                 "values does not match the number of "
-                                 "metadata categories")
-
-            sample_id = line_pieces[0]
-            metadata_values = line_pieces[1:]
-            metadata_dict[sample_id] = {key: value for key, value in
-                                        zip(metadata_categories,
-                                            metadata_values)}
-
-    return metadata_dict, comments
+    md = agmd.Metadata.from_lines(mapping_file_fp)
+    return md.to_dict(), md.comments
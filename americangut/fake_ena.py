@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import gzip
+import multiprocessing as mp
+import os
+import random
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+
+from skbio.parse.sequences import parse_fasta
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+# The size of the writes used to send FASTQ, so that clients see it arrive
+# in pieces as they would from ENA
+_SEND_CHUNK = 2 ** 16
+
+
+def _fasta_to_fastq_gz(fasta_fp, read_multiplier=1):
+    """Encode the records of a FASTA file as gzipped FASTQ"""
+    out = StringIO()
+    with gzip.GzipFile(fileobj=out, mode='w') as fp:
+        for rep in range(read_multiplier):
+            fasta_fp.seek(0)
+            for id_, seq in parse_fasta(fasta_fp):
+                if rep:
+                    id_ = '%s.r%d' % (id_, rep)
+                fp.write('@%s\n%s\n+\n%s\n' % (id_, seq, 'I' * len(seq)))
+    return out.getvalue()
+
+
+def load_samples(source_dir, replicates=1, read_multiplier=1):
+    """Build ENA responses from a directory of fetched samples
+
+    Parameters
+    ----------
+    source_dir : str
+        A study directory as written by americangut.util.fetch_study, such as
+        tests/data/ag_testing.
+    replicates : int, optional
+        The number of copies of each sample to serve. Copies are given new
+        accessions and barcodes.
+    read_multiplier : int, optional
+        The number of copies of each read to place in the FASTQ.
+
+    Returns
+    -------
+    dict
+        {accession: (str, str)} of the gzipped FASTQ and the XML metadata of
+        each sample.
+    """
+    samples = {}
+    for accession in sorted(os.listdir(source_dir)):
+        base = os.path.join(source_dir, accession, accession)
+        if not os.path.exists(base + '.fna'):
+            continue
+
+        with open(base + '.fna') as fp:
+            fastq = _fasta_to_fastq_gz(fp, read_multiplier)
+        with open(base + '.txt') as fp:
+            xml = fp.read()
+
+        samples[accession] = (fastq, xml)
+        for rep in range(1, replicates):
+            new_accession = '%s.%d' % (accession, rep)
+            # the barcode is the last component of the SUBMITTER_ID
+            new_xml = xml.replace(accession, new_accession).replace(
+                '</SUBMITTER_ID>', '.%d</SUBMITTER_ID>' % rep, 1)
+            samples[new_accession] = (fastq, new_xml)
+
+    return samples
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            fail = server.rng.random() < server.error_rate
+        if fail:
+            self.send_error(500)
+            return
+
+        if self.path.startswith('/warehouse/filereport'):
+            lines = ['secondary_sample_accession\tsubmitted_ftp']
+            for accession in sorted(server.samples):
+                lines.append('%s\t%s/fastq/%s.fastq.gz'
+                             % (accession, server.url, accession))
+            body = '\n'.join(lines) + '\n'
+        elif self.path.startswith('/view/'):
+            accession = self.path.split('/')[2].split('&')[0]
+            body = server.samples.get(accession, (None, None))[1]
+        elif self.path.startswith('/fastq/'):
+            accession = self.path.split('/')[2][:-len('.fastq.gz')]
+            body = server.samples.get(accession, (None, None))[0]
+        else:
+            body = None
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for start in range(0, len(body), _SEND_CHUNK):
+            self.wfile.write(body[start:start + _SEND_CHUNK])
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeENAServer(ThreadingMixIn, HTTPServer):
+    """A local stand-in for the ENA data service
+
+    The filereport, display=xml and FASTQ requests made by
+    americangut.util.fetch_study are answered. The filereport of any study
+    lists all of the samples served.
+
+    Parameters
+    ----------
+    samples : dict
+        {accession: (str, str)} of the gzipped FASTQ and the XML metadata of
+        each sample, as returned by load_samples.
+    latency : float, optional
+        The seconds to wait before answering each request.
+    error_rate : float, optional
+        The probability of answering a request with a HTTP 500.
+    seed : int, optional
+        The seed for the error injection.
+    port : int, optional
+        The port to listen on. By default any free port is used.
+
+    Notes
+    -----
+    Point the fetch functions at the server by setting the AG_ENA_URL
+    environment variable to its url.
+    """
+    daemon_threads = True
+
+    def __init__(self, samples, latency=0.0, error_rate=0.0, seed=None,
+                 port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.samples = samples
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the socket"""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def _serve(queue, source_dir, replicates, read_multiplier, kwargs):
+    samples = load_samples(source_dir, replicates, read_multiplier)
+    server = FakeENAServer(samples, **kwargs)
+    queue.put(server.url)
+    server.serve_forever()
+
+
+def start_process(source_dir, replicates=1, read_multiplier=1, **kwargs):
+    """Run a FakeENAServer in a separate process
+
+    This keeps the memory and CPU used by the server out of measurements of
+    the client. The parameters are as for load_samples and FakeENAServer.
+
+    Returns
+    -------
+    multiprocessing.Process
+        The server process. Terminate it when done.
+    str
+        The URL of the server.
+    """
+    queue = mp.Queue()
+    proc = mp.Process(target=_serve, args=(queue, source_dir, replicates,
+                                           read_multiplier, kwargs))
+    proc.daemon = True
+    proc.start()
+    return proc, queue.get()
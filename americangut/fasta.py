@@ -0,0 +1,602 @@
+#!/usr/bin/env python
+
+import gzip
+import json
+import mmap
+import multiprocessing as mp
+import os
+import re
+import shutil
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+BLOCK_SIZE = 2 ** 22
+_GZIP_MAGIC = '\x1f\x8b'
+
+# The first token of a FASTA header
+_HEADER = re.compile(r'^>[ \t]*(\S*)', re.M)
+
+
+def is_gzip(path):
+    """Whether a file is gzip compressed, judged by its content"""
+    with open(path, 'rb') as fp:
+        return fp.read(2) == _GZIP_MAGIC
+
+
+def open_fasta(path, mode='rb'):
+    """Open a FASTA file, compressed or not
+
+    Parameters
+    ----------
+    path : str
+        The file to open.
+    mode : str, optional
+        The mode to open with. Files are read compressed if their content is
+        gzip, and written compressed if the path ends in .gz.
+
+    Returns
+    -------
+    file-like
+        The open file.
+    """
+    if 'r' in mode:
+        compressed = is_gzip(path)
+    else:
+        compressed = path.endswith('.gz')
+
+    if compressed:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def record_blocks(fp, block_size=BLOCK_SIZE, limit=None):
+    """Read FASTA data in blocks of whole records
+
+    Parameters
+    ----------
+    fp : file-like
+        The FASTA data.
+    block_size : int, optional
+        The number of bytes to read at a time.
+    limit : int, optional
+        The number of bytes to read in total. By default the data are read to
+        the end.
+
+    Yields
+    ------
+    str
+        Blocks which begin at the start of a record and end at the end of
+        one. A block holds at least one record.
+    """
+    carry = ''
+    remaining = limit
+    while True:
+        size = block_size if remaining is None else min(block_size,
+                                                        remaining)
+        chunk = fp.read(size) if size > 0 else ''
+        if not chunk:
+            if carry:
+                yield carry
+            return
+
+        if remaining is not None:
+            remaining -= len(chunk)
+
+        buf = carry + chunk
+        cut = buf.rfind('\n>')
+        if cut == -1:
+            carry = buf
+        else:
+            yield buf[:cut + 1]
+            carry = buf[cut + 1:]
+
+
+def trim_block(block, length):
+    """Trim the sequences of a block of two line FASTA records
+
+    Parameters
+    ----------
+    block : str
+        Whole FASTA records, each a header line and a sequence line.
+    length : int
+        The length to trim sequences to. Shorter sequences are not modified.
+
+    Returns
+    -------
+    str
+        The trimmed records. Surrounding whitespace is removed from each line,
+        and a trailing header without a sequence is dropped.
+    """
+    lines = block.split('\n')
+    if len(lines) % 2:
+        # either the empty string after the final newline, or an incomplete
+        # record
+        lines.pop()
+
+    lines[0::2] = [h.strip() for h in lines[0::2]]
+    lines[1::2] = [s.strip()[:length] for s in lines[1::2]]
+
+    if not lines:
+        return ''
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def trim_records(input_fasta, output_fasta, length, block_size=BLOCK_SIZE,
+                 limit=None):
+    """Trim two line FASTA records block by block
+
+    Parameters
+    ----------
+    input_fasta : file-like
+        The records to trim.
+    output_fasta : file-like
+        Where to write the trimmed records.
+    length : int
+        The length to trim sequences to. Shorter sequences are not modified.
+    block_size : int, optional
+        The number of bytes to read at a time.
+    limit : int, optional
+        The number of bytes to read. By default the input is read to the end.
+    """
+    for block in record_blocks(input_fasta, block_size, limit):
+        output_fasta.write(trim_block(block, length))
+
+
+def _next_record(fp, pos):
+    """Get the offset of the first record starting at or after a position"""
+    if pos == 0:
+        return 0
+
+    # a record starts after a newline, so look from the preceding byte
+    offset = pos - 1
+    fp.seek(offset)
+    tail = ''
+    while True:
+        chunk = fp.read(2 ** 16)
+        if not chunk:
+            return None
+
+        buf = tail + chunk
+        idx = buf.find('\n>')
+        if idx != -1:
+            return offset - len(tail) + idx + 1
+        offset += len(chunk)
+        tail = buf[-1:]
+
+
+def shard_offsets(path, shards):
+    """Split an uncompressed FASTA file into byte ranges of whole records
+
+    Parameters
+    ----------
+    path : str
+        The FASTA file.
+    shards : int
+        The number of ranges to split into.
+
+    Returns
+    -------
+    list of (int, int)
+        The start and end offsets of each range. Ranges may be empty.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as fp:
+        for i in range(1, shards):
+            start = _next_record(fp, max(size * i // shards, bounds[-1]))
+            bounds.append(size if start is None else start)
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _trim_shard(args):
+    input_path, output_path, start, end, length, block_size = args
+    with open(input_path, 'rb') as in_, open(output_path, 'wb') as out:
+        in_.seek(start)
+        trim_records(in_, out, length, block_size, limit=end - start)
+    return output_path
+
+
+def trim_fasta_file(input_path, output_path, length, processes=1,
+                    block_size=BLOCK_SIZE):
+    """Trim the sequences of a two line FASTA file
+
+    Parameters
+    ----------
+    input_path : str
+        The FASTA file to trim. It may be gzip compressed.
+    output_path : str
+        Where to write the trimmed records. It is gzip compressed if it ends
+        in .gz.
+    length : int
+        The length to trim sequences to. Shorter sequences are not modified.
+    processes : int, optional
+        The number of processes to trim with. Uncompressed input is split
+        into byte ranges of whole records which are trimmed independently.
+    block_size : int, optional
+        The number of bytes to read at a time.
+    """
+    if processes <= 1 or is_gzip(input_path):
+        with open_fasta(input_path) as in_, \
+                open_fasta(output_path, 'wb') as out:
+            trim_records(in_, out, length, block_size)
+        return
+
+    jobs = [(input_path, '%s.part%d' % (output_path, i), start, end, length,
+             block_size)
+            for i, (start, end) in enumerate(shard_offsets(input_path,
+                                                           processes))]
+    pool = mp.Pool(processes=processes)
+    try:
+        parts = pool.map(_trim_shard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    try:
+        concatenate_paths(parts, output_path)
+    finally:
+        for part in parts:
+            os.remove(part)
+
+
+def _copy_fd(in_fd, out_fd, count, block_size):
+    """Copy bytes between file descriptors, in the kernel if possible"""
+    if hasattr(os, 'sendfile'):
+        offset = 0
+        while offset < count:
+            sent = os.sendfile(out_fd, in_fd, offset, count - offset)
+            if not sent:
+                break
+            offset += sent
+        return
+
+    data = os.read(in_fd, block_size)
+    while data:
+        os.write(out_fd, data)
+        data = os.read(in_fd, block_size)
+
+
+def concatenate_paths(input_paths, output_path, append=False,
+                      block_size=2 ** 20):
+    """Concatenate files
+
+    Parameters
+    ----------
+    input_paths : Iterable of str
+        The files to concatenate, in order.
+    output_path : str
+        Where to write the concatenation.
+    append : bool, optional
+        Whether to append to the output rather than replace it.
+    block_size : int, optional
+        The number of bytes to copy at a time when the copy cannot be done in
+        the kernel.
+
+    Notes
+    -----
+    Compressed inputs are decompressed, and the output is compressed if it
+    ends in .gz. Otherwise the data are copied between file descriptors
+    without being interpreted, with sendfile where it is available.
+    """
+    input_paths = list(input_paths)
+    mode = 'ab' if append else 'wb'
+
+    if output_path.endswith('.gz') or any(is_gzip(p) for p in input_paths):
+        with open_fasta(output_path, mode) as out:
+            for path in input_paths:
+                with open_fasta(path) as in_:
+                    shutil.copyfileobj(in_, out, block_size)
+        return
+
+    with open(output_path, mode) as out:
+        for path in input_paths:
+            with open(path, 'rb') as in_:
+                _copy_fd(in_.fileno(), out.fileno(),
+                         os.fstat(in_.fileno()).st_size, block_size)
+
+
+def _map(fp):
+    """Map a file read-only, or return None if it is empty"""
+    if os.fstat(fp.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _count_range(args):
+    path, start, end, block_size = args
+    count = 0
+    with open(path, 'rb') as fp:
+        mm = _map(fp)
+        if mm is None:
+            return 0
+        try:
+            if start == 0 and mm[:1] == '>':
+                count += 1
+
+            # overlap blocks by a byte so that no record start is missed
+            pos = max(start - 1, 0)
+            while pos < end - 1:
+                stop = min(pos + block_size, end)
+                count += mm[pos:stop].count('\n>')
+                pos = stop - 1
+        finally:
+            mm.close()
+    return count
+
+
+def _pool_map(func, jobs, processes):
+    """Map over jobs, in a process pool if more than one process is wanted"""
+    if processes <= 1 or len(jobs) <= 1:
+        return [func(job) for job in jobs]
+
+    pool = mp.Pool(processes=processes)
+    try:
+        return pool.map(func, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def count_records(path, processes=1, block_size=BLOCK_SIZE):
+    """Count the records of an uncompressed FASTA file
+
+    Parameters
+    ----------
+    path : str
+        The FASTA file.
+    processes : int, optional
+        The number of processes to count with. The file is split into equal
+        byte ranges.
+    block_size : int, optional
+        The number of bytes to scan at a time.
+
+    Returns
+    -------
+    int
+        The number of records, counted as the lines which begin with ">".
+    """
+    size = os.path.getsize(path)
+    bounds = [size * i // processes for i in range(processes + 1)]
+    jobs = [(path, start, end, block_size)
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    return sum(_pool_map(_count_range, jobs, processes))
+
+
+def record_ids(path):
+    """Get the first token of the header of each record
+
+    Parameters
+    ----------
+    path : str
+        An uncompressed FASTA file.
+
+    Yields
+    ------
+    str
+        The ID of each record, without reading the sequences.
+    """
+    with open(path, 'rb') as fp:
+        mm = _map(fp)
+        if mm is None:
+            return
+        try:
+            for match in _HEADER.finditer(mm):
+                yield match.group(1)
+        finally:
+            mm.close()
+
+
+def sample_id_of(seq_id):
+    """Get the sample of a sequence ID of the form <sample>_<number>
+
+    This is the form written by QIIME's split_libraries_fastq.py. IDs which
+    are not of this form are taken as the sample.
+    """
+    return seq_id.rsplit('_', 1)[0]
+
+
+def _index_range(args):
+    path, start, end = args
+    runs = []
+    with open(path, 'rb') as fp:
+        mm = _map(fp)
+        if mm is None:
+            return runs
+        try:
+            for match in _HEADER.finditer(mm, start, end):
+                sample_id = sample_id_of(match.group(1))
+                if runs and runs[-1][0] == sample_id:
+                    runs[-1][1] += 1
+                else:
+                    if runs:
+                        runs[-1][3] = match.start()
+                    runs.append([sample_id, 1, match.start(), None])
+        finally:
+            mm.close()
+
+    if runs:
+        runs[-1][3] = end
+    return runs
+
+
+class SequenceIndex(object):
+    """The records of each sample in a FASTA file
+
+    Records are assigned to samples with sample_id_of. The records of a
+    sample are expected to be, but need not be, contiguous.
+
+    Parameters
+    ----------
+    path : str
+        The indexed FASTA file.
+    samples : dict
+        {sample_id: [count, [[start, end], ...]]} of the number of records of
+        each sample and the byte ranges holding them.
+    size : int
+        The size of the file when it was indexed.
+    mtime : float
+        The modification time of the file when it was indexed.
+    """
+    __slots__ = ('path', 'samples', 'size', 'mtime')
+
+    def __init__(self, path, samples, size, mtime):
+        self.path = path
+        self.samples = samples
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def build(cls, path, processes=1):
+        """Index an uncompressed FASTA file in a single pass
+
+        Parameters
+        ----------
+        path : str
+            The FASTA file.
+        processes : int, optional
+            The number of processes to index with. The file is split into
+            byte ranges of whole records.
+
+        Returns
+        -------
+        SequenceIndex
+            The index.
+        """
+        st = os.stat(path)
+        jobs = [(path, start, end)
+                for start, end in shard_offsets(path, processes)
+                if end > start]
+
+        samples = {}
+        last = None
+        for runs in _pool_map(_index_range, jobs, processes):
+            for sample_id, count, start, end in runs:
+                entry = samples.setdefault(sample_id, [0, []])
+                entry[0] += count
+                if last == sample_id and entry[1][-1][1] == start:
+                    # the run continues across a shard boundary
+                    entry[1][-1][1] = end
+                else:
+                    entry[1].append([start, end])
+                last = sample_id
+
+        return cls(path, samples, st.st_size, st.st_mtime)
+
+    @staticmethod
+    def index_path(path):
+        """Get where the index of a FASTA file is persisted"""
+        return path + '.idx'
+
+    def save(self, index_path=None):
+        """Persist the index, by default alongside the FASTA file"""
+        if index_path is None:
+            index_path = self.index_path(self.path)
+        with open(index_path, 'w') as fp:
+            json.dump({'size': self.size, 'mtime': self.mtime,
+                       'samples': self.samples}, fp)
+
+    @classmethod
+    def load(cls, path, index_path=None):
+        """Load the persisted index of a FASTA file
+
+        Returns
+        -------
+        SequenceIndex or None
+            The index, or None if there is no index or the file has changed
+            since it was indexed.
+        """
+        if index_path is None:
+            index_path = cls.index_path(path)
+        if not os.path.exists(index_path):
+            return None
+
+        with open(index_path) as fp:
+            state = json.load(fp)
+
+        st = os.stat(path)
+        if state['size'] != st.st_size or state['mtime'] != st.st_mtime:
+            return None
+
+        samples = {str(k): v for k, v in state['samples'].items()}
+        return cls(path, samples, state['size'], state['mtime'])
+
+    @classmethod
+    def open(cls, path, processes=1):
+        """Load the index of a FASTA file, building and persisting if needed
+
+        Parameters
+        ----------
+        path : str
+            The FASTA file.
+        processes : int, optional
+            The number of processes to index with, if indexing is needed.
+
+        Returns
+        -------
+        SequenceIndex
+            The index.
+        """
+        index = cls.load(path)
+        if index is None:
+            index = cls.build(path, processes)
+            index.save()
+        return index
+
+    def __contains__(self, sample_id):
+        return sample_id in self.samples
+
+    def count(self, sample_ids=None):
+        """Count the records of samples
+
+        Parameters
+        ----------
+        sample_ids : Iterable of str, optional
+            The samples to count. Samples not in the file count as 0. By
+            default all records are counted.
+
+        Returns
+        -------
+        int
+            The number of records.
+        """
+        if sample_ids is None:
+            return sum(count for count, _ in self.samples.values())
+        return sum(self.samples[i][0] for i in set(sample_ids)
+                   if i in self.samples)
+
+    def extract(self, sample_id, output):
+        """Copy the records of a sample
+
+        Parameters
+        ----------
+        sample_id : str
+            The sample to extract.
+        output : file-like
+            Where to write the records.
+
+        Raises
+        ------
+        KeyError
+            If the sample is not in the index.
+        """
+        ranges = self.samples[sample_id][1]
+        with open(self.path, 'rb') as fp:
+            for start, end in ranges:
+                fp.seek(start)
+                remaining = end - start
+                while remaining:
+                    data = fp.read(min(remaining, BLOCK_SIZE))
+                    if not data:
+                        break
+                    output.write(data)
+                    remaining -= len(data)
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 
 from __future__ import division
-from numpy import mean, shape, argsort, sort, sum as nsum, delete
-from scipy.stats import ttest_1samp
+from numpy import (arange, asarray, concatenate, errstate, maximum, mean,
+                   newaxis, shape, sqrt, argsort, sort, sum as nsum, delete,
+                   where, zeros)
+from scipy.sparse import issparse
+from scipy.stats import ttest_1samp, t as t_dist
 from time import strftime, strptime, struct_time
 
+from americangut.taxtree import _observation_index
+
 __author__ = "Justine Debelius"
 __copyright__ = "Copyright 2013, The American Gut Project"
 __credits__ = ["Justine Debelius"]
@@ -141,6 +146,214 @@ def calculate_tax_rank_1(sample, population, taxa, critical_value=0.05):
     return high, low
 
 
+# The number of taxa of a sparse population densified at a time by
+# cohort_statistics
+COHORT_BLOCK_TAXA = 256
+
+
+def _dense_cohort_statistics(population):
+    """Summarizes each taxon of a dense population"""
+    # Centers each taxon to limit the cancellation in the sums of squares
+    center = mean(population, 1)
+    centered = population - center[:, newaxis]
+    sums = nsum(centered, 1)
+    squares = nsum(centered ** 2, 1)
+    present = nsum(population > 0, 1)
+    totals = nsum(population, 1)
+    return center, sums, squares, present, totals
+
+
+def cohort_statistics(population):
+    """Summarizes each taxon over a cohort for calculate_tax_rank_cohort
+
+    INPUTS:
+        population -- a numpy array or scipy sparse matrix containing
+                    taxonomic frequency values for the whole cohort. Samples
+                    are columns, taxa are rows.
+
+    OUTPUTS:
+        cohort -- a tuple of the mean of each taxon, the sums and sums of
+                    squares of each taxon centered on its mean, the number of
+                    samples each taxon is present in, the total of each taxon,
+                    and the number of samples.
+
+    A sparse population is densified COHORT_BLOCK_TAXA taxa at a time rather
+    than as a whole. Each taxon is summarized independently, so the result is
+    the same either way."""
+
+    (num_taxa, num_samples) = shape(population)
+
+    if issparse(population):
+        population = population.tocsr()
+        blocks = [_dense_cohort_statistics(
+                      asarray(population[start:start + COHORT_BLOCK_TAXA]
+                              .toarray(), dtype=float))
+                  for start in range(0, num_taxa, COHORT_BLOCK_TAXA)]
+        if not blocks:
+            blocks = [_dense_cohort_statistics(zeros((0, num_samples)))]
+        stats = tuple(concatenate(parts) for parts in zip(*blocks))
+    else:
+        stats = _dense_cohort_statistics(asarray(population, dtype=float))
+
+    return stats + (num_samples, )
+
+
+def _rank_samples(sample, taxa, cohort, exclude, critical_value):
+    """Tests samples against the rest of a cohort
+
+    sample and exclude are taxa by tested samples, and cohort is from
+    cohort_statistics. Returns a (high, low) tuple for each tested sample."""
+
+    center, sums, squares, present, totals, num_samples = cohort
+    sample_centered = sample - center[:, newaxis]
+
+    # Leave-one-out statistics, taxa by tested samples
+    num_pop = num_samples - 1
+    loo_mean = (sums[:, newaxis] - sample_centered) / num_pop
+    population_mean = loo_mean + center[:, newaxis]
+    with errstate(divide='ignore', invalid='ignore'):
+        variance = (squares[:, newaxis] - sample_centered ** 2 -
+                    num_pop * loo_mean ** 2) / (num_pop - 1)
+        variance = maximum(variance, 0)
+
+        ratio = sample / population_mean
+        t_stat = (population_mean - sample) / sqrt(variance / num_pop)
+        p_stat = t_dist.sf(abs(t_stat), num_pop - 1) * 2
+
+    # Bonferroni correction over the taxa present in the cohort which are
+    # not excluded for the sample
+    num_tested = nsum((totals > 0)[:, newaxis] & ~exclude, 0)
+    p_stat = p_stat * num_tested
+
+    # Taxa absent from the rest of the population are not tested
+    testable = ~exclude & ((present[:, newaxis] - (sample > 0)) > 0)
+
+    ranks = []
+    for col in range(sample.shape[1]):
+        high = []
+        low = []
+
+        idx = where(testable[:, col])[0]
+        p_col = p_stat[idx, col]
+        for index in idx[argsort(p_col, kind='mergesort')]:
+            if p_stat[index, col] >= critical_value:
+                continue
+
+            list_value = [taxa[index],
+                          round(sample[index, col], 6),
+                          round(population_mean[index, col], 6),
+                          round(ratio[index, col], 0),
+                          p_stat[index, col]]
+            if ratio[index, col] > 1:
+                high.append(list_value)
+            else:
+                low.append(list_value)
+        ranks.append((high, low))
+
+    return ranks
+
+
+def calculate_tax_rank_cohort(population, taxa, critical_value=0.05,
+                              exclude=None, columns=None):
+    """Preforms a case 1 t-test of each sample against the rest of a cohort
+
+    INPUTS:
+        population -- a numpy array containing taxonomic frequency values for
+                    the whole cohort. Samples are columns, taxa are rows.
+
+        taxa -- an array of greengenes ids associated the population
+                    frequencies
+
+        critical_value -- the alpha for use in the t-test
+
+        exclude -- a boolean numpy array with the same shape as population,
+                    which is True where a taxon should be left out of the
+                    test for a sample (e.g., the rare and unique taxa of the
+                    sample). DEFAULT: None
+
+        columns -- the column indices of the samples to test. If None, every
+                    sample is tested. DEFAULT: None
+
+    OUTPUTS:
+        ranks -- a list with a (high, low) tuple for each tested sample, where
+                    high and low are as returned by calculate_tax_rank_1 when
+                    the sample is compared to all other samples with its
+                    excluded taxa removed.
+
+    The leave-one-out mean and variance of every taxon are derived from the
+    cohort sums and sums of squares, so testing a sample costs O(taxa) rather
+    than rebuilding and testing a population per sample. P-values which tie
+    are ordered by taxon position."""
+
+    population = asarray(population, dtype=float)
+    (num_taxa, num_samples) = shape(population)
+
+    if num_taxa != len(taxa):
+        raise ValueError('The number of entries in samples and taxa must'
+                         ' be equal.')
+
+    if columns is None:
+        columns = arange(num_samples)
+    columns = asarray(columns, dtype=int)
+
+    if exclude is None:
+        exclude = zeros((num_taxa, len(columns)), dtype=bool)
+    else:
+        exclude = asarray(exclude, dtype=bool)[:, columns]
+
+    return _rank_samples(population[:, columns], taxa,
+                         cohort_statistics(population), exclude,
+                         critical_value)
+
+
+def calculate_tax_rank_table(table, rare_unique, critical_value=0.05,
+                             cohort=None):
+    """Tests samples in a biom table against the rest of the table
+
+    INPUTS:
+        table -- a biom table of taxonomy frequencies
+
+        rare_unique -- an iterable of (sample id, rare, unique) where rare and
+                    unique are lists of the rare and unique taxa of the sample,
+                    each a list of taxonomic levels. These taxa are excluded
+                    from the test for the sample.
+
+        critical_value -- the alpha for use in the t-test
+
+        cohort -- the cohort_statistics of the table. These are computed if
+                    None, and may be passed to test several sets of samples
+                    against the same table. DEFAULT: None
+
+    OUTPUTS:
+        ranks -- a dictionary keying each sample id to the (high, low) tuple
+                    from calculate_tax_rank_cohort
+
+    Only the columns of the tested samples are densified."""
+
+    rare_unique = list(rare_unique)
+    taxa = table.ids(axis='observation')
+    taxa_index = _observation_index(table)
+
+    if cohort is None:
+        cohort = cohort_statistics(table.matrix_data)
+
+    columns = [table.index(sample_id, axis='sample')
+               for sample_id, _, _ in rare_unique]
+    sample = asarray(table.matrix_data[:, columns].toarray(), dtype=float)
+
+    exclude = zeros((len(taxa), len(columns)), dtype=bool)
+    for col, (_, rare, unique) in enumerate(rare_unique):
+        for taxon in list(rare) + list(unique):
+            idx = taxa_index.get('; '.join(taxon))
+            if idx is not None:
+                exclude[idx, col] = True
+
+    ranks = _rank_samples(sample, taxa, cohort, exclude, critical_value)
+
+    return {sample_id: rank for (sample_id, _, _), rank
+            in zip(rare_unique, ranks)}
+
+
 def convert_taxa(rough_taxa, formatting_keys='%1.2f', hundredx=False):
     """Formats lists of numbers for table generation
     INPUTS:
@@ -515,3 +728,223 @@ def format_date(mapping, date_field=None, d_form_in=None, time_field=None,
     date = strftime(format_out, tmp)
 
     return date
+
+
+def sample_significance_macros(sample_id, high, rare, unique, abund_table,
+                               mapping=None):
+    """Creates the LaTeX macros describing the taxa in a single sample
+
+    INPUTS:
+        sample_id -- the sample to describe.
+
+        high -- the taxa enriched in the sample, as returned by
+                    calculate_tax_rank_cohort.
+
+        rare -- a list of the rare taxa in the sample, where each taxon is a
+                    list of taxonomic levels.
+
+        unique -- a list of the unique taxa in the sample, where each taxon
+                    is a list of taxonomic levels.
+
+        abund_table -- a biom table of taxonomy frequencies where taxa which
+                    are absent from every sample have been removed.
+
+        mapping -- a 2D dictionary of mapping data where the sample id is keyed
+                    to a dictionary of metadata.
+
+    OUTPUTS:
+        macros -- a string of LaTeX macros describing the most abundant taxa,
+                    the most enriched taxa, and rare and unique taxa in the
+                    sample.
+    """
+    # Sets up the way samples should be converted
+    SAMPLE_CONVERTER = {'feces': 'fecal',
+                        'oral_cavity': 'oral',
+                        'oral cavity': 'oral',
+                        'skin': 'skin'}
+
+    # Sets table constants
+    RENDERING = "LATEX"
+
+    SUM_MIN = 1
+
+    FORMAT_SIGNIFIGANCE = ['%1.2f', "%1.2f", "%i", "SKIP"]
+    SIGNIFIGANCE_HUNDRED = [True, True, False, False]
+    MACRO_CATS_SIGNIFICANCE = ['enrichTaxon', 'enrichSampl', 'enrichPopul',
+                               'enrichFold']
+    MACRO_FORM_SIGNIFICANCE = [lambda x: clean_greengenes_string(x,
+                               render_mode='LATEX'),
+                               lambda x: x,
+                               lambda x: x,
+                               lambda x: x]
+
+    DUMMY = ['', '', '', '']
+    COUNT = [0, 1, 2, 3, 4, 5, 6, 7]
+
+    FORMAT_ABUNDANCE = ["%1.1f"]
+    ABUNDANCE_HUNDRED = [True]
+    MACRO_CATS_ABUNDANCE = ['abundTaxon', 'abundSampl']
+    MACRO_FORM_ABUNDANCE = [lambda x: clean_greengenes_string(x,
+                            render_mode='LATEX'), lambda x: x]
+
+    DATE_FIELD = 'COLLECTION_DATE'
+    DATE_FORMAT_SHORT = '%m/%d/%y'
+    DATE_FORMAT_LONG = '%m/%d/%Y'
+
+    UNKNOWNS = set(['None', 'NONE', 'none', 'NA', 'na', 'UNKNOWN', 'unknown'])
+    DATE_OUT = '%B %d, %Y'
+    TIME_FIELD = 'COLLECTION_TIME'
+
+    # Number of taxa shown is an indexing value, it is one less than what is
+    # actually shown.
+    NUM_TAXA_SHOW = 5
+
+    # Gets sample information for the whole table
+    abund_sample = abund_table.data(sample_id)
+    abund_taxa = abund_table.ids(axis='observation')
+
+    # Converts the lists into greengenes strings for later processing
+    greengenes_rare = []
+    greengenes_unique = []
+    for taxon in rare:
+        greengenes_rare.append(';'.join(taxon))
+    for taxon in unique:
+        greengenes_unique.append(';'.join(taxon))
+
+    # Formats the rare and unique lists
+    rare_format = []
+    rare_combined = []
+    for taxon in greengenes_unique:
+        rare_combined.append(taxon)
+        rare_format.append('COLOR')
+    for taxon in greengenes_rare:
+        rare_combined.append(taxon)
+        rare_format.append('REG')
+
+    number_rare_tax = len(rare_combined)
+    num_rare = len(rare)
+    num_unique = len(unique)
+
+    rare_formatted = \
+        convert_taxa_to_list(rare_combined[0:NUM_TAXA_SHOW],
+                             tax_format=rare_format,
+                             render_mode=RENDERING,
+                             comma=True)
+
+    if num_unique > 0:
+        unique_string = ' and \\textcolor{red}{%i unique}' % num_unique
+    else:
+        unique_string = ''
+
+    if number_rare_tax == 0:
+        rare_formatted = "There were no rare or unique taxa found in "\
+            "your sample."
+
+    elif 0 < number_rare_tax <= NUM_TAXA_SHOW:
+        rare_formatted = 'Your sample contained the following rare%s '\
+            'taxa: %s.' % (unique_string, rare_formatted)
+
+    else:
+        rare_formatted = 'Your sample contained %i rare%s taxa, '\
+            'including the following: %s.' \
+            % (num_rare, unique_string,
+               rare_formatted)
+
+    # Calculates abundance rank
+    (abundance) = calculate_abundance(abund_sample, abund_taxa,
+                                      sum_min=SUM_MIN)
+
+    # Generates formatted abundance table
+    formatted_abundance = convert_taxa(abundance[0:NUM_TAXA_SHOW],
+                                       formatting_keys=FORMAT_ABUNDANCE,
+                                       hundredx=ABUNDANCE_HUNDRED)
+
+    abundance_formatted = \
+        build_latex_macro(formatted_abundance,
+                          categories=MACRO_CATS_ABUNDANCE,
+                          format=MACRO_FORM_ABUNDANCE)
+
+    if len(high) == 0:
+        formatted_high = [['', '', '', '']]*NUM_TAXA_SHOW
+
+    elif len(high) < NUM_TAXA_SHOW:
+        # Formats the known high taxa
+        formatted_high = \
+            convert_taxa(high[0:NUM_TAXA_SHOW],
+                         formatting_keys=FORMAT_SIGNIFIGANCE,
+                         hundredx=SIGNIFIGANCE_HUNDRED)
+
+        # Adds the dummy list to the end
+        for idx in COUNT:
+            if idx == (NUM_TAXA_SHOW - len(high)):
+                break
+            formatted_high.append(DUMMY)
+
+    else:
+        formatted_high = convert_taxa(high[0:NUM_TAXA_SHOW],
+                                      formatting_keys=FORMAT_SIGNIFIGANCE,
+                                      hundredx=SIGNIFIGANCE_HUNDRED)
+
+    high_formatted = build_latex_macro(formatted_high,
+                                       categories=MACRO_CATS_SIGNIFICANCE,
+                                       format=MACRO_FORM_SIGNIFICANCE)
+
+    # Handles date parsing
+    if mapping is not None and mapping[sample_id][DATE_FIELD] not in UNKNOWNS:
+        try:
+            sample_date = format_date(mapping[sample_id],
+                                      date_field=DATE_FIELD,
+                                      d_form_in=DATE_FORMAT_SHORT,
+                                      format_out=DATE_OUT)
+        except ValueError:
+            sample_date = format_date(mapping[sample_id],
+                                      date_field=DATE_FIELD,
+                                      d_form_in=DATE_FORMAT_LONG,
+                                      format_out=DATE_OUT)
+    else:
+        sample_date = 'unknown'
+
+    # Removes a zero character from the date
+    if ',' in sample_date and sample_date[sample_date.index(',')-2] == '0':
+        zero_pos = sample_date.index(',')-2
+        sample_date = ''.join([sample_date[:zero_pos],
+                               sample_date[zero_pos+1:]])
+
+    else:
+        sample_date = 'unknown'
+
+    # Handles sample parsing
+    if mapping is not None and mapping[sample_id][TIME_FIELD] not in UNKNOWNS:
+        sample_time = mapping[sample_id][TIME_FIELD].lower()
+    else:
+        sample_time = 'unknown'
+
+    if mapping is not None:
+        # habitats are ontology terms such as UBERON:feces, but unknown
+        # values are not
+        sample_type_prelim = \
+            mapping[sample_id]['BODY_HABITAT'].split(':')[-1]
+        if sample_type_prelim in SAMPLE_CONVERTER:
+            sample_type = SAMPLE_CONVERTER[sample_type_prelim]
+        elif sample_type_prelim in UNKNOWNS:
+            sample_type = 'unknown'
+            sample_time = 'unknown'
+        else:
+            sample_type = sample_type_prelim.lower()
+    else:
+        sample_type = 'unknown'
+
+    # Formats the macros
+    macros = []
+    macros.append('%% Barcode\n\\def\\barcode{%s}\n\n'
+                  % sample_id.split('.')[0])
+    macros.append('%% Sample Type\n\\def\\sampletype{%s}\n\n'
+                  % sample_type)
+    macros.append('%% Sample Date\n\\def\\sampledate{%s}\n'
+                  '\\def\\sampletime{%s}\n\n\n'
+                  % (sample_date, sample_time))
+    macros.append('%% Abundance Table\n%s\n\n\n' % abundance_formatted)
+    macros.append('%% Enrichment Table\n%s\n\n\n' % high_formatted)
+    macros.append('%% Rare List\n\\def\\rareList{%s}\n' % rare_formatted)
+
+    return ''.join(macros)
@@ -16,6 +16,9 @@ from matplotlib import rc
 from operator import itemgetter
 import colorbrewer
 
+from americangut.generate_otu_signifigance_tables import (
+    calculate_abundance, clean_greengenes_string)
+
 # Colors from www.ColorBrewer.org by Cynthia A. Brewer, Geography,
 #    Pennsylvania State University.
 # Copyright (c) 2002 Cynthia Brewer, Mark Harrower, and The Pennsylvania State
@@ -981,3 +984,277 @@ def render_barchart(
         plt.title(title, fontproperties=title_font)
 
     plt.savefig(file_out, format=filetype)
+
+
+def plot_sample_pie(tax_table, sample_id, file_out):
+    """Creates a pie chart of the most abundant taxa in a single sample
+
+    INPUTS:
+        tax_table -- a biom formatted taxonomy table at the desired level of
+                    resolution. Taxa which are absent from every sample are
+                    expected to have been removed.
+
+        sample_id -- the sample to plot.
+
+        file_out -- the file path where the pie chart should be saved.
+
+    OUTPUTS:
+        A pdf of the piechart summarizing the twelve most abundant taxa in the
+        sample is saved to file_out.
+    """
+    # Handles string cleaning
+    RENDER = 'LATEX'
+    UNCLASSIFIED = False
+    SUM_MIN = 1
+
+    # Sets up axis parameters
+    AXIS_LENGTH = 7.25
+    AXIS_BORDER = 0.01
+    AXIS_TITLE = 0
+    AXIS_LEGEND = 7
+    # Modifies the axis limits
+    AX_LIMS = [-1.05, 1.05]
+    # Sets up constants for getting the colormap and plotting
+    MAP_NAME = 'BrBG'
+    NUM_SHOW = 12
+    OTHER_COLOR = array([[85/255, 85/255, 85/255]])
+    # Sets up plotting parameters
+    FIG_LEGEND = True
+    FIG_COLOR_EDGE = False
+    FIG_LEG_FRAME = False
+    FIG_LEG_OFFSET = [0.95, 0.025, 1.0, 0.95]
+    # Sets up the the legend font
+    LEG_FONT = FontProperties()
+    LEG_FONT.set_size(28)
+    LEG_FONT.set_family('sans-serif')
+    # Sets the general font properties
+    use_latex = False
+    rc_font_family = 'sans-serif'
+    rc_font = ['Helvetica', 'Arial']
+
+    # Sets up the colormap
+    colormap = translate_colors((NUM_SHOW-1), MAP_NAME)
+    colormap = vstack((colormap, OTHER_COLOR))
+
+    # Sets up plotting constants
+    (axis_dims, fig_dims) = calculate_dimensions_rectangle(
+        axis_width=AXIS_LENGTH, axis_height=AXIS_LENGTH, border=AXIS_BORDER,
+        title=AXIS_TITLE, legend=AXIS_LEGEND)
+
+    sample_data = tax_table.data(sample_id)
+    taxa = tax_table.ids(axis='observation')
+
+    # Calculates abundance and limits to the top n samples.
+    abund_rank = calculate_abundance(sample=sample_data,
+                                     taxa=taxa,
+                                     sum_min=SUM_MIN)
+
+    abund_rank = abund_rank[:(NUM_SHOW-1)]
+
+    # Cleans the greengenes strings and adds an "Other" Category for
+    # missing taxa
+    [sample_tax, sample_freq] = [list(a) for a in zip(*abund_rank)]
+    clean_tax = [clean_greengenes_string(tax, RENDER,
+                                         unclassified=UNCLASSIFIED)
+                 for tax in sample_tax]
+    clean_tax.append('Other')
+    sample_freq.append(1-sum(sample_freq))
+
+    # Creates the pie chart
+    render_single_pie(data_vec=sample_freq,
+                      group_names=clean_tax,
+                      axis_dims=axis_dims,
+                      fig_dims=fig_dims,
+                      file_out=file_out,
+                      legend=FIG_LEGEND,
+                      colors=colormap,
+                      show_edge=FIG_COLOR_EDGE,
+                      legend_frame=FIG_LEG_FRAME,
+                      rc_font=rc_font,
+                      legend_offset=FIG_LEG_OFFSET,
+                      rc_fam=rc_font_family,
+                      legend_font=LEG_FONT,
+                      use_latex=use_latex,
+                      x_lims=AX_LIMS,
+                      y_lims=AX_LIMS)
+    plt.close()
+
+
+def summarize_barchart_population(otu_table, cat_tables, sample_type='fecal',
+                                  debug=False):
+    """Summarizes the population data shared by every per-sample bar chart
+
+    INPUTS:
+        otu_table -- an open OTU table
+
+        cat_tables -- a dictionary keying a mapping category to the
+                    corresponding biom table
+
+        sample_type -- the sample type: fecal, oral or skin.
+
+        debug -- ignore properly handling Michael Pollan's sample
+
+    OUTPUTS:
+        population -- a dictionary describing the summarized population which
+                    can be passed to plot_sample_barchart.
+    """
+    # Sets constants for analyzing the data
+    LEVEL = 2
+    CATEGORY = 'taxonomy'
+
+    # Common taxa are designated before processing to remain constant.
+    COMMON_TAXA = [(u'k__Bacteria', u'p__Firmicutes'),
+                   (u'k__Bacteria', u'p__Bacteroidetes'),
+                   (u'k__Bacteria', u'p__Proteobacteria'),
+                   (u'k__Bacteria', u'p__Actinobacteria'),
+                   (u'k__Bacteria', u'p__Verrucomicrobia'),
+                   (u'k__Bacteria', u'p__Tenericutes'),
+                   (u'k__Bacteria', u'p__Cyanobacteria'),
+                   (u'k__Bacteria', u'p__Fusobacteria')]
+
+    # Names categories being plotted
+    if sample_type == 'fecal':
+        michael_pollan = '10317.000007108'
+        cat_list = ['You', 'Average', 'Similar Diet', ' Similar BMI',
+                    'Same Gender', 'Similar Age', 'Michael Pollan']
+        order = ['Sample', 'Average', 'DIET_TYPE', 'BMI_CAT', 'SEX',
+                 'AGE_CAT', 'MP']
+
+    elif sample_type == 'skin':
+        michael_pollan = '10317.000007113'
+        cat_list = ['You', 'Average', 'Similar Cosmetic Use',
+                    'Same Dominant Hand', 'Same Gender', 'Same Age',
+                    'Michael Pollan']
+        order = ['Sample', 'Average', 'COSMETICS_FREQUENCY',
+                 'DOMINANT_HAND', 'SEX', 'AGE_CAT', 'MP']
+
+    elif sample_type == 'oral':
+        michael_pollan = '10317.000007109'
+        cat_list = ['You', 'Average', 'Similar Diet', 'Flossing Frequency',
+                    'Same Gender', 'Same Age', 'Michael Pollan']
+        order = ['Sample', 'Average', 'DIET_TYPE', 'FLOSSING_FREQUENCY',
+                 'SEX', 'AGE_CAT', 'MP']
+
+    else:
+        raise ValueError('%s is not a supported sample type.' % sample_type)
+
+    # Gets the category file dictionary summarized with the common categories
+    # Generates the category file dictionary
+    categories = parse_category_files(raw_tables=cat_tables,
+                                      common_groups=COMMON_TAXA[:8],
+                                      level=LEVEL,
+                                      metadata=CATEGORY)
+
+    # Summarizes taxonomy for the category
+    (whole_sample_ids, whole_summary, new_common_taxa) = \
+        summarize_common_categories(biom_table=otu_table,
+                                    level=LEVEL,
+                                    common_categories=COMMON_TAXA[:8],
+                                    metadata_category=CATEGORY)
+
+    # Converts final taxa to a clean list
+    common_phyla = []
+    for taxon in new_common_taxa:
+        common_phyla.append(taxon[1].strip(' p__').strip('[').strip(']'))
+
+    # Identifies Michael Pollan's pre-ABX sample
+    if debug:
+        mp_sample_pos = 2
+    else:
+        mp_sample_pos = whole_sample_ids.tolist().index(michael_pollan)
+
+    return {'sample_ids': whole_sample_ids,
+            'sample_index': {id_: idx for idx, id_ in
+                             enumerate(whole_sample_ids)},
+            'summary': whole_summary,
+            'average': mean(whole_summary, 1),
+            'mp_taxa': whole_summary[:, mp_sample_pos],
+            'categories': categories,
+            'common_phyla': common_phyla,
+            'cat_list': cat_list,
+            'order': order}
+
+
+def plot_sample_barchart(population, metadata, sample_id, file_out):
+    """Creates a stacked bar chart comparing a sample to its population
+
+    INPUTS:
+        population -- the summarized population from
+                    summarize_barchart_population
+
+        metadata -- a dictionary of metadata for the sample, keyed by
+                    mapping file category
+
+        sample_id -- the sample to plot
+
+        file_out -- the file path where the bar chart should be saved.
+
+    OUTPUTS:
+        A pdf of the stacked taxonomy for the sample, the population average,
+        similar groups and Michael Pollan is saved to file_out.
+    """
+    NUM_TAXA = 9
+    NUM_CATS_TO_PLOT = 7
+
+    # Sets up plotting constants
+    COLORMAP = array([[0.8353, 0.2421, 0.3098],
+                      [0.9569, 0.4275, 0.2627],
+                      [0.9922, 0.6824, 0.3804],
+                      [0.9961, 0.8784, 0.5351],
+                      [0.9020, 0.9608, 0.5961],
+                      [0.6706, 0.8667, 0.6431],
+                      [0.4000, 0.7608, 0.6471],
+                      [0.1961, 0.5333, 0.7412],
+                      [0.3333, 0.3333, 0.3333]])
+
+    FIG_DIMS = (4.44444, 3.33333)
+    AXIS_DIMS = array([[0.05, 0.05],
+                       [0.95, 0.95]])
+
+    SKIPSET = set(('Sample', 'Average', 'MP'))
+
+    if sample_id not in population['sample_index']:
+        raise ValueError('%s is not in the OTU table.' % sample_id)
+    sample_pos = population['sample_index'][sample_id]
+
+    # Prealocates a numpy array to hold the data
+    tax_array = zeros((NUM_TAXA, NUM_CATS_TO_PLOT))
+
+    # Adds preset values to the array so the first column is the sample
+    # the second column is the average and the last column is Michael
+    # Pollan
+    tax_array[:, 0] = population['summary'][:, sample_pos]
+    tax_array[:, 1] = population['average']
+    tax_array[:, -1] = population['mp_taxa']
+
+    # Adds the categories to the table in the listed order
+    for idx, cat in enumerate(population['order']):
+        # Skips over undesired categories
+        if cat in SKIPSET:
+            continue
+        # Gets the sample metadata
+        mapping_key = metadata[cat]
+        # Pulls taxonomic summary and group descriptions
+        tax_summary = population['categories'][cat]['Summary']
+        group_descriptions = population['categories'][cat]['Groups'].tolist()
+        # Appends plotting tables
+        try:
+            mapping_col = group_descriptions.index(mapping_key)
+        except ValueError:
+            raise ValueError('The %s cannot be found in %s.'
+                             % (mapping_key, cat))
+        tax_array[:, idx] = tax_summary[:, mapping_col]
+
+    # Plots the data
+    render_barchart(data_table=tax_array,
+                    x_axis=False,
+                    group_names=population['common_phyla'],
+                    legend=False,
+                    sample_names=population['cat_list'],
+                    y_axis=False,
+                    axis_dims=AXIS_DIMS,
+                    fig_dims=FIG_DIMS,
+                    file_out=file_out,
+                    show_edge=False,
+                    colors=COLORMAP)
+    plt.close()
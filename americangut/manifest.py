@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import sqlite3
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+# Workers may contend for the manifest, so be patient with locks
+_TIMEOUT = 600
+
+
+def _connect(manifest_fp):
+    """Open a manifest, creating it if necessary"""
+    con = sqlite3.connect(manifest_fp, timeout=_TIMEOUT)
+    con.execute("CREATE TABLE IF NOT EXISTS outputs ("
+                "sample_id TEXT NOT NULL, "
+                "function TEXT NOT NULL, "
+                "fingerprint TEXT NOT NULL, "
+                "outputs TEXT NOT NULL, "
+                "PRIMARY KEY (sample_id, function))")
+    return con
+
+
+def fingerprint(paths, options=()):
+    """Fingerprint the inputs to a processing function
+
+    Parameters
+    ----------
+    paths : Iterable of str
+        The input files or directories.
+    options : Iterable of str, optional
+        Any processing options which the outputs depend on.
+
+    Returns
+    -------
+    str or None
+        A digest of the path, size and modification time of each input, and of
+        the options. None is returned if an input does not exist.
+    """
+    state = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        state.append([path, st.st_size, st.st_mtime])
+
+    state.append([str(o) for o in options])
+    return hashlib.md5(json.dumps(state)).hexdigest()
+
+
+def sample_fingerprint(digest, state):
+    """Fingerprint the inputs to a processing function for one sample
+
+    Parameters
+    ----------
+    digest : str or None
+        The fingerprint of the inputs shared by all samples.
+    state : object or None
+        JSON serializable data of the sample which its outputs depend on,
+        such as its values in a table.
+
+    Returns
+    -------
+    str or None
+        A digest of both, or None if either is None.
+    """
+    if digest is None or state is None:
+        return None
+    return hashlib.md5(json.dumps([digest, state])).hexdigest()
+
+
+def current_ids(manifest_fp, function, digests):
+    """Determine which samples have up-to-date outputs
+
+    Parameters
+    ----------
+    manifest_fp : str
+        The path to the manifest.
+    function : str
+        The name of the processing function.
+    digests : dict
+        The current fingerprint of the function's inputs for each sample ID
+        to check, {str: str or None}.
+
+    Returns
+    -------
+    set of str
+        The sample IDs for which the function previously succeeded with the
+        same inputs, and whose recorded outputs all still exist.
+    """
+    if not os.path.exists(manifest_fp):
+        return set()
+
+    con = _connect(manifest_fp)
+    try:
+        rows = con.execute("SELECT sample_id, fingerprint, outputs "
+                           "FROM outputs WHERE function = ?",
+                           (function, )).fetchall()
+    finally:
+        con.close()
+
+    current = set()
+    for id_, digest, outputs in rows:
+        if digests.get(id_) == digest and all(os.path.exists(p)
+                                              for p in json.loads(outputs)):
+            current.add(id_)
+    return current
+
+
+def record(manifest_fp, function, digests, outputs):
+    """Record the outputs of a processing function
+
+    Parameters
+    ----------
+    manifest_fp : str
+        The path to the manifest.
+    function : str
+        The name of the processing function.
+    digests : dict
+        The fingerprint of the function's inputs for each sample ID,
+        {str: str or None}. Samples without a fingerprint are not recorded.
+    outputs : dict
+        The output paths produced for each sample, {str: list of str}.
+    """
+    rows = [(id_, function, digests[id_], json.dumps(paths))
+            for id_, paths in outputs.items()
+            if digests.get(id_) is not None]
+    if not rows:
+        return
+
+    con = _connect(manifest_fp)
+    try:
+        with con:
+            con.executemany("INSERT OR REPLACE INTO outputs "
+                            "(sample_id, function, fingerprint, outputs) "
+                            "VALUES (?, ?, ?, ?)", rows)
+    finally:
+        con.close()
+
+
+def forget(manifest_fp, ids):
+    """Remove all records for a set of samples
+
+    Parameters
+    ----------
+    manifest_fp : str
+        The path to the manifest.
+    ids : Iterable of str
+        The sample IDs to forget, forcing them to be reprocessed.
+    """
+    if not os.path.exists(manifest_fp):
+        return
+
+    con = _connect(manifest_fp)
+    try:
+        with con:
+            con.executemany("DELETE FROM outputs WHERE sample_id = ?",
+                            [(id_, ) for id_ in ids])
+    finally:
+        con.close()
@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+# Bumped whenever the layout of the sidecar changes, so stale sidecars are
+# rebuilt rather than misread
+_SIDECAR_VERSION = 3
+
+
+class Metadata(object):
+    """The contents of a QIIME mapping file, held by column
+
+    Each column is encoded as its distinct values, the categories, and the
+    position in the categories of the value of each sample.
+
+    Parameters
+    ----------
+    id_column : str
+        The name of the sample ID column, such as '#SampleID'.
+    columns : list of str
+        The metadata categories, in file order.
+    sample_ids : np.ndarray of str
+        The sample IDs, in file order.
+    codes : np.ndarray of int
+        (n_columns, n_samples) positions in the categories of each value.
+    categories : list of np.ndarray of str
+        The distinct values of each column.
+    comments : list of str
+        Any comment lines following the header, without the leading '#'.
+    """
+    __slots__ = ('id_column', 'columns', 'sample_ids', 'codes', 'categories',
+                 'comments', '_index', '_column_index')
+
+    def __init__(self, id_column, columns, sample_ids, codes, categories,
+                 comments):
+        self.id_column = id_column
+        self.columns = columns
+        self.sample_ids = sample_ids
+        self.codes = codes
+        self.categories = categories
+        self.comments = comments
+        self._index = None
+        self._column_index = {c: i for i, c in enumerate(columns)}
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Parse a mapping file
+
+        Parameters
+        ----------
+        lines : Iterable of str
+            The lines of the mapping file. The first non-blank line is the
+            header. Later lines starting with '#' are comments, and blank
+            lines are ignored. Whitespace is stripped from the ends of each
+            line, as str.strip would, but empty trailing fields are kept.
+
+        Returns
+        -------
+        Metadata
+            The parsed mapping file.
+
+        Raises
+        ------
+        ValueError
+            If there is no header, or if a sample does not have a value for
+            each column.
+        """
+        header = None
+        comments = []
+        rows = []
+        for line in lines:
+            stripped = line.strip()
+            if not stripped:
+                continue
+
+            if header is None:
+                header = _split_fields(line)
+            elif stripped.startswith('#'):
+                comments.append(stripped[1:])
+            else:
+                rows.append(_split_fields(line))
+
+        if header is None:
+            raise ValueError("Error in mapping file - no header")
+
+        n_fields = len(header)
+        for row in rows:
+            if len(row) != n_fields:
+                raise ValueError("Error in mapping file - "
+                                 "number of metadata values does not "
+                                 "match the number of metadata categories")
+
+        fields = zip(*rows) if rows else [()] * n_fields
+        encoded = [pd.factorize(np.asarray(values, dtype=object))
+                   for values in fields[1:]]
+
+        # most columns have few distinct values, so the codes are stored in
+        # the narrowest type that holds them all
+        n_categories = max([len(u) for _, u in encoded] or [0])
+        codes = np.empty((n_fields - 1, len(rows)),
+                         dtype=np.min_scalar_type(n_categories))
+        categories = []
+        for i, (column_codes, uniques) in enumerate(encoded):
+            codes[i] = column_codes
+            categories.append(np.asarray(uniques, dtype=object))
+
+        return cls(header[0], header[1:], np.asarray(fields[0], dtype=object),
+                   codes, categories, comments)
+
+    @staticmethod
+    def sidecar_path(path):
+        """Get where the encoded form of a mapping file is cached"""
+        return path + '.mdc'
+
+    def save(self, sidecar, size, mtime):
+        """Write the encoded form of a mapping file
+
+        Parameters
+        ----------
+        sidecar : str
+            The path to write to.
+        size : int
+            The size of the mapping file which was encoded.
+        mtime : float
+            The modification time of the mapping file which was encoded.
+        """
+        offsets = np.cumsum([0] + [len(c) for c in self.categories])
+        values = [v for c in self.categories for v in c]
+
+        header_blob, header_ends = _pack([self.id_column] + self.columns)
+        ids_blob, ids_ends = _pack(self.sample_ids)
+        values_blob, values_ends = _pack(values)
+        comments_blob, comments_ends = _pack(self.comments)
+
+        with open(sidecar, 'wb') as fp:
+            np.savez_compressed(fp,
+                                key=np.array([_SIDECAR_VERSION, size, mtime],
+                                             dtype=np.float64),
+                                header=header_blob,
+                                header_ends=header_ends,
+                                sample_ids=ids_blob,
+                                sample_ids_ends=ids_ends,
+                                codes=self.codes,
+                                offsets=offsets,
+                                values=values_blob,
+                                values_ends=values_ends,
+                                comments=comments_blob,
+                                comments_ends=comments_ends)
+
+    @classmethod
+    def load_sidecar(cls, sidecar, size, mtime):
+        """Read the encoded form of a mapping file
+
+        Parameters
+        ----------
+        sidecar : str
+            The path to read from.
+        size : int
+            The current size of the mapping file.
+        mtime : float
+            The current modification time of the mapping file.
+
+        Returns
+        -------
+        Metadata or None
+            The metadata, or None if the sidecar is missing, unreadable or
+            was written for a different version of the mapping file.
+        """
+        try:
+            data = np.load(sidecar)
+        except (IOError, ValueError, zipfile.BadZipfile):
+            return None
+
+        try:
+            key = data['key']
+            if tuple(key) != (_SIDECAR_VERSION, size, mtime):
+                return None
+
+            header = _unpack(data['header'], data['header_ends'])
+            offsets = data['offsets']
+            values = _unpack(data['values'], data['values_ends'])
+            categories = [values[start:end]
+                          for start, end in zip(offsets[:-1], offsets[1:])]
+            sample_ids = _unpack(data['sample_ids'], data['sample_ids_ends'])
+            comments = _unpack(data['comments'], data['comments_ends'])
+            return cls(header[0], header[1:].tolist(), sample_ids,
+                       data['codes'], categories, comments.tolist())
+        except (KeyError, ValueError, IndexError, zipfile.BadZipfile):
+            return None
+        finally:
+            data.close()
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.index
+
+    def __getitem__(self, sample_id):
+        return self.row(sample_id)
+
+    @property
+    def index(self):
+        """{sample_id: int} of the position of each sample"""
+        if self._index is None:
+            self._index = {id_: i for i, id_ in enumerate(self.sample_ids)}
+        return self._index
+
+    def positions(self, sample_ids):
+        """Get the positions of samples
+
+        Raises
+        ------
+        KeyError
+            If a sample is not present.
+        """
+        index = self.index
+        return np.array([index[id_] for id_ in sample_ids], dtype=np.intp)
+
+    def column_codes(self, column):
+        """Get the encoded form of a column
+
+        Returns
+        -------
+        np.ndarray of int
+            The position in the categories of the value of each sample.
+        np.ndarray of str
+            The categories.
+
+        Raises
+        ------
+        KeyError
+            If the column is not present.
+        """
+        i = self._column_index[column]
+        return self.codes[i], self.categories[i]
+
+    def column(self, column, sample_ids=None):
+        """Get the values of a column
+
+        Parameters
+        ----------
+        column : str
+            The metadata category.
+        sample_ids : Iterable of str, optional
+            The samples to get values for. By default all samples, in file
+            order.
+
+        Returns
+        -------
+        np.ndarray of str
+            The values.
+
+        Raises
+        ------
+        KeyError
+            If the column or a sample is not present.
+        """
+        codes, categories = self.column_codes(column)
+        if sample_ids is not None:
+            codes = codes[self.positions(sample_ids)]
+        return categories[codes]
+
+    def row(self, sample_id):
+        """Get the metadata of a sample as {column: value}
+
+        Raises
+        ------
+        KeyError
+            If the sample is not present.
+        """
+        codes = self.codes[:, self.index[sample_id]]
+        return {c: cats[code] for c, cats, code in
+                zip(self.columns, self.categories, codes)}
+
+    def mask(self, criteria=None, _terms=None):
+        """Find the samples which meet criteria
+
+        Parameters
+        ----------
+        criteria : dict, optional
+            {column: value} that samples must have. A value may instead be a
+            list, tuple or set of acceptable values. By default all samples
+            are selected.
+
+        Returns
+        -------
+        np.ndarray of bool
+            Whether each sample, in file order, meets all of the criteria.
+
+        Raises
+        ------
+        KeyError
+            If a column is not present.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, values in (criteria or {}).items():
+            if isinstance(values, (list, tuple, set, frozenset)):
+                values = frozenset(values)
+            else:
+                values = frozenset([values])
+
+            key = (column, values)
+            if _terms is not None and key in _terms:
+                term = _terms[key]
+            else:
+                # test each category once, then look the samples up by code
+                codes, categories = self.column_codes(column)
+                term = np.in1d(categories, list(values))[codes]
+                if _terms is not None:
+                    _terms[key] = term
+            mask &= term
+        return mask
+
+    def count(self, criteria=None, unique=None, by=None, _terms=None):
+        """Count the samples which meet criteria
+
+        Parameters
+        ----------
+        criteria : dict, optional
+            The criteria samples must meet, as for mask.
+        unique : str, optional
+            Count the distinct values of this column, such as
+            HOST_SUBJECT_ID, rather than samples.
+        by : str, optional
+            Count separately for each value of this column.
+
+        Returns
+        -------
+        int or dict
+            The count or, if `by` is given, {value: int} of the nonzero count
+            of each value.
+
+        Raises
+        ------
+        KeyError
+            If a column is not present.
+        """
+        mask = self.mask(criteria, _terms)
+
+        if by is None:
+            if unique is None:
+                return int(mask.sum())
+            codes, _ = self.column_codes(unique)
+            return int(np.unique(codes[mask]).size)
+
+        by_codes, by_categories = self.column_codes(by)
+        by_codes = by_codes[mask].astype(np.int64)
+        if unique is not None:
+            codes, categories = self.column_codes(unique)
+            # count each distinct (group, value) pair once
+            pairs = np.unique(by_codes * len(categories) + codes[mask])
+            by_codes = pairs // len(categories)
+
+        counts = np.bincount(by_codes, minlength=len(by_categories))
+        return {by_categories[i]: int(counts[i]) for i in counts.nonzero()[0]}
+
+    def _values(self):
+        """Get the decoded values as a (n_samples, n_columns) array"""
+        values = np.empty(self.codes.shape, dtype=object)
+        for i, categories in enumerate(self.categories):
+            values[i] = categories[self.codes[i]]
+        return values.T
+
+    def to_rows(self):
+        """Get the values of each sample, in file order, excluding the ID"""
+        return self._values().tolist()
+
+    def to_dict(self, include_id=False):
+        """Get the metadata as {sample_id: {column: value}}
+
+        Parameters
+        ----------
+        include_id : bool, optional
+            Whether to include the sample ID in the metadata of each sample,
+            under the name of the ID column.
+        """
+        columns = self.columns
+        if include_id:
+            columns = [self.id_column] + columns
+
+        result = {}
+        for id_, values in zip(self.sample_ids, self.to_rows()):
+            if include_id:
+                values.insert(0, id_)
+            result[id_] = dict(zip(columns, values))
+        return result
+
+    def to_frame(self):
+        """Get the metadata as strings in a DataFrame indexed by sample ID"""
+        frame = pd.DataFrame(self._values(), columns=self.columns,
+                             index=pd.Index(self.sample_ids,
+                                            name=self.id_column))
+        return frame
+
+
+def query(md, questions):
+    """Answer a batch of counting questions about a mapping file
+
+    Criteria shared between questions, such as a body site, are evaluated
+    once for the whole batch.
+
+    Parameters
+    ----------
+    md : Metadata
+        The metadata to query.
+    questions : dict
+        {name: dict} of the questions to answer. Each question is a dict of
+        the keyword arguments to Metadata.count: any of 'criteria', 'unique'
+        and 'by'.
+
+    Returns
+    -------
+    dict
+        {name: int or dict} of the answer to each question.
+
+    Raises
+    ------
+    KeyError
+        If a column is not present.
+
+    Examples
+    --------
+    >>> from StringIO import StringIO
+    >>> md = Metadata.from_lines(StringIO(
+    ...     '#SampleID\\tSITE\\tHOST_SUBJECT_ID\\n'
+    ...     'a\\tfeces\\tx\\n'
+    ...     'b\\tfeces\\tx\\n'
+    ...     'c\\tskin\\ty\\n'))
+    >>> answers = query(md, {
+    ...     'fecal': {'criteria': {'SITE': 'feces'}},
+    ...     'fecal_participants': {'criteria': {'SITE': 'feces'},
+    ...                            'unique': 'HOST_SUBJECT_ID'},
+    ...     'per_site': {'by': 'SITE'}})
+    >>> answers['fecal'], answers['fecal_participants']
+    (2, 1)
+    >>> sorted(answers['per_site'].items())
+    [('feces', 2), ('skin', 1)]
+    """
+    terms = {}
+    return {name: md.count(_terms=terms, **question)
+            for name, question in questions.items()}
+
+
+def _split_fields(line):
+    """Split a line at tabs, stripping whitespace from the ends of the line
+
+    Unlike splitting line.strip(), a trailing tab still separates an empty
+    value.
+    """
+    fields = line.rstrip('\r\n').split('\t')
+    fields[0] = fields[0].lstrip()
+    fields[-1] = fields[-1].rstrip()
+    return fields
+
+
+def _pack(values):
+    """Get strings as one byte array which can be stored without pickle
+
+    Returns
+    -------
+    np.ndarray of uint8
+        The strings joined together.
+    np.ndarray of int
+        The end of each string in the joined bytes.
+    """
+    values = [str(v) for v in values]
+    ends = np.cumsum([len(v) for v in values], dtype=np.int64)
+    return np.frombuffer(''.join(values), dtype=np.uint8), ends
+
+
+def _unpack(blob, ends):
+    """Get the strings of a byte array written by _pack"""
+    blob = blob.tostring()
+    starts = np.concatenate([[0], ends[:-1]]).astype(np.int64)
+    values = np.empty(len(ends), dtype=object)
+    values[:] = [blob[start:end] for start, end in zip(starts, ends)]
+    return values
+
+
+def load(path, cache=True):
+    """Load a mapping file, using its sidecar if it is current
+
+    Parameters
+    ----------
+    path : str
+        The path to the mapping file.
+    cache : bool, optional
+        Whether to write a sidecar if the current one is missing or stale.
+        Failure to write the sidecar, such as to a read-only directory, is
+        not an error.
+
+    Returns
+    -------
+    Metadata
+        The parsed mapping file.
+    """
+    st = os.stat(path)
+    sidecar = Metadata.sidecar_path(path)
+
+    md = Metadata.load_sidecar(sidecar, st.st_size, st.st_mtime)
+    if md is not None:
+        return md
+
+    with open(path, 'U') as fp:
+        md = Metadata.from_lines(fp)
+
+    if cache:
+        tmp = '%s.%d.tmp' % (sidecar, os.getpid())
+        try:
+            md.save(tmp, st.st_size, st.st_mtime)
+            os.rename(tmp, sidecar)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    return md
@@ -769,6 +769,8 @@ paths = {
         'statics-fecal': '09-per-sample/statics-fecal',
         'statics-oral': '09-per-sample/statics-oral',
         'statics-skin': '09-per-sample/statics-skin',
+        'manifest': '09-per-sample/manifest.sqlite',
+        'profile': '09-per-sample/profile.txt',
     },
 
     'populated-templates': {
@@ -2184,6 +2186,22 @@ def get_cpu_count():
         return multiprocessing.cpu_count()
 
 
+def is_profiling_enabled():
+    """Whether to profile the per-sample processing functions
+
+    Returns
+    -------
+    bool
+        True if $AG_PROFILE == 'True'.
+
+    Notes
+    -----
+    Profiling records the wall time, CPU time and peak RSS growth of every
+    processing function call. See `americangut.parallel.profile_call`.
+    """
+    return os.environ.get('AG_PROFILE') == 'True'
+
+
 def get_hmp():
     """Get the HMP 100nt table and mapping"""
     return _get_data('HMP', 'HMPv35_100nt')
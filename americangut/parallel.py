@@ -1,17 +1,287 @@
+from __future__ import division
+
 import multiprocessing as mp
 import logging
+import mmap
+import os
+import resource
 import traceback
 import sys
-from functools import partial
+import time
 
 import matplotlib
 matplotlib.use('Agg')  # noqa
 
+import biom
+import numpy as np
+from skbio import DistanceMatrix
+from skbio.stats.ordination import OrdinationResults
+
 import americangut as ag
-import americangut.results_utils as agru
 import americangut.notebook_environment as agenv
 
 
+# Artifacts loaded by the parent process prior to forking the worker pool.
+# Keyed by (loader, path).
+_ARTIFACTS = {}
+
+
+def _shared_array(array):
+    """Copy an array into read-only anonymous shared memory
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The array to copy.
+
+    Returns
+    -------
+    np.ndarray
+        A read-only array of the same dtype and shape backed by a shared
+        memory map. Forked processes see the same physical pages.
+    """
+    array = np.ascontiguousarray(array)
+    buf = mmap.mmap(-1, max(array.nbytes, 1))
+    shared = np.frombuffer(buf, dtype=array.dtype, count=array.size)
+    shared = shared.reshape(array.shape)
+    shared[...] = array
+    shared.flags.writeable = False
+    return shared
+
+
+class _SharedTable(biom.Table):
+    """A BIOM table whose matrix is held in shared memory
+
+    biom converts the matrix of a table in place to access it along the other
+    axis, which in a worker would replace the shared matrix with a private
+    copy. The matrix is instead shared as both CSC, for the per-sample access
+    common in the workers, and CSR, which rows are read from, and is never
+    converted. Copies are ordinary private tables.
+    """
+    # The shared CSC and CSR matrices. Set by _share.
+    _shared = (None, None)
+
+    def _get_row(self, row_idx):
+        csc, csr = self._shared
+        if self._data is not csc:
+            return super(_SharedTable, self)._get_row(row_idx)
+        return csr.getrow(row_idx)
+
+    def __eq__(self, other):
+        # biom requires the other table to be of the class of this one
+        if isinstance(other, biom.Table) and \
+                not isinstance(other, _SharedTable):
+            return biom.Table.__eq__(other, self)
+        return super(_SharedTable, self).__eq__(other)
+
+    def _data_equality(self, other):
+        csc, csr = self._shared
+        if self._data is not csc:
+            return super(_SharedTable, self)._data_equality(other)
+        return (csr.shape == other.shape and csr.dtype == other.dtype and
+                csr.nnz == other.nnz and (csr != other.tocsr()).nnz == 0)
+
+    def copy(self):
+        table = super(_SharedTable, self).copy()
+        table.__class__ = biom.Table
+        return table
+
+
+def _shared_sparse(matrix):
+    """Copy a CSC or CSR matrix into shared memory"""
+    return matrix.__class__((_shared_array(matrix.data),
+                             _shared_array(matrix.indices),
+                             _shared_array(matrix.indptr)),
+                            shape=matrix.shape, copy=False)
+
+
+def _share(obj):
+    """Move the bulk numeric data of an artifact into shared memory
+
+    BIOM tables are shared as a _SharedTable. Ordination coordinates,
+    distance matrix data and arrays are copied as is, and tuples are shared
+    item by item. Other objects are returned unchanged, and are inherited by
+    the workers copy-on-write.
+    """
+    if isinstance(obj, biom.Table):
+        matrix = obj.matrix_data
+        obj.__class__ = _SharedTable
+        obj._shared = (_shared_sparse(matrix.tocsc()),
+                       _shared_sparse(matrix.tocsr()))
+        obj._data = obj._shared[0]
+    elif isinstance(obj, OrdinationResults):
+        obj.site = _shared_array(obj.site)
+    elif isinstance(obj, DistanceMatrix):
+        obj._data = _shared_array(obj._data)
+    elif isinstance(obj, np.ndarray):
+        obj = _shared_array(obj)
+    elif isinstance(obj, tuple):
+        obj = tuple(_share(item) for item in obj)
+    return obj
+
+
+def publish_artifacts(artifacts):
+    """Load artifacts once so that forked workers can share them
+
+    Parameters
+    ----------
+    artifacts : Iterable of (function, str)
+        The loader and path of each artifact. A loader is expected to have
+        the signature ``object <- f(str)``.
+
+    Returns
+    -------
+    list of (function, str)
+        The artifacts which could not be loaded. These are left for the
+        workers to load, and to report on, as they normally would.
+
+    Notes
+    -----
+    This must be called prior to the creation of the worker pool.
+    """
+    unavailable = []
+    for loader, path in artifacts:
+        key = (loader, path)
+        if key in _ARTIFACTS:
+            continue
+
+        try:
+            _ARTIFACTS[key] = _share(loader(path))
+        except Exception:
+            unavailable.append(key)
+
+    return unavailable
+
+
+def get_artifact(loader, path):
+    """Get a published artifact, or load it if it was not published
+
+    Parameters
+    ----------
+    loader : function
+        The function to load the artifact with, ``object <- f(str)``.
+    path : str
+        The path to the artifact.
+
+    Returns
+    -------
+    object
+        The loaded artifact. Published artifacts are shared and must be
+        treated as read-only.
+    """
+    key = (loader, path)
+    if key in _ARTIFACTS:
+        return _ARTIFACTS[key]
+    return loader(path)
+
+
+def clear_artifacts():
+    """Release all published artifacts"""
+    _ARTIFACTS.clear()
+
+
+# Profiling records collected in this process. See profile_call.
+_PROFILE_RECORDS = []
+
+_PROFILE_FIELDS = ['function', 'sample_type', 'samples', 'wall_seconds',
+                   'cpu_seconds', 'max_rss_delta_kb', 'pid']
+
+
+def _cpu_seconds():
+    """Get the CPU time used by this process and its finished children"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def profile_call(name, sample_type, ids, func, *args, **kwargs):
+    """Call a function and record its resource usage
+
+    Parameters
+    ----------
+    name : str
+        The name to record the call under.
+    sample_type : str or None
+        The sample type being processed.
+    ids : list of str
+        The sample IDs being processed.
+    func : function
+        The function to call.
+    *args, **kwargs
+        The arguments to the function.
+
+    Returns
+    -------
+    object
+        The result of the function.
+
+    Notes
+    -----
+    The peak RSS delta is the growth in the high water mark of the resident
+    set size of this process in kilobytes, and is zero if the call did not
+    exceed a previous peak.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu = _cpu_seconds()
+    start = time.time()
+
+    result = func(*args, **kwargs)
+
+    _PROFILE_RECORDS.append(
+        {'function': name,
+         'sample_type': sample_type,
+         'samples': len(ids),
+         'wall_seconds': time.time() - start,
+         'cpu_seconds': _cpu_seconds() - cpu,
+         'max_rss_delta_kb':
+             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+         'pid': os.getpid()})
+
+    return result
+
+
+def write_profile(records, fp):
+    """Write profiling records
+
+    Parameters
+    ----------
+    records : list of dict
+        The records from `profile_call`.
+    fp : file-like object
+        A file-like object to write a tab delimited report too. The report
+        has one line per processing function and sample type, with the total
+        and per sample wall and CPU time, and the largest peak RSS delta of a
+        single call, ordered by total wall time.
+    """
+    summary = {}
+    for record in records:
+        key = (record['function'], record['sample_type'])
+        if key not in summary:
+            summary[key] = {'calls': 0, 'samples': 0, 'wall': 0.0,
+                            'cpu': 0.0, 'rss': 0}
+        entry = summary[key]
+        entry['calls'] += 1
+        entry['samples'] += record['samples']
+        entry['wall'] += record['wall_seconds']
+        entry['cpu'] += record['cpu_seconds']
+        entry['rss'] = max(entry['rss'], record['max_rss_delta_kb'])
+
+    fp.write('\t'.join(['#function', 'sample_type', 'calls', 'samples',
+                        'wall_seconds', 'cpu_seconds', 'wall_per_sample',
+                        'cpu_per_sample', 'max_rss_delta_kb']))
+    fp.write('\n')
+
+    ordered = sorted(summary.items(), key=lambda item: -item[1]['wall'])
+    for (function, sample_type), entry in ordered:
+        samples = max(entry['samples'], 1)
+        fp.write('%s\t%s\t%d\t%d\t%.3f\t%.3f\t%.4f\t%.4f\t%d\n'
+                 % (function, sample_type, entry['calls'], entry['samples'],
+                    entry['wall'], entry['cpu'], entry['wall'] / samples,
+                    entry['cpu'] / samples, entry['rss']))
+
+
 def run_functor(functor, *args, **kwargs):
     """
     Given a functor, run it and return its result. We can use this with
@@ -30,9 +300,153 @@ def run_functor(functor, *args, **kwargs):
         raise Exception("".join(traceback.format_exception(*sys.exc_info())))
 
 
-def dispatcher(success_fp, fail_fp, partitions):
+def _run_chunk(job):
+    """Execute a processing function over a chunk of IDs
+
+    Parameters
+    ----------
+    job : (function, list of str)
+        The function and the IDs to operate on.
+
+    Returns
+    -------
+    dict
+        The processing function's result.
+    float
+        The wall time in seconds taken by the function.
+    list of dict
+        Any profiling records collected while running the function.
+    """
+    func, ids = job
+    del _PROFILE_RECORDS[:]
+    start = time.time()
+    result = run_functor(func, ids)
+    return result, time.time() - start, list(_PROFILE_RECORDS)
+
+
+def partition_states(partitions):
+    """Set up the scheduling state of each partition
+
+    Parameters
+    ----------
+    partitions : Iterable of (function, Iterable of str)
+        Yields a function and an iterable of IDs.
+
+    Returns
+    -------
+    list of dict
+        The function, the IDs, the offset of the next ID to schedule, and the
+        number of samples and seconds observed for each partition.
+    """
+    return [{'func': func, 'ids': list(ids), 'offset': 0, 'samples': 0,
+             'seconds': 0.0} for func, ids in partitions]
+
+
+def next_chunk(states, target_seconds=60.0, initial_size=25,
+               max_size=250):
+    """Select the next chunk of IDs to process
+
+    Parameters
+    ----------
+    states : list of dict
+        The partition states from `partition_states`. The offset of the
+        selected partition is advanced.
+    target_seconds : float, optional
+        The desired wall time of a chunk.
+    initial_size : int, optional
+        The chunk size used before the cost of a partition has been observed.
+    max_size : int, optional
+        The largest chunk size allowed.
+
+    Returns
+    -------
+    dict or None
+        The state of the partition the chunk is from, or None if every ID has
+        been scheduled.
+    list of str or None
+        The IDs in the chunk.
+
+    Notes
+    -----
+    A partition which has not been started is probed with a chunk of
+    `initial_size` before anything else. Otherwise, the partition with the
+    largest estimated remaining cost is selected, so expensive partitions are
+    worked on first and cheap ones fill in at the end, and its chunk is sized
+    by its observed cost per sample to take roughly `target_seconds`.
+    """
+    pending = [s for s in states if s['offset'] < len(s['ids'])]
+    if not pending:
+        return None, None
+
+    observed = [s['seconds'] / s['samples'] for s in states if s['samples']]
+    default_cost = sum(observed) / len(observed) if observed else 1.0
+
+    def per_sample(state):
+        if state['samples']:
+            return state['seconds'] / state['samples']
+        return default_cost
+
+    def remaining_cost(state):
+        return (len(state['ids']) - state['offset']) * per_sample(state)
+
+    unstarted = [s for s in pending if s['offset'] == 0]
+    if unstarted:
+        state = unstarted[0]
+        size = initial_size
+    else:
+        state = max(pending, key=remaining_cost)
+        if state['samples']:
+            cost = max(per_sample(state), 1e-6)
+            size = int(min(max(target_seconds / cost, 1), max_size))
+        else:
+            size = initial_size
+
+    start = state['offset']
+    state['offset'] = min(start + size, len(state['ids']))
+    return state, state['ids'][start:state['offset']]
+
+
+def format_progress(completed, total, elapsed):
+    """Format a progress line
+
+    Parameters
+    ----------
+    completed : int
+        The number of samples processed.
+    total : int
+        The total number of samples to process.
+    elapsed : float
+        The number of seconds elapsed.
+
+    Returns
+    -------
+    str
+        The number of samples processed, the throughput and the estimated
+        time remaining.
+    """
+    rate = completed / elapsed if elapsed > 0 else 0.0
+    if rate > 0:
+        remaining = int(round((total - completed) / rate))
+        minutes, seconds = divmod(remaining, 60)
+        hours, minutes = divmod(minutes, 60)
+        eta = '%d:%02d:%02d' % (hours, minutes, seconds)
+    else:
+        eta = 'unknown'
+
+    return '%d/%d samples (%.2f samples/s, ETA %s)' % (completed, total,
+                                                       rate, eta)
+
+
+def dispatcher(success_fp, fail_fp, partitions, artifacts=None,
+               progress_fp=None, target_seconds=60.0, profile_fp=None):
     """Dispatch execution over a pool of processors
 
+    Chunks of IDs from all of the partitions are scheduled onto the pool as
+    workers become available, and the results of each chunk are written as
+    soon as the chunk completes. The chunk size of each partition adapts to
+    its observed cost per sample, and the partitions with the most estimated
+    work remaining are scheduled first. See `next_chunk`.
+
     Parameters
     ----------
     success_fp : file-like object
@@ -45,21 +459,91 @@ def dispatcher(success_fp, fail_fp, partitions):
         functions yielded will have the following signature:
 
         {str: list} <- function(list of str)
+    artifacts : Iterable of (function, str), optional
+        Artifacts to load once in this process, prior to forking the workers,
+        so that every worker shares a single copy of them rather than
+        reloading them for every chunk of IDs. See `publish_artifacts`.
+    progress_fp : file-like object, optional
+        If provided, a line describing the throughput and the estimated time
+        remaining is written to it after every chunk.
+    target_seconds : float, optional
+        The desired wall time of each chunk.
+    profile_fp : file-like object, optional
+        If provided, the profiling records collected by the workers are
+        merged and written to it. Records are only collected if profiling is
+        enabled, see `americangut.notebook_environment.is_profiling_enabled`.
     """
     if ag.is_test_env():
         logger = mp.log_to_stderr()
         logger.setLevel(logging.INFO)
 
-    pool = mp.Pool(processes=agenv.get_cpu_count())
+    states = partition_states(partitions)
+    total = sum(len(s['ids']) for s in states)
+
+    if artifacts is not None:
+        publish_artifacts(artifacts)
+
+    processes = agenv.get_cpu_count()
+    pool = mp.Pool(processes=processes)
 
     success_fp.write('%s\n' % '#SampleID')
     fail_fp.write('%s\t%s\n' % ('#SampleID', 'Error(s)'))
 
-    for func, ids in partitions:
-        functor = partial(run_functor, func)
-        for success_details in pool.map(functor, list(agru.chunk_list(ids))):
+    start = time.time()
+    completed = 0
+    profile = []
+
+    # keep a chunk queued behind each running chunk so workers do not idle
+    max_in_flight = 2 * processes
+    in_flight = []
+    while True:
+        while len(in_flight) < max_in_flight:
+            state, ids = next_chunk(states, target_seconds)
+            if state is None:
+                break
+            job = pool.apply_async(_run_chunk, ((state['func'], ids), ))
+            in_flight.append((state, ids, job))
+
+        if not in_flight:
+            break
+
+        finished = [item for item in in_flight if item[2].ready()]
+        if not finished:
+            in_flight[0][2].wait(0.1)
+            continue
+
+        for item in finished:
+            in_flight.remove(item)
+            state, ids, job = item
+            success_details, seconds, records = job.get()
+            profile.extend(records)
+
+            state['samples'] += len(ids)
+            state['seconds'] += seconds
+
             for id_, detail in success_details.items():
                 if detail:
                     fail_fp.write("%s\t%s\n" % (id_, '\t'.join(detail)))
                 else:
                     success_fp.write("%s\n" % id_)
+
+            completed += len(success_details)
+
+        # make sure the bookkeeping survives a crash later in the run
+        success_fp.flush()
+        fail_fp.flush()
+
+        if progress_fp is not None:
+            elapsed = time.time() - start
+            progress_fp.write('%s\n' % format_progress(completed, total,
+                                                       elapsed))
+            progress_fp.flush()
+
+    pool.close()
+    pool.join()
+
+    if profile_fp is not None:
+        write_profile(profile, profile_fp)
+
+    if artifacts is not None:
+        clear_artifacts()
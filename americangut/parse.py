@@ -4,6 +4,8 @@ from __future__ import division
 
 from numpy import array, argsort, zeros
 
+import americangut.metadata as agmd
+
 __author__ = "Sam Way"
 __copyright__ = "Copyright 2013, The American Gut Project"
 __credits__ = ["Sam Way"]
@@ -34,14 +36,13 @@ def get_filtered_taxa_summary(mapping_file, taxa_summary_file,
         collapsed_taxa_table - simplified taxonomy table
     """
 
-    mapping_fp = open(mapping_file, 'rU')
-    mapping_dict, _ = parse_mapping_file_to_dict(mapping_fp)
+    md = agmd.load(mapping_file)
     taxa_fp = open(taxa_summary_file, 'rU')
     sample_ids, taxa_ids, taxa_table = parse_taxa_summary_table(taxa_fp)
     taxa_ids = [taxa_id.split('__')[-1] for taxa_id in taxa_ids]
 
-    selected_ids = set([k for k, v in mapping_dict.iteritems()
-                       if v[metadata_category] == metadata_value])
+    selected_ids = set(md.sample_ids[md.column(metadata_category) ==
+                                     metadata_value])
 
     if not selected_ids:
         raise ValueError("No sample ids match metadata_value='%s'"
@@ -129,33 +130,5 @@ def parse_taxa_summary_table(taxa_summary, cast_as=float):
 def parse_mapping_file_to_dict(mapping_file):
     """ Takes an open mapping file and parses it to a dictionary structure """
 
-    metadata_dict = {}
-    metadata_categories = []
-    comments = []
-
-    for line in mapping_file:
-        line = line.strip()
-        if not line:
-            continue
-
-        if line.startswith('#'):
-            line = line[1:]
-            if not metadata_categories:
-                metadata_categories = line.split('\t')[1:]
-                num_categories = len(metadata_categories)
-            else:
-                comments.append(line)
-        else:
-            line_pieces = line.split('\t')
-            if len(line_pieces[1:]) != num_categories:
-                raise ValueError("Error in mapping file - "
-                                 "number of metadata values does not "
-                                 "match the number of metadata categories")
-
-            sample_id = line_pieces[0]
-            metadata_values = line_pieces[1:]
-            metadata_dict[sample_id] = {key: value for key, value in
-                                        zip(metadata_categories,
-                                            metadata_values)}
-
-    return metadata_dict, comments
+    md = agmd.Metadata.from_lines(mapping_file)
+    return md.to_dict(), md.comments
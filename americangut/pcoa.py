@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+from matplotlib import use
+use('Agg')  # noqa
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+import americangut.metadata as agmd
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald", "Justine Debelius"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+ALPHA = 1.0
+LINE_WIDTH = 0.3
+LINE_WIDTH_WHITE = 2.0
+LINE_WIDTH_BLACK = 1.0
+
+_MY_DPI = 72
+_FIGSIZE = (1000 / _MY_DPI, 1000 / _MY_DPI)
+
+
+def load_mapping(mapping_fp):
+    """Load a mapping file indexed by sample ID
+
+    Parameters
+    ----------
+    mapping_fp : str
+        The path to a QIIME mapping file.
+
+    Returns
+    -------
+    pd.DataFrame
+        The metadata as strings, indexed by #SampleID.
+    """
+    return agmd.load(mapping_fp).to_frame()
+
+
+def coordinates_frame(ordination, mapping):
+    """Align an ordination and a mapping file
+
+    Parameters
+    ----------
+    ordination : skbio.stats.ordination.OrdinationResults
+        The ordination to plot.
+    mapping : pd.DataFrame
+        The metadata indexed by sample ID.
+
+    Returns
+    -------
+    pd.DataFrame
+        The site coordinates indexed by sample ID.
+    pd.DataFrame
+        The metadata restricted to, and ordered by, the ordination sites.
+    """
+    coords = pd.DataFrame(ordination.site, ordination.site_ids)
+    return coords, mapping.loc[ordination.site_ids]
+
+
+def _save(out_file):
+    """Save the current figure and release it"""
+    plt.axis('off')
+    plt.savefig(out_file, figsize=_FIGSIZE, dpi=_MY_DPI)
+    plt.close()
+
+
+def plot_body_site(coords, mapping, sample, out_file):
+    """Generates a bodysite figure for a sample
+
+    Parameters
+    ----------
+    coords : pd.DataFrame
+        The site coordinates indexed by sample ID.
+    mapping : pd.DataFrame
+        The metadata aligned to `coords`. It is expected to contain a
+        TITLE_BODY_SITE column.
+    sample : str
+        The sample to highlight.
+    out_file : str
+        The path to save the figure to.
+
+    Raises
+    ------
+    ValueError
+        If the sample is not in the coordinates.
+    """
+    if sample not in coords.index:
+        raise ValueError("Sample %s not found" % sample)
+
+    color_hmp_fecal = sns.color_palette('Paired', 12)[10]  # light brown
+    color_agp_fecal = sns.color_palette('Paired', 12)[11]  # dark brown
+    color_hmp_oral = sns.color_palette('Paired', 12)[0]    # light blue
+    color_agp_oral = sns.color_palette('Paired', 12)[1]    # dark blue
+    color_hmp_skin = sns.color_palette('Paired', 12)[2]    # light green
+    color_agp_skin = sns.color_palette('Paired', 12)[3]    # dark green
+
+    grp_colors = {'AGP-FECAL': color_agp_fecal,
+                  'AGP-ORAL':  color_agp_oral,
+                  'AGP-SKIN':  color_agp_skin,
+                  'HMP-FECAL': color_hmp_fecal,
+                  'GG-FECAL':  color_hmp_fecal,
+                  'PGP-FECAL': color_hmp_fecal,
+                  'HMP-ORAL':  color_hmp_oral,
+                  'PGP-ORAL':  color_hmp_oral,
+                  'HMP-SKIN':  color_hmp_skin,
+                  'PGP-SKIN':  color_hmp_skin}
+
+    # plot categories as 50 slices with random zorder
+    for grp, color in grp_colors.iteritems():
+        sub_coords = coords[mapping.TITLE_BODY_SITE == grp].values
+        for i in np.array_split(sub_coords, 50):
+            if i.size == 0:
+                continue
+            plt.scatter(i[:, 0], i[:, 1], color=color,
+                        edgecolor=np.asarray(color)*0.6, lw=LINE_WIDTH,
+                        alpha=ALPHA, zorder=np.random.rand())
+
+    # plot participant's dot
+    color = grp_colors[mapping.loc[sample]['TITLE_BODY_SITE']]
+    plt.scatter(coords.loc[sample][0], coords.loc[sample][1],
+                color=color, s=270, edgecolor='w', zorder=1,
+                lw=LINE_WIDTH_WHITE)
+    plt.scatter(coords.loc[sample][0], coords.loc[sample][1],
+                color=color, s=250, edgecolor=np.asarray(color)*0.6,
+                zorder=2, lw=LINE_WIDTH_BLACK)
+
+    _save(out_file)
+
+
+def closest_sample(dm, sample, candidates):
+    """Find the closest sample which is present in a set of candidates
+
+    Parameters
+    ----------
+    dm : skbio.DistanceMatrix
+        The distances to search.
+    sample : str
+        The sample to find a neighbor for.
+    candidates : Iterable of str
+        The sample IDs that are acceptable neighbors.
+
+    Returns
+    -------
+    str
+        The ID of the closest candidate other than the sample itself.
+
+    Raises
+    ------
+    ValueError
+        If no candidate is represented in the distance matrix.
+    """
+    ids = np.asarray(dm.ids)
+    row = dm[sample].astype(float)
+    row[ids == sample] = np.inf
+
+    usable = np.in1d(ids, list(candidates)) & np.isfinite(row)
+    if not usable.any():
+        # this should not ever happen
+        raise ValueError("Unable to find a similar sample?")
+
+    row[~usable] = np.inf
+    return ids[row.argmin()]
+
+
+def _country_colors():
+    """Get a fresh country to color lookup"""
+    color_Venezuela = sns.color_palette('Paired', 12)[10]
+    color_Malawi = sns.color_palette('Paired', 12)[1]
+    color_Western = sns.color_palette('Paired', 12)[4]
+    color_no_data = (0.5, 0.5, 0.5)
+
+    grp_colors = OrderedDict()
+    grp_colors['no_data'] = color_no_data
+    for country in ['Australia', 'Belgium', 'Canada', 'China', 'Finland',
+                    'France', 'Germany', 'Great Britain', 'Ireland', 'Japan',
+                    'Netherlands', 'New Zealand', 'Norway', 'Scotland',
+                    'Spain', 'Switzerland', 'Thailand',
+                    'United Arab Emirates', 'United Kingdom',
+                    'United States of America']:
+        grp_colors[country] = color_Western
+    grp_colors['Malawi'] = color_Malawi
+    grp_colors['Venezuela'] = color_Venezuela
+
+    return grp_colors
+
+
+def plot_country(coords, mapping, dm, sample, out_file):
+    """Generates a country figure for a sample
+
+    Parameters
+    ----------
+    coords : pd.DataFrame
+        The site coordinates indexed by sample ID.
+    mapping : pd.DataFrame
+        The metadata aligned to `coords`. It is expected to contain a COUNTRY
+        column.
+    dm : skbio.DistanceMatrix
+        The distances used to find the nearest plotted sample if `sample` is
+        not present in the coordinates.
+    sample : str
+        The sample to highlight.
+    out_file : str
+        The path to save the figure to.
+
+    Raises
+    ------
+    ValueError
+        If the sample is not in the distance matrix.
+    """
+    if sample not in dm.ids:
+        raise ValueError("Sample %s not found" % sample)
+
+    color_highlight = sns.color_palette('Paired', 12)[5]
+    grp_colors = _country_colors()
+
+    sample_to_plot = sample
+    if sample not in coords.index:
+        # find the closest sample in the distance matrix that is in the
+        # coordinates data
+        sample_to_plot = closest_sample(dm, sample, coords.index)
+
+    x, y = coords[0].values, coords[1].values
+
+    # countour plot superimposed
+    sns.kdeplot(x, y, cmap='bone')
+    # thinner lines for the rest of the figure, without changing the
+    # settings of later figures
+    with sns.plotting_context(rc={"lines.linewidth": 0.75}):
+        # change particapant's country's color to color_highlight unless
+        # country is Venezuela or Malawi
+        country = mapping.loc[sample_to_plot]['COUNTRY']
+        if country not in ('Malawi', 'Venezuela'):
+            grp_colors[country] = color_highlight
+
+        # plot each country except participant's according to colors above
+        for grp, color in grp_colors.iteritems():
+            if grp == country:
+                continue
+            sub_coords = coords[mapping.COUNTRY == grp]
+            plt.scatter(sub_coords[0], sub_coords[1], color=color,
+                        edgecolor=np.asarray(color)*0.6, lw=LINE_WIDTH,
+                        alpha=ALPHA)
+
+        # now plot participant's country
+        color = grp_colors[country]
+        sub_coords = coords[mapping.COUNTRY == country]
+        plt.scatter(sub_coords[0], sub_coords[1], color=color,
+                    edgecolor=np.asarray(color)*0.6, lw=LINE_WIDTH,
+                    alpha=ALPHA)
+
+        # plot participant's dot
+        sample_x, sample_y = coords.loc[sample_to_plot][[0, 1]]
+        plt.scatter(sample_x, sample_y,
+                    color=color_highlight,
+                    s=270, edgecolor='w', zorder=1, lw=LINE_WIDTH_WHITE)
+        plt.scatter(sample_x, sample_y,
+                    color=color_highlight,
+                    s=250, edgecolor=np.asarray(color)*0.6,
+                    zorder=2, lw=LINE_WIDTH_BLACK)
+
+        _save(out_file)
+
+
+def plot_gradient(coords, mapping, color, sample, out_file):
+    """Generates a gradient figure for a sample
+
+    Parameters
+    ----------
+    coords : pd.DataFrame
+        The site coordinates indexed by sample ID.
+    mapping : pd.DataFrame
+        The metadata aligned to `coords`.
+    color : str
+        The metadata category to set the color by. Non-numeric values are
+        plotted in gray.
+    sample : str
+        The sample to highlight.
+    out_file : str
+        The path to save the figure to.
+
+    Raises
+    ------
+    ValueError
+        If the sample is not in the coordinates.
+    """
+    if sample not in coords.index:
+        raise ValueError("Sample %s not found" % sample)
+
+    values = pd.to_numeric(mapping[color], errors='coerce')
+    numeric = values[~pd.isnull(values)]
+    non_numeric = values[pd.isnull(values)]
+
+    color_array = plt.cm.RdBu(numeric / max(numeric))
+
+    # plot numeric metadata as colored gradient
+    ids = numeric.index
+    x, y = coords.loc[ids][0], coords.loc[ids][1]
+    plt.scatter(x, y, c=numeric, cmap=plt.get_cmap('RdBu'),
+                alpha=ALPHA, lw=LINE_WIDTH, edgecolor=color_array*0.6)
+
+    # plot non-numeric metadata as gray
+    ids = non_numeric.index
+    x, y = coords.loc[ids][0], coords.loc[ids][1]
+    plt.scatter(x, y, c='0.5', alpha=ALPHA, lw=LINE_WIDTH, edgecolor='0.3')
+
+    # plot individual's dot
+    try:
+        color_index = numeric.index.tolist().index(sample)
+    except ValueError:
+        color_index = None
+
+    if color_index is None:
+        _color = (0.5, 0.5, 0.5)
+    else:
+        _color = color_array[color_index]
+
+    plt.scatter(coords.loc[sample][0], coords.loc[sample][1],
+                color=_color, s=270, edgecolor='w', lw=LINE_WIDTH_WHITE)
+    plt.scatter(coords.loc[sample][0], coords.loc[sample][1],
+                color=_color, s=250, edgecolor=np.asarray(_color)*0.6,
+                lw=LINE_WIDTH_BLACK)
+
+    _save(out_file)
@@ -20,7 +20,7 @@ def cat_taxa_summaries():
         table = load_table(get_existing_path(path))
         if len(name.split('-')) == 2:
             # Have entire cohort of samples for site, so need to get medians
-            table = collapse_full(table)
+            table = collapse_full(table, processes=agenv.get_cpu_count())
         table = collapse_taxonomy(table)
         ids = table.ids(axis='observation')
         for col in table.ids():
@@ -5,19 +5,37 @@ use('Agg')  # noqa
 
 import biom
 import matplotlib.pyplot as plt
-import pandas as pd
-from qiime.util import qiime_system_call
+import numpy as np
 import seaborn as sn
+import skbio.io
+from skbio import DistanceMatrix
+from skbio.stats.ordination import OrdinationResults
 
 import americangut.util as agu
 import americangut.notebook_environment as agenv
 import americangut.results_utils as agru
+import americangut.manifest as agman
+import americangut.parallel as agpar
+import americangut.make_phyla_plots as agmpp
+import americangut.metadata as agmd
+import americangut.pcoa as agpcoa
+from americangut.generate_otu_signifigance_tables import (
+    calculate_tax_rank_table, cohort_statistics, sample_significance_macros)
+from americangut.taxtree import index_taxontable, sample_rare_unique_indexed
 
 # Sets up plotting parameters so that the default setting is use to Helvetica
 # in plots
 rcParams['font.family'] = 'sans-serif'
 rcParams['font.sans-serif'] = ['Arial']
 
+# Taxa present in fewer than this fraction of samples are considered rare
+RARE_THRESHOLD = 0.1
+
+# The values pandas.read_csv reads as missing by default
+_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+              '-nan', '1.#IND', '1.#QNAN', 'N/A', 'NA', 'NULL', 'NaN', 'n/a',
+              'nan', 'null']
+
 
 def create_opts(sample_type, chp_path, gradient_color_by, barchart_categories):
     """Create a dict of options for processing functions
@@ -115,8 +133,97 @@ def sample_type_processor(functions, opts, ids):
         A dict keyed by sample ID and valued by a list. The list contains
         all errors observed for the sample, or the empty list if no errors
         were observed.
+
+    Notes
+    -----
+    If opts['per-sample']['manifest'] is set, a function whose outputs for a
+    sample were recorded with the same input fingerprint, and which still
+    exist, is not rerun for the sample. Successful outputs are recorded.
+    Functions which do not describe their outputs are always run. See
+    `_tracked_io` for which inputs each function is fingerprinted on.
+
+    If profiling is enabled, the resource usage of every function call is
+    recorded. See `americangut.notebook_environment.is_profiling_enabled`.
+    """
+    if agenv.is_profiling_enabled():
+        def call(f, opts, ids):
+            return agpar.profile_call(f.__name__, opts.get('sample_type'),
+                                      ids, f, opts, ids)
+    else:
+        def call(f, opts, ids):
+            return f(opts, ids)
+
+    manifest_fp = opts.get('per-sample', {}).get('manifest')
+    if manifest_fp is None:
+        return merge_error_reports(*[call(f, opts, ids) for f in functions])
+
+    ids = list(ids)
+    reports = []
+    for f in functions:
+        io = _tracked_io(f, opts)
+        if io is None:
+            reports.append(call(f, opts, ids))
+            continue
+
+        inputs, options, outputs, column_table = io
+        digests = _sample_digests(agman.fingerprint(inputs, options), ids,
+                                  column_table)
+        current = agman.current_ids(manifest_fp, f.__name__, digests)
+
+        report = {id_: None for id_ in current}
+        stale = [id_ for id_ in ids if id_ not in current]
+        if stale:
+            report.update(call(f, opts, stale))
+
+        produced = {}
+        for id_ in stale:
+            if not report.get(id_):
+                result_path = _result_path(opts, id_)
+                produced[id_] = [os.path.join(result_path, o % {'id': id_})
+                                 for o in outputs]
+        agman.record(manifest_fp, f.__name__, digests, produced)
+
+        reports.append(report)
+
+    return merge_error_reports(*reports)
+
+
+def _sample_digests(digest, ids, column_table=None):
+    """Fingerprint the inputs of a tracked function for each sample
+
+    Parameters
+    ----------
+    digest : str or None
+        The fingerprint of the inputs shared by all samples.
+    ids : Iterable of str
+        The sample IDs.
+    column_table : str, optional
+        A table in which only each sample's own values affect its outputs.
+        The nonzero values of the sample, and their observation IDs, are
+        fingerprinted rather than the whole table.
+
+    Returns
+    -------
+    dict
+        {str: str or None} of the fingerprint for each sample. It is None if
+        an input is missing or the sample is not in the column table.
     """
-    return merge_error_reports(*[f(opts, ids) for f in functions])
+    if column_table is None:
+        return {id_: digest for id_ in ids}
+    if digest is None or not os.path.exists(column_table):
+        return {id_: None for id_ in ids}
+
+    table = _load_table(column_table)
+    obs_ids = table.ids(axis='observation')
+    digests = {}
+    for id_ in ids:
+        state = None
+        if table.exists(id_):
+            v = table.data(id_, dense=True)
+            present = v.nonzero()[0]
+            state = [obs_ids[present].tolist(), v[present].tolist()]
+        digests[id_] = agman.sample_fingerprint(digest, state)
+    return digests
 
 
 def _result_path(opts, id_):
@@ -184,40 +291,6 @@ def merge_error_reports(*reports):
     return result
 
 
-def _iter_ids_over_system_call(cmd_fmt, sample_ids, opts):
-    """Iteratively execute a system call over sample IDs
-
-    Parameters
-    ----------
-    cmd_fmt : str
-        The format of the command to execute. It is expected that there
-        is a single string format to be done and it should take a sample
-        ID
-    sample_ids : Iterable of str
-        A list of sample IDs of interest
-
-    Returns
-    -------
-    dict
-        A dict containing each sample ID and any errors observed or None if
-        no error was observed for the sample. {str: str or None}
-    """
-    results = {}
-
-    for id_ in sample_ids:
-        cmd = cmd_fmt % {'result_path': _result_path(opts, id_),
-                         'id': id_}
-        stdout, stderr, return_value = qiime_system_call(cmd)
-
-        if return_value != 0:
-            msg = stderr.splitlines()
-            results[id_] = 'FAILED (%s): %s' % (msg[-1] if msg else '', cmd)
-        else:
-            results[id_] = None
-
-    return results
-
-
 def taxa_summaries(opts, sample_ids):
     """Produce digestable taxonomy summaries per sample
 
@@ -237,7 +310,7 @@ def taxa_summaries(opts, sample_ids):
     """
     results = {}
     path = opts['taxa']['notrim']['L6']['ag-%s-biom' % opts['sample_type']]
-    site_table = biom.load_table(path)
+    site_table = _load_table(path)
     table_taxon_ids = site_table.ids(axis='observation')
 
     for id_ in sample_ids:
@@ -276,11 +349,7 @@ def alpha_plot(opts, sample_ids):
     """
 
     results = {}
-    alpha_map = pd.read_csv(
-        agu.get_existing_path(opts['collapsed']['100nt']['alpha-map']),
-        sep='\t',
-        dtype=str,
-        )
+    alpha_map = _load_alpha_map(opts['collapsed']['100nt']['alpha-map'])
 
     alpha_metrics = ['shannon_1k', 'PD_whole_tree_1k']
 
@@ -293,8 +362,9 @@ def alpha_plot(opts, sample_ids):
     if 'SIMPLE_BODY_SITE' not in alpha_map.columns:
         raise ValueError('SIMPLE_BODY_SITE is not a valid field name.')
 
+    # The loaded map may be shared, so it is not modified in place
+    alpha_map = alpha_map.set_index('#SampleID')
     alpha_map[alpha_metrics] = alpha_map[alpha_metrics].astype(float)
-    alpha_map.set_index('#SampleID', inplace=True)
 
     results = {}
     for id_ in sample_ids:
@@ -336,7 +406,7 @@ def sufficient_sequence_counts(opts, sample_ids):
         no error was observed for the sample. {str: str or None}
     """
     results = {}
-    table = biom.load_table(opts['otus']['100nt']['ag-biom'])
+    table = _load_table(opts['otus']['100nt']['ag-biom'])
 
     minimum_depth = opts['rarefaction-depth']
 
@@ -353,6 +423,220 @@ def sufficient_sequence_counts(opts, sample_ids):
     return results
 
 
+def _failure(exc, desc):
+    """Format an error report entry for an exception"""
+    msg = str(exc).splitlines()
+    return 'FAILED (%s): %s' % (msg[-1] if msg else type(exc).__name__, desc)
+
+
+def _iter_ids_in_process(loader, render_f, sample_ids, opts):
+    """Iteratively render per-sample results within this process
+
+    Parameters
+    ----------
+    loader : function
+        A function with the signature ``object <- f(dict, list)`` which is
+        provided the opts and the sample IDs, and loads the inputs shared by
+        all of the samples. It is called once.
+    render_f : function
+        A function with the signature ``f(object, str, str)`` which is
+        provided the loaded inputs, a sample ID and the result path for the
+        sample. It is expected to raise on failure.
+    sample_ids : Iterable of str
+        A list of sample IDs of interest
+    opts : dict
+        A dict of relevant opts.
+
+    Returns
+    -------
+    dict
+        A dict containing each sample ID and any errors observed or None if
+        no error was observed for the sample. {str: str or None}
+
+    Notes
+    -----
+    This avoids paying the interpreter startup and input parsing cost once
+    per sample, which dominates when a script is invoked per sample.
+    """
+    results = {}
+
+    try:
+        inputs = loader(opts, sample_ids)
+    except Exception as e:
+        failure = _failure(e, loader.__name__)
+        return {id_: failure for id_ in sample_ids}
+
+    for id_ in sample_ids:
+        try:
+            render_f(inputs, id_, _result_path(opts, id_))
+        except Exception as e:
+            results[id_] = _failure(e, '%s %s' % (render_f.__name__, id_))
+        else:
+            results[id_] = None
+        finally:
+            plt.close('all')
+
+    return results
+
+
+def _read_mapping_dict(path):
+    """Read a mapping file, indexable as a 2D dict"""
+    return agmd.load(path)
+
+
+def _read_ordination(path):
+    """Read principal coordinates"""
+    return skbio.io.read(path, into=OrdinationResults)
+
+
+def _read_distance_matrix(path):
+    """Read a distance matrix"""
+    return skbio.io.read(path, into=DistanceMatrix)
+
+
+def _read_alpha_map(path):
+    """Read the alpha diversity mapping file
+
+    Values which pandas.read_csv treats as missing, such as '' and 'NA',
+    are read as NaN.
+    """
+    frame = agmd.load(agu.get_existing_path(path)).to_frame()
+    frame = frame.replace(_NA_VALUES, np.nan)
+    return frame.reset_index()
+
+
+def _read_significance_cohort(path):
+    """Read a taxonomy table and summarize it for the significance tests
+
+    Taxa absent from every sample are removed. The table, its taxonomy index
+    from index_taxontable and its cohort_statistics are returned, so that
+    they are computed once rather than for every chunk of samples.
+    """
+    def filt_fun(v, i, md):
+        return v.sum() > 0
+
+    table = biom.load_table(path)
+    table.filter(filt_fun, axis='observation')
+    return (table, index_taxontable(table),
+            cohort_statistics(table.matrix_data))
+
+
+# The loaders below return the copy published by the dispatcher if there is
+# one. Anything they return must be treated as read-only.
+def _load_table(path):
+    """Load a BIOM table"""
+    return agpar.get_artifact(biom.load_table, path)
+
+
+def _load_mapping_dict(path):
+    """Load a mapping file, indexable as a 2D dict"""
+    return agpar.get_artifact(_read_mapping_dict, path)
+
+
+def _load_mapping_frame(path):
+    """Load a mapping file as a DataFrame indexed by sample ID"""
+    return agpar.get_artifact(agpcoa.load_mapping, path)
+
+
+def _load_ordination(path):
+    """Load principal coordinates"""
+    return agpar.get_artifact(_read_ordination, path)
+
+
+def _load_distance_matrix(path):
+    """Load a distance matrix"""
+    return agpar.get_artifact(_read_distance_matrix, path)
+
+
+def _load_alpha_map(path):
+    """Load the alpha diversity mapping file"""
+    return agpar.get_artifact(_read_alpha_map, path)
+
+
+def _load_significance_cohort(path):
+    """Load a taxonomy table summarized for the significance tests"""
+    return agpar.get_artifact(_read_significance_cohort, path)
+
+
+def shared_artifacts(*all_opts):
+    """Get the artifacts the processing functions load from disk
+
+    Parameters
+    ----------
+    *all_opts : list of dict
+        The opts for each sample type being processed.
+
+    Returns
+    -------
+    list of (function, str)
+        The loader and path for each artifact, suitable for passing to
+        `americangut.parallel.dispatcher`.
+    """
+    artifacts = []
+    for opts in all_opts:
+        sample_type = opts['sample_type']
+        beta1k = opts['beta']['100nt']['1k']
+        taxa = opts['taxa']['notrim']
+        meta = opts['meta']
+
+        artifacts.extend([
+            (biom.load_table, opts['otus']['100nt']['ag-biom']),
+            (biom.load_table, taxa['L6']['ag-%s-biom' % sample_type]),
+            (_read_significance_cohort,
+             taxa['L6']['ag-%s-biom' % sample_type]),
+            (biom.load_table, taxa['L3']['ag-tsv']),
+            (biom.load_table,
+             opts['collapsed']['notrim']['1k']['ag-%s-biom' % sample_type]),
+            (_read_alpha_map, opts['collapsed']['100nt']['alpha-map']),
+            (_read_mapping_dict, meta['ag-cleaned-md']),
+            (agpcoa.load_mapping, meta['ag-pgp-hmp-gg-cleaned-md']),
+            (agpcoa.load_mapping, meta['ag-gg-cleaned-md']),
+            (agpcoa.load_mapping, taxa['L2']['ag-md']),
+            (_read_ordination, beta1k['ag-pgp-hmp-gg-unifrac-pc']),
+            (_read_ordination, beta1k['ag-gg-subsampled-unifrac-pc']),
+            (_read_ordination, beta1k['ag-%s-unifrac-pc' % sample_type]),
+            (_read_distance_matrix, beta1k['ag-gg-unifrac'])])
+
+        categories = _parse_barchart_categories(opts['barchart_categories'])
+        artifacts.extend((biom.load_table, path)
+                         for _, path in sorted(categories.items()))
+
+    seen = set()
+    return [a for a in artifacts if not (a in seen or seen.add(a))]
+
+
+def _load_significance_inputs(opts, sample_ids):
+    path = opts['taxa']['notrim']['L6']['ag-%s-biom' % opts['sample_type']]
+    abund_table, (tree, obs_taxa, sample_obs), cohort = \
+        _load_significance_cohort(path)
+    mapping = _load_mapping_dict(opts['meta']['ag-cleaned-md'])
+
+    # Tests all of the samples of interest against the table in one pass
+    present = {id_: sample_obs[id_] for id_ in sample_ids
+               if id_ in sample_obs}
+    rare_unique = {samp: (rare, unique) for samp, rare, unique in
+                   sample_rare_unique_indexed(tree, obs_taxa, present,
+                                              RARE_THRESHOLD)}
+    ranks = calculate_tax_rank_table(
+        abund_table, [(k, r, u) for k, (r, u) in rare_unique.items()],
+        cohort=cohort)
+
+    return mapping, abund_table, rare_unique, ranks
+
+
+def _render_significance(inputs, id_, result_path):
+    mapping, abund_table, rare_unique, ranks = inputs
+    if id_ not in rare_unique:
+        raise ValueError('%s is not in the taxonomy table' % id_)
+
+    rare, unique = rare_unique[id_]
+    high, low = ranks[id_]
+    macros = sample_significance_macros(id_, high, rare, unique, abund_table,
+                                        mapping)
+    with open(os.path.join(result_path, 'macros.tex'), 'w') as fp:
+        fp.write(macros)
+
+
 def taxon_significance(opts, sample_ids):
     """Produce OTU significance results
 
@@ -369,14 +653,21 @@ def taxon_significance(opts, sample_ids):
         A dict containing each sample ID and any errors observed or None if
         no error was observed for the sample. {str: str or None}
     """
-    path = opts['taxa']['notrim']['L6']['ag-%s-biom' % opts['sample_type']]
-    map_path = opts['meta']['ag-cleaned-md']
+    return _iter_ids_in_process(_load_significance_inputs,
+                                _render_significance, sample_ids, opts)
 
-    cmd_fmt = 'generate_otu_signifigance_tables_AGP.py -i %s ' % path
-    cmd_fmt += '-o %(result_path)s -s %(id)s '
-    cmd_fmt += '-m %s' % map_path
 
-    return _iter_ids_over_system_call(cmd_fmt, sample_ids, opts)
+def _load_body_site_inputs(opts, sample_ids):
+    beta1k = opts['beta']['100nt']['1k']
+    ordination = _load_ordination(beta1k['ag-pgp-hmp-gg-unifrac-pc'])
+    mapping = _load_mapping_frame(opts['meta']['ag-pgp-hmp-gg-cleaned-md'])
+    return agpcoa.coordinates_frame(ordination, mapping)
+
+
+def _render_body_site(inputs, id_, result_path):
+    coords, mapping = inputs
+    agpcoa.plot_body_site(coords, mapping, id_,
+                          os.path.join(result_path, 'figure1.pdf'))
 
 
 def body_site_pcoa(opts, sample_ids):
@@ -395,16 +686,23 @@ def body_site_pcoa(opts, sample_ids):
         A dict containing each sample ID and any errors observed or None if
         no error was observed for the sample. {str: str or None}
     """
-    coords = opts['beta']['100nt']['1k']['ag-pgp-hmp-gg-unifrac-pc']
-    mapping = opts['meta']['ag-pgp-hmp-gg-cleaned-md']
-    cmd_fmt = ' '.join(["mod2_pcoa.py body_site",
-                        "--coords %s" % coords,
-                        "--mapping_file %s" % mapping,
-                        "--output %(result_path)s",
-                        "--filename figure1.pdf",
-                        "--sample %(id)s"])
+    return _iter_ids_in_process(_load_body_site_inputs, _render_body_site,
+                                sample_ids, opts)
+
+
+def _load_country_inputs(opts, sample_ids):
+    beta1k = opts['beta']['100nt']['1k']
+    dm = _load_distance_matrix(beta1k['ag-gg-unifrac'])
+    ordination = _load_ordination(beta1k['ag-gg-subsampled-unifrac-pc'])
+    mapping = _load_mapping_frame(opts['meta']['ag-gg-cleaned-md'])
+    coords, mapping = agpcoa.coordinates_frame(ordination, mapping)
+    return coords, mapping, dm
 
-    return _iter_ids_over_system_call(cmd_fmt, sample_ids, opts)
+
+def _render_country(inputs, id_, result_path):
+    coords, mapping, dm = inputs
+    agpcoa.plot_country(coords, mapping, dm, id_,
+                        os.path.join(result_path, 'figure2.pdf'))
 
 
 def country_pcoa(opts, sample_ids):
@@ -423,17 +721,22 @@ def country_pcoa(opts, sample_ids):
         A dict containing each sample ID and any errors observed or None if
         no error was observed for the sample. {str: str or None}
     """
-    beta1k = opts['beta']['100nt']['1k']
-    coords = beta1k['ag-gg-subsampled-unifrac-pc']
-    cmd_fmt = ' '.join(["mod2_pcoa.py country",
-                        "--distmat %s" % beta1k['ag-gg-unifrac'],
-                        "--coords %s" % coords,
-                        "--mapping_file %s" % opts['meta']['ag-gg-cleaned-md'],
-                        "--output %(result_path)s",
-                        "--filename figure2.pdf",
-                        "--sample %(id)s"])
+    return _iter_ids_in_process(_load_country_inputs, _render_country,
+                                sample_ids, opts)
+
+
+def _load_gradient_inputs(opts, sample_ids):
+    coords_key = 'ag-%s-unifrac-pc' % opts['sample_type']
+    ordination = _load_ordination(opts['beta']['100nt']['1k'][coords_key])
+    mapping = _load_mapping_frame(opts['taxa']['notrim']['L2']['ag-md'])
+    coords, mapping = agpcoa.coordinates_frame(ordination, mapping)
+    return coords, mapping, opts['gradient_color_by']
 
-    return _iter_ids_over_system_call(cmd_fmt, sample_ids, opts)
+
+def _render_gradient(inputs, id_, result_path):
+    coords, mapping, color = inputs
+    agpcoa.plot_gradient(coords, mapping, color, id_,
+                         os.path.join(result_path, 'figure3.pdf'))
 
 
 def gradient_pcoa(opts, sample_ids):
@@ -452,18 +755,24 @@ def gradient_pcoa(opts, sample_ids):
         A dict containing each sample ID and any errors observed or None if
         no error was observed for the sample. {str: str or None}
     """
-    mapping = opts['taxa']['notrim']['L2']['ag-md']
-    coords_key = 'ag-%s-unifrac-pc' % opts['sample_type']
-    coords = opts['beta']['100nt']['1k'][coords_key]
-    cmd_fmt = ' '.join(["mod2_pcoa.py gradient",
-                        "--coords %s" % coords,
-                        "--mapping_file %s" % mapping,
-                        "--output %(result_path)s",
-                        "--filename figure3.pdf",
-                        "--color %s" % opts['gradient_color_by'],
-                        "--sample %(id)s"])
+    return _iter_ids_in_process(_load_gradient_inputs, _render_gradient,
+                                sample_ids, opts)
+
+
+def _load_pie_inputs(opts, sample_ids):
+    table = _load_table(opts['taxa']['notrim']['L3']['ag-tsv'])
+
+    # Removes the taxa which are not present in any sample
+    def filt_fun(v, i, md):
+        return v.sum() > 0
 
-    return _iter_ids_over_system_call(cmd_fmt, sample_ids, opts)
+    return table.filter(filt_fun, axis='observation', inplace=False)
+
+
+def _render_pie(table, id_, result_path):
+    if not table.exists(id_):
+        raise ValueError('%s is not in the taxonomy table' % id_)
+    agmpp.plot_sample_pie(table, id_, os.path.join(result_path, 'figure2.pdf'))
 
 
 def pie_plot(opts, sample_ids):
@@ -482,11 +791,41 @@ def pie_plot(opts, sample_ids):
         A dict containing each sample ID and any errors observed or None if
         no error was observed for the sample. {str: str or None}
     """
-    cmd_fmt = ' '.join(['make_pie_plot_AGP.py',
-                        '-i %s' % opts['taxa']['notrim']['L3']['ag-tsv'],
-                        '-o %(result_path)s',
-                        '-s %(id)s'])
-    return _iter_ids_over_system_call(cmd_fmt, sample_ids, opts)
+    return _iter_ids_in_process(_load_pie_inputs, _render_pie, sample_ids,
+                                opts)
+
+
+def _parse_barchart_categories(categories):
+    """Parse the "CATEGORY:path, CATEGORY:path" barchart option"""
+    categories = categories.strip('"').strip()
+    if not categories:
+        return {}
+
+    category_fp = {}
+    for item in categories.split(','):
+        category, path = item.strip().split(':', 1)
+        category_fp[category] = path
+    return category_fp
+
+
+def _load_barchart_inputs(opts, sample_ids):
+    sample_type = opts['sample_type']
+    path = opts['collapsed']['notrim']['1k']['ag-%s-biom' % sample_type]
+    table = _load_table(path)
+    mapping = _load_mapping_dict(opts['meta']['ag-cleaned-md'])
+    category_fp = _parse_barchart_categories(opts['barchart_categories'])
+    cat_tables = {c: _load_table(p) for c, p in category_fp.items()}
+    population = agmpp.summarize_barchart_population(table, cat_tables,
+                                                     sample_type=sample_type)
+    return population, mapping
+
+
+def _render_barchart(inputs, id_, result_path):
+    population, mapping = inputs
+    if id_ not in mapping:
+        raise ValueError('%s is not in the mapping file' % id_)
+    agmpp.plot_sample_barchart(population, mapping[id_], id_,
+                               os.path.join(result_path, 'figure4.pdf'))
 
 
 def bar_chart(opts, sample_ids):
@@ -505,16 +844,8 @@ def bar_chart(opts, sample_ids):
         A dict containing each sample ID and any errors observed or None if
         no error was observed for the sample. {str: str or None}
     """
-    sample_type = opts['sample_type']
-    path = opts['collapsed']['notrim']['1k']['ag-%s-biom' % sample_type]
-    cmd_fmt = ' '.join(['make_phyla_plots_AGP.py',
-                        '-i %s' % path,
-                        '-m %s' % opts['meta']['ag-cleaned-md'],
-                        '-o %(result_path)s',
-                        '-c %s' % opts['barchart_categories'],
-                        '-t %s' % opts['sample_type'],
-                        '-s %(id)s'])
-    return _iter_ids_over_system_call(cmd_fmt, sample_ids, opts)
+    return _iter_ids_in_process(_load_barchart_inputs, _render_barchart,
+                                sample_ids, opts)
 
 
 def per_sample_directory(opts, sample_ids):
@@ -588,6 +919,101 @@ def stage_per_sample_specific_statics(opts, sample_ids):
     return result
 
 
+def _tracked_io(func, opts):
+    """Describe what a processing function reads and writes
+
+    Parameters
+    ----------
+    func : function
+        The processing function.
+    opts : dict
+        A dict of relevant opts.
+
+    Returns
+    -------
+    tuple or None
+        The input paths, the options the outputs depend on, the output file
+        name formats relative to a sample's result path which are formatted
+        with the sample ID as "id", and the path of a table in which only the
+        sample's own values affect its outputs, or None. None is returned if
+        the function is not tracked.
+
+    Notes
+    -----
+    The taxonomy summaries and pie charts only show a sample's own taxa, so
+    they are fingerprinted on the sample's values in the table, and are kept
+    when a new round of samples changes the table. The significance tests,
+    PCoAs, alpha diversity distributions and bar charts place the sample
+    within the cohort, so any change to their inputs, such as a new round
+    of samples, invalidates them on purpose.
+    """
+    def taxa_summaries_io():
+        path = taxa['L6']['ag-%s-biom' % sample_type]
+        return [], [], ['%(id)s.txt'], path
+
+    def alpha_plot_io():
+        path = opts['collapsed']['100nt']['alpha-map']
+        return [path], [], ['shannon_%(id)s.png', 'pd_%(id)s.png'], None
+
+    def taxon_significance_io():
+        paths = [taxa['L6']['ag-%s-biom' % sample_type],
+                 opts['meta']['ag-cleaned-md']]
+        return paths, [RARE_THRESHOLD], ['macros.tex'], None
+
+    def body_site_pcoa_io():
+        paths = [beta1k['ag-pgp-hmp-gg-unifrac-pc'],
+                 opts['meta']['ag-pgp-hmp-gg-cleaned-md']]
+        return paths, [], ['figure1.pdf'], None
+
+    def country_pcoa_io():
+        paths = [beta1k['ag-gg-unifrac'],
+                 beta1k['ag-gg-subsampled-unifrac-pc'],
+                 opts['meta']['ag-gg-cleaned-md']]
+        return paths, [], ['figure2.pdf'], None
+
+    def gradient_pcoa_io():
+        paths = [beta1k['ag-%s-unifrac-pc' % sample_type],
+                 taxa['L2']['ag-md']]
+        return paths, [opts['gradient_color_by']], ['figure3.pdf'], None
+
+    def pie_plot_io():
+        return [], [], ['figure2.pdf'], taxa['L3']['ag-tsv']
+
+    def bar_chart_io():
+        categories = opts['barchart_categories']
+        paths = [opts['collapsed']['notrim']['1k']['ag-%s-biom' % sample_type],
+                 opts['meta']['ag-cleaned-md']]
+        paths.extend(sorted(_parse_barchart_categories(categories).values()))
+        return paths, [sample_type, categories], ['figure4.pdf'], None
+
+    def stage_per_sample_specific_statics_io():
+        path = opts['per-sample']['statics-%s' % sample_type.lower()]
+        return [path], [sample_type], ['%(id)s.tex', 'statics'], None
+
+    tracked = {taxa_summaries: taxa_summaries_io,
+               alpha_plot: alpha_plot_io,
+               taxon_significance: taxon_significance_io,
+               body_site_pcoa: body_site_pcoa_io,
+               country_pcoa: country_pcoa_io,
+               gradient_pcoa: gradient_pcoa_io,
+               pie_plot: pie_plot_io,
+               bar_chart: bar_chart_io,
+               stage_per_sample_specific_statics:
+                   stage_per_sample_specific_statics_io}
+
+    if func not in tracked:
+        return None
+
+    try:
+        sample_type = opts['sample_type']
+        taxa = opts['taxa']['notrim']
+        beta1k = opts['beta']['100nt']['1k']
+        return tracked[func]()
+    except KeyError:
+        # the opts are incomplete, so the function cannot be tracked
+        return None
+
+
 def _plot_alpha(sample, alpha_map, alpha_field, group_field='SIMPLE_BODY_SITE',
                 output_dir=None, xlabel=None, fp=None, debug=False):
     """Generates a distrbution plot for the data
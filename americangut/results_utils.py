@@ -9,7 +9,8 @@ from functools import partial
 
 from biom.parse import parse_biom_table
 
-from americangut.util import check_file
+import americangut.fasta as agf
+from americangut.util import check_file, map_row_chunks, _is_unread_file
 
 # These are the data files in the American-Gut repository that are used for
 # results processing
@@ -178,7 +179,38 @@ def parse_previously_printed(path):
     return prev_printed
 
 
-def filter_mapping_file(in_fp, out_fp, columns_to_keep):
+# The columns and criteria of the mapping file being filtered. Set prior to
+# forking any worker pool, as the criteria need not be picklable.
+_FILTER = None
+
+
+def _filter_rows(rows):
+    """Filter mapping rows by the criteria in _FILTER"""
+    columns, indices, criteria = _FILTER
+
+    new_rows = []
+    for l in rows:
+        new_line = []
+
+        keep = True
+        # fetch values from specific columns
+        for column, index in zip(columns, indices):
+            value = l[index]
+            if criteria[column] is None:
+                new_line.append(value)
+            elif not criteria[column](value):
+                keep = False
+                break
+            else:
+                new_line.append(value)
+
+        if keep:
+            new_rows.append('\t'.join(new_line))
+
+    return new_rows
+
+
+def filter_mapping_file(in_fp, out_fp, columns_to_keep, processes=1):
     """Filter out columns in a mapping file
 
     in_fp : the input file-like object
@@ -188,9 +220,14 @@ def filter_mapping_file(in_fp, out_fp, columns_to_keep):
         criteria. In other words, a row is retained if the function associated
         with the key "foo" returns True, or the row is retained if the value
         associated with "foo" is None.
+    processes : the number of processes to filter rows with
+
+    The mapping file is streamed, so rows are written as they are processed.
     """
-    lines = [l.strip().split('\t') for l in in_fp]
-    header = lines[0][:]
+    global _FILTER
+
+    rows = (l.strip().split('\t') for l in in_fp)
+    header = next(rows)
     header_lower = [x.lower() for x in header]
 
     # ensure SampleID is always first
@@ -204,31 +241,18 @@ def filter_mapping_file(in_fp, out_fp, columns_to_keep):
         new_header.append(c)
     columns_to_keep['#SampleID'] = None  # add for consistency
 
-    new_lines = [new_header]
-    for l in lines[1:]:
-        new_line = []
-
-        keep = True
-        # fetch values from specific columns
-        for column, index in zip(new_header, indices):
-            try:
-                value = l[index]
-            except:
-                raise
-            if columns_to_keep[column] is None:
-                new_line.append(value)
-            elif not columns_to_keep[column](value):
-                keep = False
-                break
-            else:
-                new_line.append(value)
-
-        if keep:
-            new_lines.append(new_line)
-
-    out_fp.write('\n'.join(['\t'.join(l) for l in new_lines]))
+    out_fp.write('\t'.join(new_header))
     out_fp.write('\n')
 
+    _FILTER = (new_header, indices, columns_to_keep)
+    try:
+        for new_rows in map_row_chunks(_filter_rows, rows, processes):
+            for row in new_rows:
+                out_fp.write(row)
+                out_fp.write('\n')
+    finally:
+        _FILTER = None
+
 
 def construct_svg_smash_commands(files, ids, cmd_format, cmd_args):
     """Format the SVG smashing commands
@@ -534,42 +558,80 @@ def pdf_smash(path, tag, pdf_smash_fmt, n_per_result=30,
     return smash_cmds
 
 
-def count_unique_sequences_per_otu(otu_ids, otu_map_file, input_seqs_file):
+# The OTU of each sequence ID being counted by count_unique_sequences_per_otu.
+# Set prior to forking any worker pool, so that it is shared with the workers.
+_SEQ_OTUS = None
+
+
+def _count_block(block, counts):
+    """Count the sequences of a block of two line FASTA records by OTU"""
+    seq_otus = _SEQ_OTUS
+    lines = block.split('\n')
+    for header, sequence in izip(lines[0::2], lines[1::2]):
+        otu_id = seq_otus.get(header.strip().split(' ', 1)[0][1:])
+        if otu_id is not None:
+            counts[otu_id][sequence.strip()] += 1
+
+
+def _count_shard(args):
+    path, start, end = args
+    counts = defaultdict(partial(defaultdict, int))
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        for block in agf.record_blocks(fp, limit=end - start):
+            _count_block(block, counts)
+    return dict(counts)
+
+
+def count_unique_sequences_per_otu(otu_ids, otu_map_file, input_seqs_file,
+                                   processes=1):
     """Counts unique sequences per-OTU for a given set of OTUs
 
     otu_ids: a set of OTU IDs
     otu_map_file: file-like object in the format of an OTU map
     input_seqs_file: FASTA containing sequences that were used to generate
                      the otu_map_file
+    processes: the number of processes to count with. An uncompressed FASTA
+               file on disk is split into byte ranges counted independently.
+
+    The OTU map is indexed by sequence ID, so the FASTA is read in a single
+    pass. A sequence ID listed under several OTUs is counted in the last.
 
     Returns a nested dict structure: {otu_id: {sequence: count}}
     """
-    # This will hold the OTU map for the OTUs in otu_ids
-    otu_map = {x: set() for x in otu_ids}
+    global _SEQ_OTUS
 
-    # go through the otu map and save the lines of interest to the otu_map
-    # data structure above
+    # index the OTU of each sequence of the OTUs of interest
     print "Reading OTU map..."
+    seq_otus = {}
     for line in otu_map_file:
         otu_id, seq_ids = line.strip().split('\t', 1)
         if otu_id in otu_ids:
-            otu_map[otu_id] = set(seq_ids.split('\t'))
+            seq_otus.update(dict.fromkeys(seq_ids.split('\t'), otu_id))
 
     # this will hold, for each OTU in otus, counts of each unique sequence
     # observed in that OTU
     unique_counts = {x: defaultdict(int) for x in otu_ids}
 
-    # go through input fasta file TWO LINES AT A TIME, counting unique
-    # sequences in each OTU of intrest
     print "Reading FASTA file and counting unique sequences..."
-    for header, sequence in izip(input_seqs_file, input_seqs_file):
-        header = header.strip()
-        sequence = sequence.strip()
-        seq_id = header.split(' ', 1)[0][1:]
-        for otu_id in otu_ids:
-            if seq_id in otu_map[otu_id]:
-                unique_counts[otu_id][sequence] += 1
-                break
+    _SEQ_OTUS = seq_otus
+    try:
+        if (processes > 1 and _is_unread_file(input_seqs_file) and
+                not agf.is_gzip(input_seqs_file.name)):
+            path = input_seqs_file.name
+            jobs = [(path, start, end)
+                    for start, end in agf.shard_offsets(path, processes)
+                    if end > start]
+            for counts in agf._pool_map(_count_shard, jobs, processes):
+                for otu_id, otu_counts in counts.iteritems():
+                    total = unique_counts[otu_id]
+                    for sequence, count in otu_counts.iteritems():
+                        total[sequence] += count
+        else:
+            for block in agf.record_blocks(input_seqs_file):
+                _count_block(block, unique_counts)
+    finally:
+        _SEQ_OTUS = None
 
     return unique_counts
 
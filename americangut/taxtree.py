@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
-from itertools import izip
+import json
+from itertools import chain, izip
+
+import numpy as np
+from scipy.sparse import csr_matrix
 
 
 __author__ = "Daniel McDonald"
@@ -12,6 +16,156 @@ __maintainer__ = "Daniel McDonald"
 __email__ = "mcdonadt@colorado.edu"
 
 
+def _informative(tax_string):
+    """Truncate a taxon path at its first uninformative level
+
+    Levels which are unnamed (e.g., "g__") or which are bracketed (e.g.,
+    "p__[Thermi]") and everything below them are not represented in
+    population trees.
+    """
+    for idx, taxon in enumerate(tax_string):
+        if taxon.endswith('__') or '[' in taxon:
+            return tax_string[:idx]
+    return tax_string
+
+
+class TaxonTrie(object):
+    """A compact taxonomy tree
+
+    Nodes are integer IDs, with the root being 0. Node names, parents and
+    counts are held in parallel lists, and children are found through a hash
+    index keyed by (parent ID, name), so resolving a taxon path costs time
+    proportional to its length.
+    """
+    __slots__ = ('names', 'parents', 'counts', 'children', '_index')
+
+    def __init__(self, root_name='root'):
+        self.names = [root_name]
+        self.parents = [-1]
+        self.counts = [0]
+        self.children = [[]]
+        self._index = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def child(self, node_id, name):
+        """Get the ID of a named child of a node, or None"""
+        return self._index.get((node_id, name))
+
+    def add_child(self, node_id, name):
+        """Get the ID of a named child of a node, creating it if needed"""
+        key = (node_id, name)
+        child_id = self._index.get(key)
+        if child_id is None:
+            child_id = len(self.names)
+            self.names.append(name)
+            self.parents.append(node_id)
+            self.counts.append(0)
+            self.children.append([])
+            self.children[node_id].append(child_id)
+            self._index[key] = child_id
+        return child_id
+
+    def find(self, tax_string):
+        """Get the ID of the node for a taxon path, or None"""
+        node_id = 0
+        for taxon in tax_string:
+            node_id = self._index.get((node_id, taxon))
+            if node_id is None:
+                return None
+        return node_id
+
+    def find_all(self, tax_strings):
+        """Get the node IDs for many taxon paths
+
+        Returns a numpy array with -1 for paths which are not in the tree.
+        """
+        ids = [self.find(t) for t in tax_strings]
+        return np.array([-1 if i is None else i for i in ids], dtype=int)
+
+    def add(self, tax_string):
+        """Add a taxon path, returning the IDs of the nodes along it"""
+        path = []
+        node_id = 0
+        for taxon in tax_string:
+            node_id = self.add_child(node_id, taxon)
+            path.append(node_id)
+        return path
+
+    def update_population(self, taxa_by_sample):
+        """Count samples into the tree as update_tree does
+
+        Each node is counted once per sample it is observed in. Nodes are
+        distinct by their path, so a name which appears under several
+        parents (e.g., a genus in two families) is counted at each.
+        """
+        counts = self.counts
+        for list_of_taxa in taxa_by_sample:
+            counts[0] += 1
+            seen = set([])
+            for tax_string in list_of_taxa:
+                for node_id in self.add(_informative(tax_string)):
+                    if node_id not in seen:
+                        counts[node_id] += 1
+                        seen.add(node_id)
+
+    def postorder(self, node_id=0):
+        """Yield node IDs in post-order"""
+        stack = [(node_id, False)]
+        while stack:
+            node_id, expanded = stack.pop()
+            if expanded:
+                yield node_id
+            else:
+                stack.append((node_id, True))
+                for child_id in reversed(self.children[node_id]):
+                    stack.append((child_id, False))
+
+    def to_dict(self, count_key='popcount'):
+        """Convert to nested dict nodes as produced by create_node"""
+        nodes = [None] * len(self.names)
+        for node_id in self.postorder():
+            node = create_node(self.names[node_id])
+            node[count_key] = self.counts[node_id]
+            node['children'] = [nodes[c] for c in self.children[node_id]]
+            nodes[node_id] = node
+        return nodes[0]
+
+    @classmethod
+    def from_parents(cls, names, parents):
+        """Construct from node names and parent IDs, as held by a trie
+
+        Parents must precede their children. The counts are all 0.
+        """
+        trie = cls(names[0])
+        for name, parent in izip(names[1:], parents[1:]):
+            trie.add_child(parent, name)
+        return trie
+
+    @classmethod
+    def from_dict(cls, tree, count_key='popcount'):
+        """Convert nested dict nodes as produced by create_node"""
+        trie = cls(tree['name'])
+        trie.counts[0] = tree.get(count_key, 0)
+
+        stack = [(0, tree)]
+        while stack:
+            node_id, node = stack.pop()
+            for child in node['children']:
+                child_id = trie.add_child(node_id, child['name'])
+                trie.counts[child_id] = child.get(count_key, 0)
+                stack.append((child_id, child))
+        return trie
+
+
+def as_trie(tree):
+    """Get a TaxonTrie for a population tree which may be in dict form"""
+    if isinstance(tree, TaxonTrie):
+        return tree
+    return TaxonTrie.from_dict(tree)
+
+
 def create_node(name, **kwargs):
     """Create and return a new node"""
     n = {'name': name, 'children': []}
@@ -39,31 +193,26 @@ def update_tree(tree, taxa_by_sample):
         name     : node name
         popcount : number of times observed in the population
         children : list of nodes
-    """
-    if tree is None:
-        tree = create_node('root', popcount=0)
-
-    for list_of_taxa in taxa_by_sample:
-        tree['popcount'] += 1
-        seen = set([])
-        for tax_string in list_of_taxa:
-            cur_node = tree
 
-            for taxon in tax_string:
-                if taxon.endswith('__') or '[' in taxon:
-                    break
-
-                node = get_node(cur_node, taxon)
+    A TaxonTrie may be passed instead, in which case it is updated and
+    returned.
+    """
+    if isinstance(tree, TaxonTrie):
+        tree.update_population(taxa_by_sample)
+        return tree
 
-                if node is None:
-                    node = create_node(taxon, popcount=0)
-                    add_node(cur_node, node)
+    if tree is None:
+        trie = TaxonTrie()
+        trie.update_population(taxa_by_sample)
+        return trie.to_dict()
 
-                if taxon not in seen:
-                    node['popcount'] += 1
-                    seen.add(taxon)
+    trie = TaxonTrie.from_dict(tree)
+    trie.update_population(taxa_by_sample)
 
-                cur_node = node
+    # update in place as the tree may be referenced elsewhere
+    updated = trie.to_dict()
+    tree.clear()
+    tree.update(updated)
     return tree
 
 
@@ -97,30 +246,33 @@ def update_per_sample_tree(tree, taxons, count):
 def get_rare_unique(tree, sample_taxa, rare_threshold):
     """Returns the rare and unique taxa in a sample
 
+    tree           : a population tree as a dict or a TaxonTrie. Use a
+                     TaxonTrie when calling this repeatedly.
     sample_taxa    : a list of taxon strings
     rare_threshold : the level at which a taxon is considered rare
     """
+    trie = as_trie(tree)
+
     unique = []
     rare = []
 
-    popsize = float(tree['popcount'])
+    popcounts = trie.counts
+    popsize = float(popcounts[0])
     for tax_string in sample_taxa:
-        cur_node = tree
-
-        for taxon in tax_string:
-            if taxon.endswith('__') or '[' in taxon:
-                break
-
-            node = get_node(cur_node, taxon)
-
-            if node is None:
-                raise ValueError("%s doesn't exist!" % taxon)
-
-            cur_node = node
-
-        if cur_node['popcount'] == 1:
+        informative = _informative(tax_string)
+        node_id = trie.find(informative)
+
+        if node_id is None:
+            # report the first missing level
+            cur_id = 0
+            for taxon in informative:
+                cur_id = trie.child(cur_id, taxon)
+                if cur_id is None:
+                    raise ValueError("%s doesn't exist!" % taxon)
+
+        if popcounts[node_id] == 1:
             unique.append(tax_string)
-        elif cur_node['popcount'] / popsize <= rare_threshold:
+        elif popcounts[node_id] / popsize <= rare_threshold:
             rare.append(tax_string)
 
     return (rare, unique)
@@ -134,23 +286,235 @@ def traverse(node):
     yield node
 
 
+def _split_taxa(table):
+    """Split the observation IDs of a taxon table into taxon levels
+
+    It is assumed the IDs are of the form "foo; bar" or "foo;bar". Both of
+    which have been produced by QIIME's summarize_taxa.py
+    """
+    return [[t.strip() for t in i.split(';')]
+            for i in table.ids(axis='observation')]
+
+
+def index_taxontable(table):
+    """Construct a tree and per-sample observation indices from a taxon table
+
+    returns (tree, obs_taxa, sample_obs) where tree is a TaxonTrie,
+    obs_taxa is the list of taxon levels of each observation, and
+    sample_obs is {sample_id: array of the indices of observations present}.
+
+    The popcount of a node is the number of samples with a nonzero count in
+    any observation beneath it, and is computed with a single sparse product
+    rather than by walking the tree for every sample. Nodes are created in
+    the order update_tree would encounter them when visiting the samples in
+    table order.
+    """
+    obs_taxa = _split_taxa(table)
+    present = _presence(table)
+    n_obs, n_samples = present.shape
+
+    # update_tree visits samples in order, and observations in order within
+    # a sample. The first visit of a node is the earliest of the first
+    # visits of the observations beneath it.
+    nonempty = np.diff(present.indptr) > 0
+    first_visit = np.full(n_obs, np.iinfo(np.int64).max, dtype=np.int64)
+    first_visit[nonempty] = (present.indices[present.indptr[:-1][nonempty]]
+                             .astype(np.int64) * n_obs +
+                             np.arange(n_obs)[nonempty])
+
+    prefixes = {}
+    for obs_idx in np.flatnonzero(nonempty):
+        tax_string = tuple(_informative(obs_taxa[obs_idx]))
+        for depth in range(1, len(tax_string) + 1):
+            prefix = tax_string[:depth]
+            prefixes[prefix] = min(prefixes.get(prefix, first_visit[obs_idx]),
+                                   first_visit[obs_idx])
+
+    trie = TaxonTrie()
+    for prefix in sorted(prefixes, key=lambda p: (prefixes[p], len(p))):
+        trie.add(prefix)
+
+    # relate every node to the observations beneath it
+    rows = []
+    cols = []
+    for obs_idx in np.flatnonzero(nonempty):
+        path = trie.add(_informative(obs_taxa[obs_idx]))
+        rows.extend(path)
+        cols.extend([obs_idx] * len(path))
+    membership = csr_matrix((np.ones(len(rows), dtype=np.int32),
+                             (rows, cols)), shape=(len(trie), n_obs))
+
+    popcounts = membership.dot(present).getnnz(axis=1)
+    popcounts[0] = n_samples
+    trie.counts = popcounts.tolist()
+
+    return trie, obs_taxa, _sample_observations(present, table.ids())
+
+
+def _presence(table):
+    """Get an observation by sample matrix of where counts are nonzero"""
+    present = csr_matrix(table.matrix_data > 0, dtype=np.int32)
+    present.sort_indices()
+    return present
+
+
+def _sample_observations(present, sample_ids):
+    """Get {sample_id: array of the indices of observations present}"""
+    present = present.tocsc()
+    present.sort_indices()
+    return {sample_id: present.indices[start:end]
+            for sample_id, start, end in izip(sample_ids,
+                                              present.indptr[:-1],
+                                              present.indptr[1:])}
+
+
+def sample_observations(table, sample_ids=None):
+    """Get the observations present in samples of a taxon table
+
+    returns (obs_taxa, sample_obs) as index_taxontable does, without
+    constructing a tree. If sample_ids is given, only those samples are
+    indexed.
+    """
+    if sample_ids is not None:
+        table = table.filter(sample_ids, inplace=False)
+    return _split_taxa(table), _sample_observations(_presence(table),
+                                                    table.ids())
+
+
 def build_tree_from_taxontable(table):
     """Construct a tree from a taxon table
 
     returns (tree, sample_taxa_lookup) where sample_taxa_lookup is:
     {sample_id:[['k__foo','p__bar',...]]}
+
+    Use index_taxontable to avoid materializing the taxa of every sample.
     """
-    sample_taxa_lookup = {}
-    for taxa_freqs, sample_id, sample_md in table.iter():
-        sample_taxa = []
-        for taxon, freq in zip(table.ids(axis='observation'), taxa_freqs):
-            if freq > 0:
-                sample_taxa.append([t.strip() for t in taxon.split(';')])
-        sample_taxa_lookup[sample_id] = sample_taxa
+    trie, obs_taxa, sample_obs = index_taxontable(table)
+    sample_taxa_lookup = {sample_id: [obs_taxa[i] for i in obs]
+                          for sample_id, obs in sample_obs.iteritems()}
+
+    return trie.to_dict(), sample_taxa_lookup
 
-    tree = update_tree(None, sample_taxa_lookup.values())
 
-    return tree, sample_taxa_lookup
+class PerSampleTrees(object):
+    """The per-sample trees of a taxon table
+
+    Every taxon path of the table is placed in a single shared TaxonTrie,
+    and the count of every node in every sample is obtained with one sparse
+    product of a node by observation membership matrix and the table. The
+    tree of a sample is only materialized when it is requested.
+
+    tree       : the shared TaxonTrie. Its counts are not used.
+    sample_ids : the samples in table order
+    counts     : a node by sample scipy.sparse.csc_matrix of counts
+    """
+    __slots__ = ('tree', 'sample_ids', 'counts', '_obs_paths', '_data',
+                 '_index')
+
+    def __init__(self, table):
+        trie = TaxonTrie()
+        self._obs_paths = [trie.add(t) for t in _split_taxa(table)]
+        self.tree = trie
+        self.sample_ids = table.ids()
+        self._index = {id_: idx for idx, id_ in enumerate(self.sample_ids)}
+
+        data = table.matrix_data.tocsc(copy=True)
+        data.eliminate_zeros()
+        data.sort_indices()
+        self._data = data
+
+        # every observation contributes to the root and its own path
+        rows = []
+        cols = []
+        for obs_idx, path in enumerate(self._obs_paths):
+            rows.append(0)
+            rows.extend(path)
+            cols.extend([obs_idx] * (len(path) + 1))
+        membership = csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                shape=(len(trie), len(self._obs_paths)))
+
+        counts = membership.dot(data).tocsc()
+        counts.sort_indices()
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def __iter__(self):
+        for sample_id in self.sample_ids:
+            yield (sample_id, self.sample_tree(sample_id))
+
+    def sample_counts(self, sample_id):
+        """Get the compact form of the tree of a sample
+
+        returns (node_ids, counts) where node_ids is an array of the nodes of
+        the shared tree present in the sample, including the root, and
+        counts their sequence counts.
+        """
+        idx = self._index[sample_id]
+        start, end = self.counts.indptr[idx:idx + 2]
+        return (self.counts.indices[start:end],
+                self.counts.data[start:end])
+
+    def sample_nodes(self, sample_id):
+        """Get the nodes of the tree of a sample in the order they are reached
+
+        returns (node_ids, counts) as sample_counts does, ordered by the
+        first observation of the sample, in table order, beneath each node.
+        This is the order in which update_per_sample_tree would create them.
+        """
+        node_ids, node_counts = self.sample_counts(sample_id)
+        counts = dict(izip(node_ids.tolist(), node_counts.tolist()))
+
+        idx = self._index[sample_id]
+        start, end = self._data.indptr[idx:idx + 2]
+
+        order = [0]
+        seen = set(order)
+        for obs_idx in self._data.indices[start:end].tolist():
+            for node_id in self._obs_paths[obs_idx]:
+                if node_id not in seen:
+                    seen.add(node_id)
+                    order.append(node_id)
+
+        return (np.asarray(order),
+                np.asarray([counts.get(i, 0) for i in order], dtype=float))
+
+    def sample_tree(self, sample_id):
+        """Materialize the tree of a sample
+
+        The tree is as produced by update_per_sample_tree and
+        set_relative_freqs, with children in the order the observations are
+        in the table.
+        """
+        node_ids, counts = self.sample_nodes(sample_id)
+        return materialize_tree(self.tree, node_ids, counts)
+
+
+def materialize_tree(tree, node_ids, counts):
+    """Construct a per-sample tree from the nodes of a shared tree
+
+    tree     : a TaxonTrie providing the node names and parents
+    node_ids : the nodes present in the sample, parents before children and
+               the root first. Children are added in this order.
+    counts   : the sequence count of each node
+
+    returns a tree as produced by update_per_sample_tree and
+    set_relative_freqs
+    """
+    names = tree.names
+    parents = tree.parents
+    node_ids = np.asarray(node_ids).tolist()
+    counts = np.asarray(counts, dtype=float).tolist()
+
+    total = counts[0] if node_ids else 0.0
+    root = create_node(names[0], count=total, freq=total / total)
+    nodes = {0: root}
+    for node_id, count in izip(node_ids[1:], counts[1:]):
+        node = create_node(names[node_id], count=count, freq=count / total)
+        add_node(nodes[parents[node_id]], node)
+        nodes[node_id] = node
+    return root
 
 
 def build_persample_tree_from_taxontable(table):
@@ -159,48 +523,199 @@ def build_persample_tree_from_taxontable(table):
     yields (sample_id, tree). Each node in the tree (tip and nontip) include
     the taxon name, associated sequence count as well as the relative
     abundance.
+
+    Use PerSampleTrees directly to access the trees of specific samples, or
+    their counts without materializing them.
     """
-    samp_ids = table.ids()
+    return iter(PerSampleTrees(table))
 
-    # It is assumed the IDs are of the form "foo; bar" or "foo;bar". Both of
-    # which have been produced by QIIME's summarize_taxa.py
-    obs_ids_tmp = table.ids(axis='observation')
-    obs_ids = [[t.strip() for t in i.split(';')] for i in obs_ids_tmp]
 
-    for samp_id in samp_ids:
-        tree = create_node('root', count=0, freq=None)
-        data = table.data(samp_id)
-        for obs_id, count in izip(obs_ids, data):
-            if count == 0:
-                continue
-            update_per_sample_tree(tree, obs_id, count)
-        set_relative_freqs(tree)
-        yield (samp_id, tree)
+def _observation_index(table):
+    """Map the taxon path of each observation to its index in the table
 
+    The taxon levels are rejoined with '; ' regardless of how the IDs are
+    delimited, so that they can be looked up from lists of taxon levels.
+    """
+    return {'; '.join([t.strip() for t in obs_id.split(';')]): idx
+            for idx, obs_id in enumerate(table.ids(axis='observation'))}
 
-def sample_rare_unique(tree, table, all_sample_taxa, rare_threshold):
-    """Get the rare and unique taxa per sample
 
-    returns (sample_id, biom table w/o rare and uniques, rare, unique)
-    """
-    def make_filter_f(r, u):
-        r = ['; '.join(i) for i in r]
-        u = ['; '.join(i) for i in u]
-        to_remove = set(r).union(set(u))
+def sample_rare_unique_masks(tree, table, all_sample_taxa, rare_threshold):
+    """Get the rare and unique taxa per sample as observation masks
 
-        def f(v, i, md):
-            if i in to_remove:
-                return False
-            return True
-        return f
+    yields (sample_id, mask, rare, unique) where mask is a boolean array over
+    the observations of the table which is False for the rare and unique taxa
+    of the sample. The table is not copied; a filtered table can be obtained
+    when needed with
+
+        table.filter(table.ids(axis='observation')[mask],
+                     axis='observation', inplace=False)
+    """
+    tree = as_trie(tree)
+    index = _observation_index(table)
+    num_obs = len(table.ids(axis='observation'))
 
     for sample_id, sample_taxa in all_sample_taxa.iteritems():
         rare, unique = get_rare_unique(tree, sample_taxa, rare_threshold)
-        filter_f = make_filter_f(rare, unique)
 
-        if table is None:
+        mask = np.ones(num_obs, dtype=bool)
+        for taxon in chain(rare, unique):
+            idx = index.get('; '.join(taxon))
+            if idx is not None:
+                mask[idx] = False
+
+        yield (sample_id, mask, rare, unique)
+
+
+def sample_rare_unique_indexed(tree, obs_taxa, sample_obs, rare_threshold):
+    """Get the rare and unique taxa per sample from observation indices
+
+    tree           : a population tree as a dict or a TaxonTrie
+    obs_taxa       : the list of taxon levels of each observation
+    sample_obs     : {sample_id: array of the indices of observations present}
+    rare_threshold : the level at which a taxon is considered rare
+
+    yields (sample_id, rare, unique) as sample_rare_unique does. Each
+    observation is classified once, rather than once per sample.
+    """
+    trie = as_trie(tree)
+    node_ids = trie.find_all([_informative(t) for t in obs_taxa])
+    popcounts = np.asarray(trie.counts)[node_ids]
+    popcounts[node_ids == -1] = 0
+
+    is_unique = popcounts == 1
+    is_rare = ~is_unique & (popcounts / float(trie.counts[0]) <=
+                            rare_threshold)
+
+    for sample_id, obs in sample_obs.iteritems():
+        missing = obs[node_ids[obs] == -1]
+        if missing.size:
+            # raises for the missing taxon as get_rare_unique does
+            get_rare_unique(trie, [obs_taxa[missing[0]]], rare_threshold)
+
+        rare = [obs_taxa[i] for i in obs[is_rare[obs]]]
+        unique = [obs_taxa[i] for i in obs[is_unique[obs]]]
+        yield (sample_id, rare, unique)
+
+
+def sample_rare_unique(tree, table, all_sample_taxa, rare_threshold):
+    """Get the rare and unique taxa per sample
+
+    returns (sample_id, biom table w/o rare and uniques, rare, unique)
+
+    Every filtered table is a copy. Use sample_rare_unique_masks to avoid
+    copying the table for every sample.
+    """
+    if table is None:
+        tree = as_trie(tree)
+        for sample_id, sample_taxa in all_sample_taxa.iteritems():
+            rare, unique = get_rare_unique(tree, sample_taxa, rare_threshold)
             yield (sample_id, None, rare, unique)
-        else:
-            filtered = table.filter(filter_f, axis='observation',
+    else:
+        obs_ids = table.ids(axis='observation')
+        it = sample_rare_unique_masks(tree, table, all_sample_taxa,
+                                      rare_threshold)
+        for sample_id, mask, rare, unique in it:
+            filtered = table.filter(obs_ids[mask], axis='observation',
                                     inplace=False)
             yield (sample_id, filtered, rare, unique)
+
+
+class PopulationTree(object):
+    """A population tree which can be updated with samples as they arrive
+
+    The tree is kept with the set of samples counted into it, and the nodes
+    each sample was counted at, so that samples can be added or removed
+    without recounting the population. Nodes which no longer have any
+    samples beneath them are retained with a popcount of 0.
+    """
+    __slots__ = ('tree', 'samples')
+
+    def __init__(self, tree=None, samples=None):
+        self.tree = TaxonTrie() if tree is None else tree
+        self.samples = {} if samples is None else samples
+
+    def __contains__(self, sample_id):
+        return sample_id in self.samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add_samples(self, table, sample_ids=None):
+        """Count samples of a taxon table into the population
+
+        table      : a biom taxon table
+        sample_ids : the samples to count, all of the samples in the table
+                     if None
+
+        Samples which have already been counted are skipped. Returns the
+        list of samples added.
+        """
+        if sample_ids is None:
+            sample_ids = table.ids()
+        new_ids = [i for i in sample_ids if i not in self.samples]
+        if not new_ids:
+            return []
+
+        obs_taxa, sample_obs = sample_observations(table, new_ids)
+
+        trie = self.tree
+        paths = {}
+        for sample_id in new_ids:
+            nodes = []
+            for obs_idx in sample_obs[sample_id]:
+                if obs_idx not in paths:
+                    paths[obs_idx] = trie.add(_informative(obs_taxa[obs_idx]))
+                nodes.extend(paths[obs_idx])
+            self.samples[sample_id] = np.unique(np.asarray(nodes,
+                                                           dtype=np.int64))
+
+        counts = np.bincount(np.concatenate([self.samples[i]
+                                             for i in new_ids]),
+                             minlength=len(trie))
+        counts[0] = len(new_ids)
+        self._adjust(counts)
+        return new_ids
+
+    def remove_samples(self, sample_ids):
+        """Remove samples from the population
+
+        Samples which have not been counted are ignored. Returns the list of
+        samples removed.
+        """
+        removed = [i for i in sample_ids if i in self.samples]
+        counts = np.zeros(len(self.tree), dtype=np.int64)
+        for sample_id in removed:
+            counts[self.samples.pop(sample_id)] -= 1
+        counts[0] = -len(removed)
+        self._adjust(counts)
+        return removed
+
+    def _adjust(self, delta):
+        """Add an array of per-node changes to the popcounts"""
+        counts = np.asarray(self.tree.counts, dtype=np.int64)
+        counts[:len(delta)] += delta
+        self.tree.counts = counts.tolist()
+
+    def save(self, path):
+        """Write the population to a JSON file"""
+        trie = self.tree
+        state = {'names': trie.names,
+                 'parents': trie.parents,
+                 'counts': trie.counts,
+                 'samples': {k: v.tolist() for k, v in self.samples.items()}}
+        with open(path, 'w') as fp:
+            json.dump(state, fp)
+
+    @classmethod
+    def load(cls, path):
+        """Read a population written by save"""
+        with open(path) as fp:
+            state = json.load(fp)
+
+        trie = TaxonTrie.from_parents(state['names'], state['parents'])
+        trie.counts = state['counts']
+
+        samples = {k: np.asarray(v, dtype=np.int64)
+                   for k, v in state['samples'].items()}
+        return cls(trie, samples)
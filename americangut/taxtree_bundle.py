@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+import json
+import multiprocessing as mp
+import os
+import struct
+import zlib
+from itertools import izip
+
+import numpy as np
+
+import americangut.notebook_environment as agenv
+from americangut.taxtree import TaxonTrie, materialize_tree
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+# A bundle is laid out as
+#
+#   MAGIC
+#   one zlib compressed block per sample
+#   the zlib compressed JSON index
+#   the offset and length of the index, as little-endian uint64, and MAGIC
+#
+# A sample block holds the number of nodes as a uint32, the IDs of the nodes
+# in the shared tree as uint32 and their counts as float64, all little-endian.
+# The index holds the names and parents of the nodes of the shared tree, and
+# the offset and length of the block of each sample.
+MAGIC = b'AGTREES1'
+_FOOTER = struct.Struct('<QQ8s')
+_COUNT = struct.Struct('<I')
+
+# The trees being written. Set prior to forking the worker pool.
+_TREES = None
+
+
+def encode_sample(node_ids, counts):
+    """Encode the nodes of a sample tree as a bundle block
+
+    Parameters
+    ----------
+    node_ids : np.array of int
+        The nodes of the shared tree in the sample, in materialization order.
+    counts : np.array of float
+        The counts of the nodes.
+
+    Returns
+    -------
+    str
+        The compressed block.
+    """
+    raw = (_COUNT.pack(len(node_ids)) +
+           np.asarray(node_ids, dtype='<u4').tostring() +
+           np.asarray(counts, dtype='<f8').tostring())
+    return zlib.compress(raw)
+
+
+def decode_sample(block):
+    """Decode a bundle block
+
+    Parameters
+    ----------
+    block : str
+        A block as produced by encode_sample.
+
+    Returns
+    -------
+    np.array of int
+        The nodes of the shared tree in the sample.
+    np.array of float
+        The counts of the nodes.
+    """
+    raw = zlib.decompress(block)
+    n = _COUNT.unpack_from(raw)[0]
+    start = _COUNT.size
+    node_ids = np.frombuffer(raw, dtype='<u4', count=n, offset=start)
+    counts = np.frombuffer(raw, dtype='<f8', count=n, offset=start + 4 * n)
+    return node_ids.astype(int), counts.astype(float)
+
+
+def _encode(sample_id):
+    return encode_sample(*_TREES.sample_nodes(sample_id))
+
+
+def write_bundle(trees, path, processes=None):
+    """Write all of the per-sample trees of a table to one bundle
+
+    Parameters
+    ----------
+    trees : americangut.taxtree.PerSampleTrees
+        The trees to write.
+    path : str
+        The path to write the bundle to. The bundle is written to a temporary
+        file which is moved into place once complete.
+    processes : int, optional
+        The number of processes to encode samples with. Defaults to the
+        available CPUs.
+    """
+    global _TREES
+
+    if processes is None:
+        processes = agenv.get_cpu_count()
+
+    sample_ids = list(trees.sample_ids)
+    chunksize = max(1, len(sample_ids) // (processes * 16))
+
+    _TREES = trees
+    pool = None
+    try:
+        if processes > 1:
+            pool = mp.Pool(processes=processes)
+            blocks = pool.imap(_encode, sample_ids, chunksize)
+        else:
+            blocks = (_encode(id_) for id_ in sample_ids)
+
+        tmp_path = path + '.tmp'
+        offsets = []
+        with open(tmp_path, 'wb') as fp:
+            fp.write(MAGIC)
+            offset = len(MAGIC)
+            for id_, block in izip(sample_ids, blocks):
+                fp.write(block)
+                offsets.append([id_, offset, len(block)])
+                offset += len(block)
+
+            index = zlib.compress(json.dumps({'names': trees.tree.names,
+                                              'parents': trees.tree.parents,
+                                              'samples': offsets}))
+            fp.write(index)
+            fp.write(_FOOTER.pack(offset, len(index), MAGIC))
+        os.rename(tmp_path, path)
+    finally:
+        _TREES = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class TreeBundle(object):
+    """Random access to the per-sample trees of a bundle
+
+    Parameters
+    ----------
+    path : str
+        The path to a bundle written by write_bundle.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a bundle.
+    """
+    def __init__(self, path):
+        self._fp = open(path, 'rb')
+        try:
+            self._fp.seek(-_FOOTER.size, os.SEEK_END)
+            offset, length, magic = _FOOTER.unpack(self._fp.read())
+        except (IOError, struct.error):
+            magic = None
+
+        if magic != MAGIC:
+            self._fp.close()
+            raise ValueError("%s is not a tree bundle" % path)
+
+        self._fp.seek(offset)
+        index = json.loads(zlib.decompress(self._fp.read(length)))
+
+        self.tree = TaxonTrie.from_parents(index['names'], index['parents'])
+        self.sample_ids = [id_ for id_, _, _ in index['samples']]
+        self._blocks = {id_: (start, size)
+                        for id_, start, size in index['samples']}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, sample_id):
+        return sample_id in self._blocks
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def close(self):
+        """Close the underlying file"""
+        self._fp.close()
+
+    def sample_nodes(self, sample_id):
+        """Get the nodes of the tree of a sample
+
+        Parameters
+        ----------
+        sample_id : str
+            The sample to get.
+
+        Returns
+        -------
+        np.array of int
+            The nodes of the shared tree in the sample, root first.
+        np.array of float
+            The counts of the nodes.
+
+        Raises
+        ------
+        KeyError
+            If the sample is not in the bundle.
+        """
+        start, size = self._blocks[sample_id]
+        self._fp.seek(start)
+        return decode_sample(self._fp.read(size))
+
+    def sample_tree(self, sample_id):
+        """Materialize the tree of a sample
+
+        Parameters
+        ----------
+        sample_id : str
+            The sample to get.
+
+        Returns
+        -------
+        dict
+            The tree as produced by
+            americangut.taxtree.build_persample_tree_from_taxontable.
+
+        Raises
+        ------
+        KeyError
+            If the sample is not in the bundle.
+        """
+        return materialize_tree(self.tree, *self.sample_nodes(sample_id))
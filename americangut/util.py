@@ -1,22 +1,31 @@
 #!/usr/bin/env python
 
 import os
+import marshal
+import tempfile
 import urllib2
 import gzip
 import time
+import zlib
 
 import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix
 
-from itertools import izip
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 from StringIO import StringIO
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import partial
+from itertools import islice
 from biom import Table
 
 from lxml import etree
-from skbio.parse.sequences import parse_fastq, parse_fasta
+from skbio.parse.sequences import parse_fasta
 
 import americangut as ag
+import americangut.fasta as agf
+import americangut.metadata as agmd
 
 
 __author__ = "Daniel McDonald"
@@ -113,6 +122,9 @@ def get_existing_path(path):
 def parse_mapping_file(open_file):
     """return (header, [(sample_id, all_other_fields)])
 
+    Every line after the header is split at its first tab, including
+    comment lines and rows with a different number of fields. Use
+    americangut.metadata to load a mapping file by column.
     """
     header = open_file.readline().strip()
     res = []
@@ -158,13 +170,10 @@ def trim_fasta(input_fasta, output_fasta, length):
     length: what length to trim the sequences to. Sequences shorter than
             length will not be modified.
     """
-    # reads the FASTA file two lines at at a time
+    # reads the FASTA file in blocks of whole records
     # Assumptions: 1) each FASTA record is two lines
     #              2) There are no incomplete FASTA records
-    for header, sequence in izip(input_fasta, input_fasta):
-        header = header.strip()
-        sequence = sequence.strip()[:length]
-        output_fasta.write("%s\n%s\n" % (header, sequence))
+    agf.trim_records(input_fasta, output_fasta, length)
 
 
 def concatenate_files(input_files, output_file, read_chunk=10000):
@@ -185,10 +194,10 @@ def fetch_study_details(accession):
 
     yields [(secondary_accession, fastq_url)]
     """
-    url_fmt = "http://www.ebi.ac.uk/ena/data/warehouse/" \
+    url_fmt = "%(base)s/warehouse/" \
               "filereport?accession=%(accession)s&result=read_run&" \
               "fields=secondary_sample_accession,submitted_ftp"
-    res = fetch_url(url_fmt % {'accession': accession})
+    res = fetch_url(url_fmt % {'base': ag.ena_url(), 'accession': accession})
 
     for line in res.readlines()[1:]:
         if 'ERA371447' in line:
@@ -204,49 +213,210 @@ def fetch_study_details(accession):
             yield tuple(parts)
 
 
-def fetch_url(url):
-    """Return an open file handle"""
-    # really should use requests instead of urllib2
-    attempts = 0
-    res = None
+# Seconds to wait before retrying a request which failed with a server error
+RETRY_WAIT = 5
+
+
+def open_url(url, attempts=5):
+    """Open a URL, retrying if the server errors
+
+    Parameters
+    ----------
+    url : str
+        The URL to open.
+    attempts : int, optional
+        The number of times to try. Requests which fail with a HTTP 500 are
+        retried after RETRY_WAIT seconds.
+
+    Returns
+    -------
+    file-like
+        The response, which has not been read.
 
-    while attempts < 5:
-        attempts += 1
+    Raises
+    ------
+    ValueError
+        If every attempt failed with a HTTP 500.
+    urllib2.HTTPError
+        If the request failed with any other HTTP error.
+    """
+    for _ in range(attempts):
         try:
-            res = urllib2.urlopen(url)
+            return urllib2.urlopen(url)
         except urllib2.HTTPError as e:
             if e.code == 500:
-                time.sleep(5)
+                time.sleep(RETRY_WAIT)
                 continue
             else:
                 raise
 
-    if res is None:
-        raise ValueError("Failed at fetching %s" % url)
+    raise ValueError("Failed at fetching %s" % url)
 
-    return StringIO(res.read())
 
+def fetch_url(url):
+    """Return an open file handle"""
+    res = open_url(url)
+    try:
+        return StringIO(res.read())
+    finally:
+        res.close()
 
-def fetch_seqs_fastq(url):
-    """Fetch a FTP item"""
+
+def _fastq_url(url):
+    """Qualify a FASTQ location, which ENA reports without a scheme"""
     # not using a url_fmt here as the directory structure has potential to
     # be different between studies
-    if not url.startswith('ftp://'):
+    if '://' not in url:
         url = "ftp://%s" % url
+    return url
+
 
-    res = fetch_url(url)
+def fetch_seqs_fastq(url):
+    """Fetch a FTP item"""
+    res = fetch_url(_fastq_url(url))
 
     return gzip.GzipFile(fileobj=res)
 
 
+def _metadata_url(accession):
+    """Get the URL of the XML metadata of a sample"""
+    return "%(base)s/view/%(accession)s&display=xml" % \
+        {'base': ag.ena_url(), 'accession': accession}
+
+
 def fetch_metadata_xml(accession):
     """Fetch sample metadata"""
-    url_fmt = "http://www.ebi.ac.uk/ena/data/view/%(accession)s&display=xml"
-    res = fetch_url(url_fmt % {'accession': accession})
+    res = fetch_url(_metadata_url(accession))
     metadata = xml_to_dict(res)
     return metadata
 
 
+def _gunzip_chunks(fp, chunk_size):
+    """Decompress a gzip stream incrementally
+
+    Concatenated gzip members are handled as gzip does.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunk = fp.read(chunk_size)
+    while chunk:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+
+        chunk = decompressor.unused_data
+        if chunk:
+            # a new member begins
+            yield decompressor.flush()
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            chunk = fp.read(chunk_size)
+
+    yield decompressor.flush()
+
+
+def _lines(chunks):
+    """Split a stream of chunks into lines, without line endings"""
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line
+    if partial:
+        yield partial
+
+
+def fastq_to_fasta(chunks, fasta_out):
+    """Write the records of a FASTQ stream as FASTA
+
+    Parameters
+    ----------
+    chunks : Iterable of str
+        The FASTQ data, split arbitrarily.
+    fasta_out : file-like
+        Where to write the records.
+
+    Returns
+    -------
+    int
+        The number of records written.
+
+    Raises
+    ------
+    ValueError
+        If the FASTQ data are malformed.
+
+    Notes
+    -----
+    Records are expected to be four lines, as ENA provides them. The
+    quality scores are not validated.
+    """
+    lines = _lines(chunks)
+    count = 0
+    for header in lines:
+        header = header.strip()
+        if not header:
+            continue
+
+        try:
+            seq = next(lines)
+            qual_header = next(lines)
+            next(lines)
+        except StopIteration:
+            raise ValueError("Incomplete FASTQ record found at end of file")
+
+        if not header.startswith('@') or not qual_header.startswith('+'):
+            raise ValueError("Malformed FASTQ record: %s" % header)
+
+        fasta_out.write(">%s\n%s\n" % (header[1:], seq.strip()))
+        count += 1
+    return count
+
+
+def _write_atomic(path, write_f):
+    """Write a file through a temporary file which is moved into place
+
+    Interrupted writes leave only the temporary file behind, so the
+    existence of the path implies it is complete.
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as fp:
+            result = write_f(fp)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return result
+
+
+def stream_seqs_fasta(url, fasta_path, chunk_size=2 ** 16):
+    """Fetch gzipped FASTQ and write it as FASTA
+
+    Parameters
+    ----------
+    url : str
+        The location of the gzipped FASTQ.
+    fasta_path : str
+        The path to write the FASTA to. It is written atomically.
+    chunk_size : int, optional
+        The number of bytes to read at a time. Memory use is bounded by this
+        rather than by the size of the file.
+
+    Returns
+    -------
+    int
+        The number of sequences written.
+    """
+    res = open_url(_fastq_url(url))
+    try:
+        return _write_atomic(fasta_path, lambda fp: fastq_to_fasta(
+            _gunzip_chunks(res, chunk_size), fp))
+    finally:
+        res.close()
+
+
 def xml_to_dict(xml_fp):
     """ Converts xml string to a dictionary
 
@@ -279,7 +449,16 @@ def xml_to_dict(xml_fp):
     return barcode, metadata
 
 
-def from_xmls_to_mapping_file(xml_paths, mapping_fp):
+def _xml_records(xml_paths):
+    """Parse sample XMLs to (barcode, metadata)"""
+    return [xml_to_dict(xml_fp) for xml_fp in xml_paths]
+
+
+# The number of sample XMLs parsed as a unit when building a mapping file
+XML_CHUNK_SIZE = 64
+
+
+def from_xmls_to_mapping_file(xml_paths, mapping_fp, processes=1):
     """ Create a mapping file from multiple xml strings
 
     Accepts a list of xml paths, reads them and
@@ -291,27 +470,123 @@ def from_xmls_to_mapping_file(xml_paths, mapping_fp):
        List of file paths for xml files
     mapping_fp : str
        File path for the resulting mapping file
+    processes : int, optional
+       The number of processes to parse the xml files with
+
+    Notes
+    -----
+    The parsed metadata are spooled to a temporary file while the union of
+    the metadata categories is found, and then written out one sample at a
+    time, so only a chunk of samples per process is held in memory. Columns
+    are sorted, and samples are written in the order of `xml_paths`. If a
+    barcode is repeated, the last xml file with that barcode is used.
     """
-    all_md = {}
     all_cols = set(['BarcodeSequence', 'LinkerPrimerSequence'])
-    for xml_fp in xml_paths:
-        bc, md = xml_to_dict(xml_fp)
-        all_md[bc] = md
-        all_cols.update(md)
-    with open(mapping_fp, 'w') as md_f:
-        header = list(all_cols)
-        md_f.write('#SampleID\t')
-        md_f.write('\t'.join(header))
-        md_f.write('\n')
-        for sampleid, values in all_md.iteritems():
-            to_write = [values.get(k, "no_data").encode('utf-8')
-                        for k in header]
-            to_write.insert(0, sampleid)
-            md_f.write('\t'.join(to_write))
+    last = {}
+    spool = tempfile.TemporaryFile()
+    try:
+        n_samples = 0
+        for records in map_row_chunks(_xml_records, xml_paths, processes,
+                                      XML_CHUNK_SIZE):
+            for barcode, metadata in records:
+                last[barcode] = n_samples
+                all_cols.update(metadata)
+                marshal.dump((barcode, metadata), spool)
+                n_samples += 1
+
+        header = sorted(all_cols)
+        spool.seek(0)
+        with open(mapping_fp, 'w') as md_f:
+            md_f.write('#SampleID\t')
+            md_f.write('\t'.join(header))
             md_f.write('\n')
+            for index in xrange(n_samples):
+                sampleid, values = marshal.load(spool)
+                if last[sampleid] != index:
+                    continue
+
+                to_write = [values.get(k, "no_data").encode('utf-8')
+                            for k in header]
+                to_write.insert(0, sampleid)
+                md_f.write('\t'.join(to_write))
+                md_f.write('\n')
+    finally:
+        spool.close()
+
+
+def fetch_sample(study_dir, sample, fastq_url):
+    """Fetch the sequences and metadata of a sample
+
+    Parameters
+    ----------
+    study_dir : str
+        The directory of the study. The sample is written to a directory of
+        its own within it.
+    sample : str
+        The sample accession.
+    fastq_url : str
+        The location of the gzipped FASTQ of the sample.
+
+    Returns
+    -------
+    bool
+        Whether the sample was fetched. Samples which were already fetched are
+        not fetched again.
+    """
+    sample_dir = os.path.join(study_dir, sample)
+    metadata_path = os.path.join(sample_dir, '%s.txt' % sample)
+    fasta_path = os.path.join(sample_dir, '%s.fna' % sample)
+
+    # the metadata are written last, and only once the sequences are complete
+    if os.path.exists(metadata_path):
+        return False
+
+    if not os.path.exists(sample_dir):
+        os.mkdir(sample_dir)
+
+    if not os.path.exists(fasta_path):
+        stream_seqs_fasta(fastq_url, fasta_path)
+
+    res = open_url(_metadata_url(sample))
+    try:
+        _write_atomic(metadata_path,
+                      lambda fp: concatenate_files([res], fp, 2 ** 16))
+    finally:
+        res.close()
+
+    return True
+
+
+def fetch_samples(study_dir, samples, threads=8):
+    """Fetch samples concurrently
+
+    Parameters
+    ----------
+    study_dir : str
+        The directory of the study.
+    samples : Iterable of (str, str)
+        The sample accessions and FASTQ locations, as yielded by
+        fetch_study_details.
+    threads : int, optional
+        The number of samples to fetch at once.
+
+    Returns
+    -------
+    int
+        The number of samples fetched.
+    """
+    def fetch(item):
+        return fetch_sample(study_dir, *item)
+
+    pool = ThreadPool(threads)
+    try:
+        return sum(pool.imap_unordered(fetch, samples))
+    finally:
+        pool.close()
+        pool.join()
 
 
-def fetch_study(study_accession, base_dir):
+def fetch_study(study_accession, base_dir, threads=8):
     """Fetch and dump a study
 
     Grab and dump a study.  If sample_accessions
@@ -325,12 +600,17 @@ def fetch_study(study_accession, base_dir):
        Accession ID for the study
     base_dir : str
        Path of base directory to save the fetched results
+    threads : int, optional
+       The number of samples to fetch at once
 
     Note
     ----
-    If sample_accession is None, then the entire study will be fetched
+    If sample_accession is None, then the entire study will be fetched.
+    Samples are written atomically, so an interrupted fetch can be resumed
+    by fetching the study again.
     """
-    if ag.is_test_env():
+    # under test, only fetch from a local stand-in for ENA
+    if ag.is_test_env() and ag.is_live_ena():
         return 0
 
     study_dir = os.path.join(base_dir, study_accession)
@@ -340,94 +620,66 @@ def fetch_study(study_accession, base_dir):
     elif not os.path.exists(study_dir):
         os.mkdir(study_dir)
 
-    new_samples = 0
-
-    for sample, fastq_url in fetch_study_details(study_accession):
-        sample_dir = os.path.join(study_dir, sample)
-        if not os.path.exists(sample_dir):
-            # fetch files if it isn't already present
-            os.mkdir(sample_dir)
-            metadata_path = os.path.join(sample_dir,
-                                         '%s.txt' % sample)
-            fasta_path = os.path.join(sample_dir,
-                                      '%s.fna' % sample)
-            # write out fasta
-            with open(fasta_path, 'w') as fasta_out:
-                for id_, seq, qual in parse_fastq(fetch_seqs_fastq(fastq_url)):
-                    fasta_out.write(">%s\n%s\n" % (id_, seq))
-            # write mapping xml
-            url_fmt = "http://www.ebi.ac.uk/ena/data/view/" + \
-                      "%(accession)s&display=xml"
-            res = fetch_url(url_fmt % {'accession': sample})
-            with open(metadata_path, 'w') as md_f:
-                md_f.write(res.read())
-
-            new_samples += 1
-    return new_samples
+    return fetch_samples(study_dir, fetch_study_details(study_accession),
+                         threads)
 
 
 def count_seqs(seqs_fp, subset=None):
-    """Could the number of FASTA records"""
-    if subset is None:
+    """Could the number of FASTA records
+
+    Uncompressed files opened from disk are scanned in blocks rather than
+    parsed. Use americangut.fasta.SequenceIndex to count repeatedly.
+    """
+    if _is_unread_file(seqs_fp) and not agf.is_gzip(seqs_fp.name):
+        if subset is None:
+            return agf.count_records(seqs_fp.name)
+        ids = agf.record_ids(seqs_fp.name)
+    elif subset is None:
         return sum(1 for line in seqs_fp if line.startswith(">"))
     else:
-        subset = set(subset)
-        count = 0
-        for id_, seq in parse_fasta(seqs_fp):
-            parts = id_.split()
-
-            # check if the ID is there, and handle the qiimedb suffix case
-            if parts[0] in subset:
-                count += 1
-            elif parts[0].split('.')[0] in subset:
-                count += 1
-        return count
+        ids = (id_.split()[0] for id_, seq in parse_fasta(seqs_fp))
 
+    subset = set(subset)
+    count = 0
+    for id_ in ids:
+        # check if the ID is there, and handle the qiimedb suffix case
+        if id_ in subset:
+            count += 1
+        elif id_.split('.')[0] in subset:
+            count += 1
+    return count
 
-def count_unique_participants(metadata_fp, criteria=None):
-    """Count the number of unique participants"""
-    if criteria is None:
-        criteria = {}
 
-    header = {k: i for i, k in enumerate(
-              metadata_fp.next().strip().split('\t'))}
+def _is_unread_file(fp):
+    """Whether an object is a file on disk which has not been read from"""
+    return (isinstance(fp, file) and os.path.isfile(fp.name) and
+            fp.tell() == 0)
 
-    count = set()
-    for line in metadata_fp:
-        line = line.strip().split('\t')
-        keep = True
-        for crit, val in criteria.items():
-            if line[header[crit]] != val:
-                keep = False
-        if keep:
-            count.add(line[header['HOST_SUBJECT_ID']])
 
-    return len(count)
+def _load_metadata(metadata_fp):
+    """Load an open mapping file, using its sidecar if it is on disk"""
+    if _is_unread_file(metadata_fp):
+        return agmd.load(metadata_fp.name)
+    return agmd.Metadata.from_lines(metadata_fp)
 
 
-def count_samples(metadata_fp, criteria=None):
-    """Count the number of samples
+def count_unique_participants(metadata_fp, criteria=None):
+    """Count the number of unique participants
 
     criteria : dict
         Header keys and values to restrict by
     """
-    if criteria is None:
-        criteria = {}
+    md = _load_metadata(metadata_fp)
+    return md.count(criteria, unique='HOST_SUBJECT_ID')
 
-    header = {k: i for i, k in enumerate(
-              metadata_fp.next().strip().split('\t'))}
 
-    count = 0
-    for line in metadata_fp:
-        line = line.strip().split('\t')
-        keep = True
-        for crit, val in criteria.items():
-            if line[header[crit]] != val:
-                keep = False
-        if keep:
-            count += 1
+def count_samples(metadata_fp, criteria=None):
+    """Count the number of samples
 
-    return count
+    criteria : dict
+        Header keys and values to restrict by
+    """
+    return _load_metadata(metadata_fp).count(criteria)
 
 
 simple_matter_map = {
@@ -460,35 +712,54 @@ simple_matter_map = {
 }
 
 
-def clean_and_reformat_mapping(in_fp, out_fp, body_site_column_name,
-                               exp_acronym):
-    """Simplify the mapping file for use in figures
-
-    in_fp : input file-like object
-    out_fp : output file-like object
-    body_site_column_name : specify the column name for body
-    exp_acronym : short name for the study
-
-    Returns a dict containing a description of any unprocessed samples.
-    """
-    errors = defaultdict(list)
-
-    mapping_lines = [l.strip('\n').split('\t') for l in in_fp]
+# The number of mapping file rows processed as a unit when streaming
+MAPPING_CHUNK_ROWS = 2000
 
-    header = mapping_lines[0]
-    header_low = [x.lower() for x in header]
 
-    bodysite_idx = header_low.index(body_site_column_name.lower())
-    country_idx = header_low.index('country')
+def map_row_chunks(func, rows, processes=1, chunk_rows=None):
+    """Apply a function to successive chunks of rows
 
-    new_mapping_lines = [header[:]]
-    new_mapping_lines[0].append('SIMPLE_BODY_SITE')
-    new_mapping_lines[0].append('TITLE_ACRONYM')
-    new_mapping_lines[0].append('TITLE_BODY_SITE')
-    new_mapping_lines[0].append('HMP_SITE')
+    func : a function of a list of rows. It must be defined at module level
+        if more than one process is used.
+    rows : an iterable of rows, which is consumed lazily
+    processes : the number of processes to apply the function with
+    chunk_rows : the number of rows in each chunk. Defaults to
+        MAPPING_CHUNK_ROWS.
 
-    for l in mapping_lines[1:]:
-        new_line = l[:]
+    Yields the result for each chunk, in order. At most two chunks per process
+    are held at once, so memory does not grow with the number of rows.
+    """
+    if chunk_rows is None:
+        chunk_rows = MAPPING_CHUNK_ROWS
+
+    rows = iter(rows)
+    chunks = iter(lambda: list(islice(rows, chunk_rows)), [])
+
+    if processes <= 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+
+    pool = mp.Pool(processes=processes)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(func, (chunk, )))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _reformat_rows(bodysite_idx, country_idx, exp_acronym, rows):
+    """Reformat mapping rows, returning the kept rows and the failures"""
+    new_rows = []
+    failures = []
+    for new_line in rows:
         sample_id = new_line[0]
         body_site = new_line[bodysite_idx]
         country = new_line[country_idx]
@@ -500,14 +771,14 @@ def clean_and_reformat_mapping(in_fp, out_fp, body_site_column_name,
             body_site = body_site.split(':', 1)[-1]
         elif body_site in ['NA', 'unknown', '', 'no_data', 'None', 'Unknown',
                            'Unspecified']:
-            errors[('unspecified_bodysite', body_site)].append(sample_id)
+            failures.append((('unspecified_bodysite', body_site), sample_id))
             continue
         else:
             raise ValueError("Cannot process: %s, %s" % (sample_id, body_site))
 
         # remap the body site
         if body_site.lower() not in simple_matter_map:
-            errors[('unknown_bodysite', body_site)].append(sample_id)
+            failures.append((('unknown_bodysite', body_site), sample_id))
             continue
         else:
             body_site = simple_matter_map[body_site.lower()]
@@ -526,11 +797,48 @@ def clean_and_reformat_mapping(in_fp, out_fp, body_site_column_name,
         new_line.append("%s-%s" % (exp_acronym, body_site))
         new_line.append(hmp_site)
 
-        new_mapping_lines.append(new_line)
+        new_rows.append('\t'.join(new_line))
+
+    return new_rows, failures
+
+
+def clean_and_reformat_mapping(in_fp, out_fp, body_site_column_name,
+                               exp_acronym, processes=1):
+    """Simplify the mapping file for use in figures
+
+    in_fp : input file-like object
+    out_fp : output file-like object
+    body_site_column_name : specify the column name for body
+    exp_acronym : short name for the study
+    processes : the number of processes to reformat rows with
+
+    The mapping file is streamed, so rows are written as they are processed.
+
+    Returns a dict containing a description of any unprocessed samples.
+    """
+    errors = defaultdict(list)
+
+    rows = (l.strip('\n').split('\t') for l in in_fp)
+
+    header = next(rows)
+    header_low = [x.lower() for x in header]
+
+    bodysite_idx = header_low.index(body_site_column_name.lower())
+    country_idx = header_low.index('country')
 
-    out_fp.write('\n'.join(['\t'.join(l) for l in new_mapping_lines]))
+    new_header = header + ['SIMPLE_BODY_SITE', 'TITLE_ACRONYM',
+                           'TITLE_BODY_SITE', 'HMP_SITE']
+    out_fp.write('\t'.join(new_header))
     out_fp.write('\n')
 
+    reformat = partial(_reformat_rows, bodysite_idx, country_idx, exp_acronym)
+    for new_rows, failures in map_row_chunks(reformat, rows, processes):
+        for row in new_rows:
+            out_fp.write(row)
+            out_fp.write('\n')
+        for key, sample_id in failures:
+            errors[key].append(sample_id)
+
     return errors
 
 
@@ -566,7 +874,7 @@ def add_alpha_diversity(map_, alphas):
     return alpha_map_
 
 
-def get_single_id_lists(map_, depths):
+def get_single_id_lists(map_, depths, seed=None, draws=None):
     """Identifies a single sample per individual
 
     Single samples are identified based on host subject id, and then by
@@ -585,58 +893,62 @@ def get_single_id_lists(map_, depths):
     depths: iterable
         The rarefaction depths used for analysis. Depths may be an iterable
         of floats or castable strings.
+    seed : int, optional
+        The seed for the random selection. By default the global numpy
+        random state is used.
+    draws : int, optional
+        The number of independent selections to make.
 
     Returns
     -------
-    single_ids : dict
+    single_ids : dict or list of dict
         A dictionary keyed by rarefaction depth, where each value is a list
-        of samples representing a single sample from each subject.
+        of samples representing a single sample from each subject. If `draws`
+        is given, a list of such dictionaries is returned, one per draw.
 
+    Notes
+    -----
+    Each sample is assigned the highest depth it meets with a binary search,
+    and the samples are sorted by subject, by that depth and by a random key,
+    so the first sample of each subject is its selection.
     """
-    # Determines the numebr of depths and sorts the list
-    num_depths = len(depths)
-    depths = sorted(depths)
-
-    # Sets up the output
-    single_ids = {depth: [] for depth in depths}
-    single_ids['unrare'] = []
-
-    # Casts the depths column explictly to a float
-    map_['depth'] = map_['depth'].astype(float)
-
-    for hsi, subject in map_.groupby('HOST_SUBJECT_ID'):
-        # For each depth, we check to see if there is one or more samples that
-        # have suffecient sequences for that depth. If there is a sample
-        # which meets the depth requirement, one is chosen at random from
-        # the avaliable set of samples, and no additonal depths are considered
-        for depth_id, depth in enumerate(depths[::-1]):
-            if (subject['depth'] >= float(depth)).any():
-                # Chooses one sample at random
-                id_ = np.random.choice(
-                    subject.loc[subject['depth'] >= float(depth)].index,
-                    replace=False
-                    )
-                single_ids[depth].append(id_)
-                break
-        # If a subject does not have suffecient sequences to meet the
-        # subsampling requirements for the lowest rarefaction depth,
-        # a sample is selected at random and included in the unrarefied list.
-        else:
-            # A sample does not exist at the lowest depth. However, it falls
-            # into the full list
-            single_ids['unrare'].append(
-                np.random.choice(subject.index, replace=False)
-            )
-
-    # Updates the list so lower rarefaction depths inheriet the ids at higher
-    # depths
-    for idx, lowest in zip(*(np.arange(num_depths, 0, -1) - 1, depths[::-1])):
-        if idx == 0:
-            single_ids['unrare'].extend(single_ids[depth])
-        else:
-            single_ids[depths[idx - 1]].extend(single_ids[depths[idx]])
+    depths = sorted(depths, key=float)
+    thresholds = np.array([float(d) for d in depths])
 
-    return single_ids
+    # The index of the highest depth each sample meets, or -1 for none
+    sample_depths = map_['depth'].values.astype(float)
+    buckets = np.searchsorted(thresholds, sample_depths, side='right') - 1
+    buckets[np.isnan(sample_depths)] = -1
+
+    subjects, _ = pd.factorize(map_['HOST_SUBJECT_ID'], sort=True)
+    has_subject = subjects >= 0
+    subjects = subjects[has_subject]
+    buckets = buckets[has_subject]
+    ids = np.asarray(map_.index)[has_subject]
+
+    rng = np.random if seed is None else np.random.RandomState(seed)
+
+    results = []
+    for _ in range(1 if draws is None else draws):
+        order = np.lexsort((rng.random_sample(len(ids)), -buckets, subjects))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = subjects[order][1:] != subjects[order][:-1]
+        chosen = order[first]
+        chosen_buckets = buckets[chosen]
+
+        # Lower rarefaction depths inherit the ids at higher depths
+        single_ids = {}
+        inherited = []
+        for idx in range(len(depths) - 1, -1, -1):
+            inherited = ids[chosen[chosen_buckets == idx]].tolist() + \
+                inherited
+            single_ids[depths[idx]] = inherited
+        single_ids['unrare'] = ids[chosen[chosen_buckets == -1]].tolist() + \
+            inherited
+
+        results.append(single_ids)
+
+    return results[0] if draws is None else results
 
 
 def collapse_taxonomy(_bt, level=5):
@@ -659,19 +971,229 @@ def collapse_taxonomy(_bt, level=5):
     ---------
     [1] http://biom-format.org/documentation/table_objects.html
     """
-    def collapse_f(id_, md):
-        return '; '.join(md['taxonomy'][:level + 1])
-    collapsed = _bt.collapse(collapse_f, axis='observation', norm=False)
+    return collapse_taxonomy_levels(_bt, [level])[level]
+
+
+def collapse_taxonomy_levels(_bt, levels=(1, 2, 3, 4, 5)):
+    """Collapses OTUs by taxonomy at several levels at once
+
+    Parameters
+    ----------
+    _bt : biom table
+        Table to collapse
+    levels : Iterable of int, optional
+        Levels to collapse to. 0=kingdom, 1=phylum,...,5=genus, 6=species
+        Default phylum through genus
+
+    Returns
+    -------
+    dict of biom table
+        {level: table} of the collapsed tables, each as Table.collapse
+        would produce with norm=False, including the order of the taxa.
+
+    Notes
+    -----
+    The taxonomy is read once. Each level is then a product of a sparse
+    taxon by OTU membership matrix with the table.
+    """
+    obs_ids = _bt.ids(axis='observation')
+    taxa = [md['taxonomy'] for md in _bt.metadata(axis='observation')]
+    data = _bt.matrix_data.tocsr()
+
+    collapsed = {}
+    for level in levels:
+        # Table.collapse orders the taxa as a dict built in table order
+        groups = {}
+        codes = np.empty(len(taxa), dtype=int)
+        for i, taxon in enumerate(taxa):
+            codes[i] = groups.setdefault('; '.join(taxon[:level + 1]),
+                                         len(groups))
+        names = list(groups)
+        positions = np.empty(len(names), dtype=int)
+        positions[[groups[name] for name in names]] = np.arange(len(names))
+        codes = positions[codes]
+
+        membership = csr_matrix((np.ones(len(codes)),
+                                 (codes, np.arange(len(codes)))),
+                                shape=(len(names), len(codes)))
+
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        members = [{'collapsed_ids': obs_ids[order[a:b]].tolist()}
+                   for a, b in zip(bounds[:-1], bounds[1:])]
+
+        collapsed[level] = Table(membership.dot(data), names, _bt.ids()[:],
+                                 members, _bt.metadata(), _bt.table_id,
+                                 type=_bt.type)
     return collapsed
 
 
-def collapse_full(_bt):
+def sparse_quantiles(matrix, quantiles):
+    """Computes quantiles of each row of a sparse matrix
+
+    Parameters
+    ----------
+    matrix : scipy.sparse matrix
+        The data, with one row per observation
+    quantiles : iterable of float
+        The quantiles to compute, each in [0, 1]
+
+    Returns
+    -------
+    np.ndarray
+        (n_rows, n_quantiles) of the quantiles, interpolated linearly as by
+        np.percentile. The median is the 0.5 quantile.
+
+    Notes
+    -----
+    Only the stored values of each row are sorted. The implicit zeros of a
+    row are accounted for by their count, so rows are never densified.
+    """
+    matrix = csr_matrix(matrix)
+    n_rows, n_cols = matrix.shape
+    quantiles = np.asarray(quantiles, dtype=float)
+    result = np.empty((n_rows, len(quantiles)))
+    if n_cols == 0:
+        result.fill(np.nan)
+        return result
+
+    # sort the stored values within each row
+    rows = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    values = matrix.data[np.lexsort((matrix.data, rows))]
+    starts = matrix.indptr[:-1]
+    ends = matrix.indptr[1:]
+
+    # in sorted order a row is its negatives, then zeros, then positives
+    n_neg = np.bincount(rows[values < 0], minlength=n_rows)
+    n_pos = np.bincount(rows[values > 0], minlength=n_rows)
+
+    def order_statistic(k):
+        stat = np.zeros(n_rows)
+        neg = k < n_neg
+        stat[neg] = values[starts[neg] + k]
+        pos = k >= n_cols - n_pos
+        stat[pos] = values[ends[pos] + k - n_cols]
+        return stat
+
+    for i, q in enumerate(quantiles):
+        position = (n_cols - 1) * q
+        below = int(np.floor(position))
+        above = min(below + 1, n_cols - 1)
+        weight = position - below
+        result[:, i] = order_statistic(below) * (1 - weight) + \
+            order_statistic(above) * weight
+    return result
+
+
+# The number of observations summarized as a unit by summarize_observations
+SUMMARY_BLOCK_ROWS = 4096
+
+# The matrix being summarized. Set prior to forking the worker pool.
+_SUMMARY_MATRIX = None
+
+
+def _summarize_block(args):
+    start, end, quantiles = args
+    block = _SUMMARY_MATRIX[start:end]
+    means = np.asarray(block.sum(axis=1)).ravel() / block.shape[1]
+    return np.column_stack([means, sparse_quantiles(block, quantiles)])
+
+
+def summarize_observations(_bt, stats=('median', ), processes=1):
+    """Computes summary statistics of each OTU across samples
+
+    Parameters
+    ----------
+    _bt : biom table
+        Table to summarize
+    stats : iterable, optional
+        The statistics to compute: 'median', 'mean', or a float quantile in
+        [0, 1]
+    processes : int, optional
+        The number of processes to summarize blocks of OTUs with
+
+    Returns
+    -------
+    pd.DataFrame
+        The statistics, indexed by observation ID with a column per
+        statistic. All statistics are computed in one pass over the sparse
+        data, which is never densified.
+    """
+    global _SUMMARY_MATRIX
+
+    stats = list(stats)
+    quantiles = [0.5 if s == 'median' else s for s in stats if s != 'mean']
+
+    _SUMMARY_MATRIX = _bt.matrix_data.tocsr()
+    try:
+        n_rows = _SUMMARY_MATRIX.shape[0]
+        jobs = [(start, min(start + SUMMARY_BLOCK_ROWS, n_rows), quantiles)
+                for start in range(0, n_rows, SUMMARY_BLOCK_ROWS)]
+        if processes > 1 and len(jobs) > 1:
+            pool = mp.Pool(processes=processes)
+            try:
+                blocks = pool.map(_summarize_block, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            blocks = [_summarize_block(job) for job in jobs]
+    finally:
+        _SUMMARY_MATRIX = None
+
+    if blocks:
+        summary = np.vstack(blocks)
+    else:
+        summary = np.empty((0, len(quantiles) + 1))
+
+    columns = {}
+    quantile_column = 1
+    for stat in stats:
+        if stat == 'mean':
+            columns[stat] = summary[:, 0]
+        else:
+            columns[stat] = summary[:, quantile_column]
+            quantile_column += 1
+
+    return pd.DataFrame(columns, index=_bt.ids(axis='observation'),
+                        columns=stats)
+
+
+def collapse_summaries(_bt, stats=('median', 'mean'), processes=1):
+    """Collapses full biom table to summary statistics of each OTU
+
+    Parameters
+    ----------
+    _bt : biom table
+        Table to collapse
+    stats : iterable, optional
+        The statistics to collapse to, as for summarize_observations
+    processes : int, optional
+        The number of processes to summarize with
+
+    Returns
+    -------
+    biom table
+        Collapsed biom table, with a sample for each statistic, each
+        normalized.
+    """
+    summary = summarize_observations(_bt, stats, processes)
+    table = Table(summary.values, _bt.ids(axis='observation'),
+                  [str(s) for s in summary.columns],
+                  observation_metadata=_bt.metadata(axis='observation'))
+    table.norm(inplace=True)
+    return table
+
+
+def collapse_full(_bt, processes=1):
     """Collapses full biom table to median of each OTU
 
     Parameters
     ----------
     _bt : biom table
         Table to collapse
+    processes : int, optional
+        The number of processes to summarize with
 
     Returns
     -------
@@ -679,11 +1201,6 @@ def collapse_full(_bt):
         Collapsed biom table, one sample containing median of each OTU,
         normalized.
     """
-    num_obs = len(_bt.ids(axis='observation'))
-    table = Table(np.array(
-        [np.median(v) for v in _bt.iter_data(axis='observation')]).reshape(
-        (num_obs, 1)),
-        _bt.ids(axis='observation'), ['average'],
-        observation_metadata=_bt.metadata(axis='observation'))
-    table.norm(inplace=True)
+    table = collapse_summaries(_bt, ['median'], processes)
+    table.update_ids({'median': 'average'}, inplace=True)
     return table
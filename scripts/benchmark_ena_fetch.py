@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""Benchmark the sequence and metadata ingest against a local fake ENA
+
+The ingest of chapter 01 is run against americangut.fake_ena serving the
+test samples: the study is fetched, the per-sample FASTA are concatenated and
+the mapping file is built from the sample XML. The throughput in samples per
+second, and the peak memory of this process, are reported.
+"""
+
+import os
+import resource
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import americangut.fake_ena as agena
+import americangut.fasta as agf
+import americangut.notebook_environment as agenv
+import americangut.util as agu
+
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def ingest(study_accession, base_dir, threads):
+    """Run the chapter 01 ingest, returning the number of samples fetched"""
+    new_samples = agu.fetch_study(study_accession, base_dir, threads)
+
+    study_dir = os.path.join(base_dir, study_accession)
+    agf.concatenate_paths(agenv.get_files(study_dir, suffix='fna'),
+                          os.path.join(base_dir, 'sequences.fna'))
+
+    agu.from_xmls_to_mapping_file(agenv.get_files(study_dir, suffix='txt'),
+                                  os.path.join(base_dir, 'metadata.txt'),
+                                  processes=agenv.get_cpu_count())
+    return new_samples
+
+
+parser = ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--source', default=None,
+                    help='The directory of samples to serve. Defaults to '
+                         'tests/data/ag_testing')
+parser.add_argument('--replicates', type=int, default=10,
+                    help='The number of copies of each sample to serve')
+parser.add_argument('--read-multiplier', type=int, default=1,
+                    help='The number of copies of each read to serve')
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='Seconds of latency added to each request')
+parser.add_argument('--error-rate', type=float, default=0.0,
+                    help='The probability of a request failing with a 500')
+parser.add_argument('--threads', type=int, default=8,
+                    help='The number of samples to fetch at once')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        source = os.path.join(agenv.get_repository_dir(),
+                              'tests/data/ag_testing')
+
+    proc, url = agena.start_process(source, args.replicates,
+                                    args.read_multiplier,
+                                    latency=args.latency,
+                                    error_rate=args.error_rate)
+    os.environ['AG_ENA_URL'] = url
+    agu.RETRY_WAIT = 0.1
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        rss_before = _peak_rss_mb()
+        start = time.time()
+        samples = ingest('ERP_FAKE', work_dir, args.threads)
+        elapsed = time.time() - start
+    finally:
+        proc.terminate()
+        shutil.rmtree(work_dir)
+
+    print "samples\t%d" % samples
+    print "seconds\t%.3f" % elapsed
+    print "samples_per_second\t%.2f" % (samples / elapsed)
+    print "peak_rss_mb\t%.1f" % _peak_rss_mb()
+    print "peak_rss_increase_mb\t%.1f" % (_peak_rss_mb() - rss_before)
@@ -4,14 +4,12 @@ from __future__ import division
 from os.path import isfile, exists
 from os.path import join as pjoin
 from os import mkdir
-from numpy import zeros, mean, array
 from argparse import ArgumentParser
 from biom.parse import parse_biom_table
 from americangut.make_phyla_plots import (map_to_2D_dict,
-                                          render_barchart,
-                                          summarize_common_categories,
                                           load_category_files,
-                                          parse_category_files)
+                                          summarize_barchart_population,
+                                          plot_sample_barchart)
 
 __author__ = "Justine Debelius"
 __copyright__ = "Copyright 2013, The American Gut Project"
@@ -52,92 +50,17 @@ def main(otu_table, mapping_data, cat_tables, output_dir, sample_type='fecal',
         Figure_4_<SAMPLEID>.pdf
     """
 
-    # Sets constants for analyzing the data
-    LEVEL = 2
-    CATEGORY = 'taxonomy'
-    NUM_TAXA = 9
-    NUM_CATS_TO_PLOT = 7
-
-    # Sets up plotting constants
-    COLORMAP = array([[0.8353, 0.2421, 0.3098],
-                      [0.9569, 0.4275, 0.2627],
-                      [0.9922, 0.6824, 0.3804],
-                      [0.9961, 0.8784, 0.5351],
-                      [0.9020, 0.9608, 0.5961],
-                      [0.6706, 0.8667, 0.6431],
-                      [0.4000, 0.7608, 0.6471],
-                      [0.1961, 0.5333, 0.7412],
-                      [0.3333, 0.3333, 0.3333]])
-
-    FIG_DIMS = (4.44444, 3.33333)
-    AXIS_DIMS = array([[0.05, 0.05],
-                       [0.95, 0.95]])
-
-    # Common taxa are designated before processing to remain constant.
-    COMMON_TAXA = [(u'k__Bacteria', u'p__Firmicutes'),
-                   (u'k__Bacteria', u'p__Bacteroidetes'),
-                   (u'k__Bacteria', u'p__Proteobacteria'),
-                   (u'k__Bacteria', u'p__Actinobacteria'),
-                   (u'k__Bacteria', u'p__Verrucomicrobia'),
-                   (u'k__Bacteria', u'p__Tenericutes'),
-                   (u'k__Bacteria', u'p__Cyanobacteria'),
-                   (u'k__Bacteria', u'p__Fusobacteria')]
-
-    SKIPSET = set(('Sample', 'Average', 'MP'))
-
-    # Names categories being plotted
-    if sample_type == 'fecal':
-        michael_pollan = '10317.000007108'
-        cat_list = ['You', 'Average', 'Similar Diet', ' Similar BMI',
-                    'Same Gender', 'Similar Age', 'Michael Pollan']
-        order = ['Sample', 'Average', 'DIET_TYPE', 'BMI_CAT', 'SEX',
-                 'AGE_CAT', 'MP']
-
-    elif sample_type == 'skin':
-        michael_pollan = '10317.000007113'
-        cat_list = ['You', 'Average', 'Similar Cosmetic Use',
-                    'Same Dominant Hand', 'Same Gender', 'Same Age',
-                    'Michael Pollan']
-        order = ['Sample', 'Average', 'COSMETICS_FREQUENCY',
-                 'DOMINANT_HAND', 'SEX', 'AGE_CAT', 'MP']
-
-    elif sample_type == 'oral':
-        michael_pollan = '10317.000007109'
-        cat_list = ['You', 'Average', 'Similar Diet', 'Flossing Frequency',
-                    'Same Gender', 'Same Age', 'Michael Pollan']
-        order = ['Sample', 'Average', 'DIET_TYPE', 'FLOSSING_FREQUENCY',
-                 'SEX', 'AGE_CAT', 'MP']
-
-    else:
-        raise ValueError('%s is not a supported sample type.' % sample_type)
-
     # Gets the mapping file
     map_dict = map_to_2D_dict(mapping_data)
 
-    # Gets the category file dictionary summarized with the common categories
-    # Generates the category file dictionary
-    categories = parse_category_files(raw_tables=cat_tables,
-                                      common_groups=COMMON_TAXA[:8],
-                                      level=LEVEL,
-                                      metadata=CATEGORY)
-
-    # Summarizes taxonomy for the category
-    (whole_sample_ids, whole_summary, new_common_taxa) = \
-        summarize_common_categories(biom_table=otu_table,
-                                    level=LEVEL,
-                                    common_categories=COMMON_TAXA[:8],
-                                    metadata_category=CATEGORY)
-
-    # Converts the final taxa to a cleaned up list
-    # Converts final taxa to a clean list
-    common_phyla = []
-    for taxon in new_common_taxa:
-        common_phyla.append(taxon[1].strip(' p__').strip('[').strip(']'))
-    new_common_taxa = common_phyla
+    # Summarizes the population and the categories
+    population = summarize_barchart_population(otu_table, cat_tables,
+                                               sample_type=sample_type,
+                                               debug=debug)
 
     # Checks that the crrect sample ids are plotted
     if samples_to_plot is None:
-        sample_ids = whole_sample_ids
+        sample_ids = population['sample_ids']
     else:
         sample_ids = samples_to_plot
 
@@ -145,63 +68,11 @@ def main(otu_table, mapping_data, cat_tables, output_dir, sample_type='fecal',
         # TODO: make the rest of the code reflect this...
         raise ValueError("SCRIPT NO LONGER SUPPORTS MULTIPLE SAMPLES")
 
-    # Identifies Michael Pollan's pre-ABX sample
-    if debug:
-        mp_sample_pos = 2
-    else:
-        mp_sample_pos = whole_sample_ids.tolist().index(michael_pollan)
-    mp_sample_taxa = whole_summary[:, mp_sample_pos]
-
-    # Gets the table average
-    table_average = mean(whole_summary, 1)
-
     # Generates a figure for each sample
-    for idx, sample_id in enumerate(whole_sample_ids):
+    for sample_id in population['sample_ids']:
         if sample_id in sample_ids:
-            meta_data = map_dict[sample_id]
-            # Prealocates a numpy array to hold the data
-            tax_array = zeros((NUM_TAXA, NUM_CATS_TO_PLOT))
-
-            # Adds preset values to the array so the first column is the sample
-            # the second column is the average and the last column is Michael
-            # Pollan
-            tax_array[:, 0] = whole_summary[:, idx]
-            tax_array[:, 1] = table_average
-            tax_array[:, -1] = mp_sample_taxa
-
-            # Adds the categories to the table in the listed order
-            for idx, cat in enumerate(order):
-                # Skips over undesired categories
-                if cat in SKIPSET:
-                    continue
-                # Gets the sample metadata
-                mapping_key = meta_data[cat]
-                # Pulls taxonomic summary and group descriptions
-                tax_summary = categories[cat]['Summary']
-                group_descriptions = categories[cat]['Groups'].tolist()
-                # Appends plotting tables
-                try:
-                    mapping_col = group_descriptions.index(mapping_key)
-                except:
-                    raise ValueError('The %s cannot be found in %s.'
-                                     % (mapping_key, cat))
-                tax_array[:, idx] = tax_summary[:, mapping_col]
-
-            # Sets up the file to save the data
-            filename = pjoin(output_dir, 'figure4.pdf')
-
-            # Plots the data
-            render_barchart(data_table=tax_array,
-                            x_axis=False,
-                            group_names=new_common_taxa,
-                            legend=False,
-                            sample_names=cat_list,
-                            y_axis=False,
-                            axis_dims=AXIS_DIMS,
-                            fig_dims=FIG_DIMS,
-                            file_out=filename,
-                            show_edge=False,
-                            colors=COLORMAP)
+            plot_sample_barchart(population, map_dict[sample_id], sample_id,
+                                 pjoin(output_dir, 'figure4.pdf'))
 
 # Sets up the command line interface
 
@@ -6,17 +6,9 @@ from os import mkdir
 from os.path import isfile, exists, join as pjoin
 from argparse import ArgumentParser
 
-from numpy import array, vstack
 from biom.parse import parse_biom_table
-from matplotlib.font_manager import FontProperties
 
-from americangut.make_phyla_plots import (translate_colors,
-                                          calculate_dimensions_rectangle,
-                                          render_single_pie)
-from americangut.generate_otu_signifigance_tables import(
-    calculate_abundance, clean_greengenes_string)
-from americangut.taxtree import (build_tree_from_taxontable,
-                                 sample_rare_unique)
+from americangut.make_phyla_plots import plot_sample_pie
 
 __author__ = "Justine Debelius"
 __copyright__ = "Copyright 2013, The American Gut Project"
@@ -45,118 +37,26 @@ def main(tax_table, output_dir, samples_to_analyze=None):
         naming convention PIECHART_<SAMPLEID>.pdf.
     """
 
-    # Handles string cleaning
-    RENDER = 'LATEX'
-    UNCLASSIFIED = False
-
-    # Sets up the rare threshhold for
-    RARE_THRESH = 0.0
-    SUM_MIN = 1
-
-    # Sets up axis parameters
-    AXIS_LENGTH = 7.25
-    AXIS_BORDER = 0.01
-    AXIS_TITLE = 0
-    AXIS_LEGEND = 7
-    # Modifies the axis limits
-    AX_LIMS = [-1.05, 1.05]
-    # Sets up constants for getting the colormap and plotting
-    MAP_NAME = 'BrBG'
-    NUM_SHOW = 12
-    OTHER_COLOR = array([[85/255, 85/255, 85/255]])
-    # Sets up plotting parameters
-    FIG_LEGEND = True
-    FIG_COLOR_EDGE = False
-    FIG_LEG_FRAME = False
-    FIG_LEG_OFFSET = [0.95, 0.025, 1.0, 0.95]
-    # Sets up the the legend font
-    LEG_FONT = FontProperties()
-    LEG_FONT.set_size(28)
-    LEG_FONT.set_family('sans-serif')
-    # Sets the general font properties
-    use_latex = False
-    rc_font_family = 'sans-serif'
-    rc_font = ['Helvetica', 'Arial']
-
-    # Sets up the colormap
-    colormap = translate_colors((NUM_SHOW-1), MAP_NAME)
-    colormap = vstack((colormap, OTHER_COLOR))
-
-    # Sets up plotting constants
-    (axis_dims, fig_dims) = calculate_dimensions_rectangle(
-        axis_width=AXIS_LENGTH, axis_height=AXIS_LENGTH, border=AXIS_BORDER,
-        title=AXIS_TITLE, legend=AXIS_LEGEND)
-
-    # Walks over a taxa tree and prioritizes based on taxonomy
-    (tree, all_taxa) = build_tree_from_taxontable(tax_table)
+    # Removes the taxa which are not present in any sample
+    def filt_fun(v, i, md):
+        return v.sum() > 0
 
-    # Sets up samples for which tables are being generated
-    if len(samples_to_analyze) > 1:
-        # TODO: make the rest of the code reflect this...
-        raise ValueError("SCRIPT NO LONGER SUPPORTS MULTIPLE SAMPLES")
+    filtered_table = tax_table.filter(filt_fun, axis='observation',
+                                      inplace=False)
 
+    # Sets up samples for which tables are being generated
     if samples_to_analyze is not None:
-        samples_to_test = samples_to_analyze
+        if len(samples_to_analyze) > 1:
+            # TODO: make the rest of the code reflect this...
+            raise ValueError("SCRIPT NO LONGER SUPPORTS MULTIPLE SAMPLES")
+        samples_to_test = [s for s in samples_to_analyze
+                           if tax_table.exists(s)]
     else:
-        samples_to_test = all_taxa.keys()
-
-    # Checks the samples exist
-    if samples_to_test:
-        samples_to_test = set(samples_to_test)
-        tmp = {k: v for k, v in all_taxa.items() if k in samples_to_test}
-        all_taxa = tmp
-        if not samples_to_test:
-            raise ValueError("No samples!")
-
-    # Walks over the table
-    def filt_fun(v, i, md):
-        return v.sum() > 0
-
-    for samp, filtered_table, rare, unique in sample_rare_unique(tree,
-                                                                 tax_table,
-                                                                 all_taxa,
-                                                                 RARE_THRESH):
-        # abund_fun = lambda v, i, md: i in all_taxa[samp]
-        filtered_table = tax_table.filter(filt_fun, axis='observation')
-        sample_data = filtered_table.data(samp)
-        taxa = filtered_table.ids(axis='observation')
-
-        # Calculates abundance and limits to the top n samples.
-        abund_rank = calculate_abundance(sample=sample_data,
-                                         taxa=taxa,
-                                         sum_min=SUM_MIN)
-
-        abund_rank = abund_rank[:(NUM_SHOW-1)]
-
-        # Cleans the greengenes strings and adds an "Other" Category for
-        # missing taxa
-        [sample_tax, sample_freq] = [list(a) for a in zip(*abund_rank)]
-        clean_tax = [clean_greengenes_string(tax, RENDER,
-                                             unclassified=UNCLASSIFIED)
-                     for tax in sample_tax]
-        clean_tax.append('Other')
-        sample_freq.append(1-sum(sample_freq))
-
-        # Sets up the sample filename
-        filename = pjoin(output_dir, 'figure2.pdf')
+        samples_to_test = tax_table.ids()
 
+    for samp in samples_to_test:
         # Creates the pie chart
-        render_single_pie(data_vec=sample_freq,
-                          group_names=clean_tax,
-                          axis_dims=axis_dims,
-                          fig_dims=fig_dims,
-                          file_out=filename,
-                          legend=FIG_LEGEND,
-                          colors=colormap,
-                          show_edge=FIG_COLOR_EDGE,
-                          legend_frame=FIG_LEG_FRAME,
-                          rc_font=rc_font,
-                          legend_offset=FIG_LEG_OFFSET,
-                          rc_fam=rc_font_family,
-                          legend_font=LEG_FONT,
-                          use_latex=use_latex,
-                          x_lims=AX_LIMS,
-                          y_lims=AX_LIMS)
+        plot_sample_pie(filtered_table, samp, pjoin(output_dir, 'figure2.pdf'))
 
 
 # Sets up command line parsing
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import imp
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from numpy import array
+from biom import Table
+from click.testing import CliRunner
+
+from americangut.taxtree import PopulationTree
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2013, The American Gut Project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "unversioned"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+
+ag = imp.load_source('ag_script', os.path.join(os.path.dirname(__file__),
+                                               os.pardir, 'scripts', 'ag'))
+
+
+class RareUniqueTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.population = os.path.join(self.dir, 'population.json')
+        self.runner = CliRunner()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_table(self, name, sample_ids):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as fp:
+            presence_table.filter(sample_ids, inplace=False).to_json('test',
+                                                                     fp)
+        return path
+
+    def rareunique(self, *args):
+        result = self.runner.invoke(ag.ag, ['taxtree', 'rareunique',
+                                            '--rare-threshold', '0.7'] +
+                                    list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_population_rounds(self):
+        first = self.write_table('first.biom', ['a', 'b'])
+        second = self.write_table('second.biom', ['c'])
+
+        self.rareunique('--table', first, '--population', self.population)
+        obs = self.rareunique('--table', second, '--population',
+                              self.population, '--new-only')
+
+        # the samples of the first round are kept
+        exp = PopulationTree()
+        exp.add_samples(presence_table)
+        pop = PopulationTree.load(self.population)
+        self.assertEqual(sorted(pop.samples), ['a', 'b', 'c'])
+        self.assertEqual(pop.tree.to_dict(), exp.tree.to_dict())
+        self.assertEqual(obs, '#SampleID\ttype\ttaxon\n')
+
+    def test_population_remove(self):
+        table = self.write_table('all.biom', ['a', 'b', 'c'])
+        self.rareunique('--table', table, '--population', self.population)
+
+        remove = os.path.join(self.dir, 'remove.txt')
+        with open(remove, 'w') as fp:
+            fp.write('#SampleID\na\n\n')
+        second = self.write_table('second.biom', ['b'])
+        obs = self.rareunique('--table', second, '--population',
+                              self.population, '--remove', remove)
+
+        exp = PopulationTree()
+        exp.add_samples(presence_table, ['b', 'c'])
+        pop = PopulationTree.load(self.population)
+        self.assertEqual(sorted(pop.samples), ['b', 'c'])
+        self.assertEqual(popcounts(pop.tree), popcounts(exp.tree))
+
+        # b is still in the table, and is now the only sample with p__x
+        self.assertEqual(obs.splitlines(),
+                         ['#SampleID\ttype\ttaxon',
+                          "b\tunique\t[u'k__1', u'p__x', u'c__']",
+                          "b\tunique\t[u'k__1', u'p__y', u'c__3']"])
+
+    def test_remove_requires_population(self):
+        table = self.write_table('all.biom', ['a'])
+        remove = os.path.join(self.dir, 'remove.txt')
+        open(remove, 'w').close()
+        result = self.runner.invoke(ag.ag, ['taxtree', 'rareunique',
+                                            '--table', table,
+                                            '--remove', remove])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('requires --population', result.output)
+
+
+def popcounts(trie):
+    """Get {taxon path: popcount} of the counted nodes of a TaxonTrie"""
+    counts = {}
+    for node_id, count in enumerate(trie.counts):
+        path = []
+        cur_id = node_id
+        while cur_id > 0:
+            path.append(trie.names[cur_id])
+            cur_id = trie.parents[cur_id]
+        if count:
+            counts[tuple(reversed(path))] = count
+    return counts
+
+
+presence_table = Table(array([[1, 0, 0],
+                              [1, 0, 0],
+                              [1, 2, 0],
+                              [1, 2, 0],
+                              [0, 0, 3]]),
+                       ['k__1; p__x; c__1',
+                        'k__1; p__x; c__2',
+                        'k__1;p__x;c__',
+                        'k__1; p__y; c__3',
+                        'k__1; p__y; c__'],
+                       ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    main()
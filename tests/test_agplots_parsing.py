@@ -12,6 +12,7 @@ from americangut.agplots_parse import (parse_mapping_file_to_dict,
                                        get_filtered_taxa_summary)
 from numpy import array, array_equal
 import numpy.testing as npt
+from StringIO import StringIO
 from unittest import TestCase, main
 
 
@@ -42,6 +43,20 @@ class test_mapping_file_parse(TestCase):
                 self.assertEqual(sample_dict[category],
                                  self.metadata_dict[sample_id][category])
 
+    def test_mapping_file_whitespace(self):
+        # the ends of each line are stripped
+        mapping = StringIO('#SampleID\tTEST_CATEGORY\tAWESOME_CATEGORY\n'
+                           '# a comment \n'
+                           'sample_a\t1\tsuper \n'
+                           ' sample_b\t2 \ttotally\r\n')
+        exp = ({'sample_a': {'TEST_CATEGORY': '1',
+                             'AWESOME_CATEGORY': 'super'},
+                'sample_b': {'TEST_CATEGORY': '2 ',
+                             'AWESOME_CATEGORY': 'totally'}},
+               [' a comment'])
+        obs = parse_mapping_file_to_dict(mapping)
+        self.assertEqual(obs, exp)
+
 
 class test_taxa_summary_file_parse(TestCase):
     def setUp(self):
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import americangut.notebook_environment as agenv
+import americangut.util as agu
+from americangut.fake_ena import FakeENAServer, load_samples
+
+
+class FakeENATests(TestCase):
+    def setUp(self):
+        self.source = os.path.join(agenv.get_repository_dir(),
+                                   'tests/data/ag_testing')
+        self.accessions = sorted(
+            d for d in os.listdir(self.source)
+            if os.path.isdir(os.path.join(self.source, d)))
+        self.dir = tempfile.mkdtemp()
+
+        self.environ = os.environ.get('AG_ENA_URL')
+        self.retry_wait = agu.RETRY_WAIT
+        agu.RETRY_WAIT = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        agu.RETRY_WAIT = self.retry_wait
+        if self.environ is None:
+            os.environ.pop('AG_ENA_URL', None)
+        else:
+            os.environ['AG_ENA_URL'] = self.environ
+
+    def test_load_samples(self):
+        obs = load_samples(self.source, replicates=2)
+        self.assertEqual(len(obs), 2 * len(self.accessions))
+
+        acc = self.accessions[0]
+        self.assertEqual(obs[acc][0], obs[acc + '.1'][0])
+        self.assertTrue('accession="%s.1"' % acc in obs[acc + '.1'][1])
+        self.assertNotEqual(agu.xml_to_dict(self._xml(obs[acc][1]))[0],
+                            agu.xml_to_dict(self._xml(obs[acc + '.1'][1]))[0])
+
+    def _xml(self, text):
+        path = os.path.join(self.dir, 'sample.xml')
+        with open(path, 'w') as fp:
+            fp.write(text)
+        return path
+
+    def test_fetch_study(self):
+        samples = load_samples(self.source)
+        with FakeENAServer(samples) as server:
+            os.environ['AG_ENA_URL'] = server.url
+            self.assertEqual(agu.fetch_study('ERP_FAKE', self.dir, 4),
+                             len(self.accessions))
+
+        for acc in self.accessions:
+            exp_base = os.path.join(self.source, acc, acc)
+            obs_base = os.path.join(self.dir, 'ERP_FAKE', acc, acc)
+            for suffix in ('.fna', '.txt'):
+                with open(exp_base + suffix) as exp, \
+                        open(obs_base + suffix) as obs:
+                    self.assertEqual(obs.read(), exp.read())
+
+    def test_server_errors(self):
+        samples = load_samples(self.source)
+        with FakeENAServer(samples, error_rate=1.0) as server:
+            os.environ['AG_ENA_URL'] = server.url
+            with self.assertRaisesRegexp(ValueError, 'Failed at fetching'):
+                list(agu.fetch_study_details('ERP_FAKE'))
+
+    def test_server_errors_retried(self):
+        samples = load_samples(self.source)
+        with FakeENAServer(samples, error_rate=0.3, seed=0) as server:
+            os.environ['AG_ENA_URL'] = server.url
+            details = list(agu.fetch_study_details('ERP_FAKE'))
+        self.assertEqual([acc for acc, _ in details], self.accessions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import gzip
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase, main
+
+from americangut.fasta import (is_gzip, open_fasta, record_blocks,
+                               trim_block, trim_records, shard_offsets,
+                               trim_fasta_file, concatenate_paths,
+                               count_records, record_ids, sample_id_of,
+                               SequenceIndex)
+
+
+class FastaTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = self._write('seqs.fna', fasta)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data, compress=False):
+        path = os.path.join(self.dir, name)
+        opener = gzip.open if compress else open
+        with opener(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def _read(self, path):
+        with open_fasta(path) as fp:
+            return fp.read()
+
+    def test_open_fasta(self):
+        path = self._write('seqs.fna.gz', fasta, compress=True)
+        self.assertTrue(is_gzip(path))
+        self.assertFalse(is_gzip(self.fasta))
+        self.assertEqual(self._read(path), fasta)
+
+        # compression on read is detected from the content
+        moved = os.path.join(self.dir, 'seqs_gz.fna')
+        os.rename(path, moved)
+        self.assertEqual(self._read(moved), fasta)
+
+        out = os.path.join(self.dir, 'out.fna.gz')
+        with open_fasta(out, 'wb') as fp:
+            fp.write(fasta)
+        self.assertTrue(is_gzip(out))
+
+    def test_record_blocks(self):
+        for block_size in (1, 7, 1000):
+            blocks = list(record_blocks(StringIO(fasta), block_size))
+            self.assertEqual(''.join(blocks), fasta)
+            for block in blocks:
+                self.assertTrue(block.startswith('>'))
+                self.assertTrue(block.endswith('\n'))
+
+    def test_record_blocks_limit(self):
+        blocks = list(record_blocks(StringIO(fasta), 4, limit=29))
+        self.assertEqual(''.join(blocks), fasta[:29])
+
+    def test_trim_block(self):
+        self.assertEqual(trim_block('>a x \n0123456789\n>b\n01\n', 4),
+                         '>a x\n0123\n>b\n01\n')
+        self.assertEqual(trim_block('>a\n0123\n>b', 2), '>a\n01\n')
+        self.assertEqual(trim_block('', 2), '')
+
+    def test_trim_records(self):
+        exp = '>seq1 a\n01234\n>seq2\n01234\n>seq3 b\n012\n>seq4\n01234\n'
+        for block_size in (3, 2 ** 20):
+            out = StringIO()
+            trim_records(StringIO(fasta), out, 5, block_size)
+            self.assertEqual(out.getvalue(), exp)
+
+    def test_shard_offsets(self):
+        for shards in (1, 2, 3, 10):
+            offsets = shard_offsets(self.fasta, shards)
+            self.assertEqual(len(offsets), shards)
+            self.assertEqual(offsets[0][0], 0)
+            self.assertEqual(offsets[-1][1], len(fasta))
+            pieces = [fasta[start:end] for start, end in offsets]
+            self.assertEqual(''.join(pieces), fasta)
+            for piece in pieces:
+                if piece:
+                    self.assertTrue(piece.startswith('>'))
+
+    def test_trim_fasta_file(self):
+        exp = '>seq1 a\n01234\n>seq2\n01234\n>seq3 b\n012\n>seq4\n01234\n'
+        out = os.path.join(self.dir, 'out.fna')
+        for processes in (1, 3):
+            trim_fasta_file(self.fasta, out, 5, processes=processes,
+                            block_size=8)
+            self.assertEqual(self._read(out), exp)
+        # the shards are removed
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['out.fna', 'seqs.fna'])
+
+        compressed = self._write('seqs.fna.gz', fasta, compress=True)
+        out = os.path.join(self.dir, 'out.fna.gz')
+        trim_fasta_file(compressed, out, 5, processes=3)
+        self.assertTrue(is_gzip(out))
+        self.assertEqual(self._read(out), exp)
+
+    def test_concatenate_paths(self):
+        other = self._write('other.fna', '>x\nAC\n')
+        out = os.path.join(self.dir, 'out.fna')
+        concatenate_paths([self.fasta, other], out)
+        self.assertEqual(self._read(out), fasta + '>x\nAC\n')
+
+        concatenate_paths([other], out, append=True)
+        self.assertEqual(self._read(out), fasta + '>x\nAC\n>x\nAC\n')
+
+        concatenate_paths([self.fasta, other], out, block_size=3)
+        self.assertEqual(self._read(out), fasta + '>x\nAC\n')
+
+    def test_concatenate_paths_gzip(self):
+        compressed = self._write('other.fna.gz', '>x\nAC\n', compress=True)
+        out = os.path.join(self.dir, 'out.fna')
+        concatenate_paths([self.fasta, compressed], out)
+        self.assertEqual(self._read(out), fasta + '>x\nAC\n')
+
+        out = os.path.join(self.dir, 'out.fna.gz')
+        concatenate_paths([self.fasta, compressed], out)
+        self.assertTrue(is_gzip(out))
+        self.assertEqual(self._read(out), fasta + '>x\nAC\n')
+
+    def test_count_records(self):
+        for processes in (1, 2, 3):
+            for block_size in (2, 5, 2 ** 20):
+                self.assertEqual(count_records(self.fasta, processes,
+                                               block_size), 4)
+        self.assertEqual(count_records(self._write('empty.fna', '')), 0)
+
+    def test_record_ids(self):
+        self.assertEqual(list(record_ids(self.fasta)),
+                         ['seq1', 'seq2', 'seq3', 'seq4'])
+
+    def test_sample_id_of(self):
+        self.assertEqual(sample_id_of('10317.000007113_2840481'),
+                         '10317.000007113')
+        self.assertEqual(sample_id_of('a_b_1'), 'a_b')
+        self.assertEqual(sample_id_of('a'), 'a')
+
+    def test_sequence_index(self):
+        path = self._write('samples.fna', samples_fasta)
+        for processes in (1, 2, 4):
+            index = SequenceIndex.build(path, processes)
+            self.assertEqual(index.samples,
+                             {'A.1': [3, [[0, 30]]],
+                              'B': [3, [[30, 45], [53, 62]]],
+                              'C': [1, [[45, 53]]]})
+
+        self.assertEqual(index.count(), 7)
+        self.assertEqual(index.count(['A.1', 'C', 'missing']), 4)
+        self.assertTrue('B' in index)
+
+        out = StringIO()
+        index.extract('B', out)
+        self.assertEqual(out.getvalue(), '>B_1\nA\n>B_2\nCC\n>B_3\nGGG\n')
+        with self.assertRaises(KeyError):
+            index.extract('missing', out)
+
+    def test_sequence_index_persisted(self):
+        path = self._write('samples.fna', samples_fasta)
+        self.assertEqual(SequenceIndex.load(path), None)
+
+        index = SequenceIndex.open(path)
+        self.assertTrue(os.path.exists(SequenceIndex.index_path(path)))
+        self.assertEqual(SequenceIndex.load(path).samples, index.samples)
+
+        # a changed file invalidates the index
+        with open(path, 'a') as fp:
+            fp.write('>D_0\nA\n')
+        self.assertEqual(SequenceIndex.load(path), None)
+        self.assertEqual(SequenceIndex.open(path).count(['D']), 1)
+
+
+samples_fasta = ('>A.1_0 x\nAC\n>A.1_1\nA\n>A.1_2\nA\n'
+                 '>B_1\nA\n>B_2\nCC\n'
+                 '>C_0\nAA\n'
+                 '>B_3\nGGG\n')
+
+fasta = ('>seq1 a\n0123456789\n'
+         '>seq2\n0123456789\n'
+         '>seq3 b\n012\n'
+         '>seq4\n012345678901234\n')
+
+
+if __name__ == '__main__':
+    main()
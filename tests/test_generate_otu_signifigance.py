@@ -2,7 +2,11 @@
 # make_phyla_plots_AGP_test.py
 
 from unittest import TestCase, main
-from numpy import array
+from numpy import array, column_stack, zeros
+import numpy.testing as npt
+from biom import Table
+from scipy.sparse import csc_matrix
+import americangut.generate_otu_signifigance_tables as agsig
 from americangut.generate_otu_signifigance_tables import (calculate_abundance,
                                                           calculate_tax_rank_1,
                                                           convert_taxa,
@@ -10,6 +14,9 @@ from americangut.generate_otu_signifigance_tables import (calculate_abundance,
                                                           convert_taxa_to_list,
                                                           build_latex_macro,
                                                           format_date)
+from americangut.generate_otu_signifigance_tables import (
+    calculate_tax_rank_cohort, calculate_tax_rank_table, cohort_statistics,
+    sample_significance_macros)
 
 
 class GenerateOTUSignifiganceTablesTest(TestCase):
@@ -256,6 +263,121 @@ class GenerateOTUSignifiganceTablesTest(TestCase):
         self.assertEqual(known_high_01, test_high_01)
         self.assertEqual(known_low_01, test_low_01)
 
+    def _assert_ranks_equal(self, obs, exp):
+        self.assertEqual(len(obs), len(exp))
+        for o, e in zip(obs, exp):
+            self.assertEqual(o[:4], e[:4])
+            npt.assert_allclose(o[4], e[4], rtol=1e-7)
+
+    def test_calculate_tax_rank_cohort(self):
+        cohort = column_stack([self.sample, self.pop])
+        for critical_value in (0.1, 0.05, 0.01):
+            exp_high, exp_low = calculate_tax_rank_1(
+                sample=self.sample, population=self.pop, taxa=self.taxa,
+                critical_value=critical_value)
+            [(obs_high, obs_low)] = calculate_tax_rank_cohort(
+                cohort, self.taxa, critical_value=critical_value,
+                columns=[0])
+            self._assert_ranks_equal(obs_high, exp_high)
+            self._assert_ranks_equal(obs_low, exp_low)
+
+    def test_calculate_tax_rank_cohort_leave_one_out(self):
+        cohort = column_stack([self.sample, self.pop])
+        obs = calculate_tax_rank_cohort(cohort, self.taxa, critical_value=0.1)
+        self.assertEqual(len(obs), cohort.shape[1])
+        for col, (obs_high, obs_low) in enumerate(obs):
+            others = [c for c in range(cohort.shape[1]) if c != col]
+            exp_high, exp_low = calculate_tax_rank_1(
+                sample=cohort[:, col], population=cohort[:, others],
+                taxa=self.taxa, critical_value=0.1)
+            self._assert_ranks_equal(obs_high, exp_high)
+            self._assert_ranks_equal(obs_low, exp_low)
+
+    def test_calculate_tax_rank_cohort_exclude(self):
+        cohort = column_stack([self.sample, self.pop])
+        exclude = zeros(cohort.shape, dtype=bool)
+        exclude[4, 0] = True
+        [(obs_high, obs_low)] = calculate_tax_rank_cohort(
+            cohort, self.taxa, critical_value=0.1, exclude=exclude,
+            columns=[0])
+
+        keep = [i for i in range(len(self.taxa)) if i != 4]
+        exp_high, exp_low = calculate_tax_rank_1(
+            sample=self.sample[keep], population=self.pop[keep],
+            taxa=array(self.taxa)[keep], critical_value=0.1)
+        self._assert_ranks_equal(obs_high, exp_high)
+        self._assert_ranks_equal(obs_low, exp_low)
+
+    def test_calculate_tax_rank_cohort_error(self):
+        with self.assertRaises(ValueError):
+            calculate_tax_rank_cohort(self.pop, self.taxa[:-1])
+
+    def test_calculate_tax_rank_table(self):
+        cohort = column_stack([self.sample, self.pop])
+        ids = ['s%d' % i for i in range(cohort.shape[1])]
+        table = Table(cohort, self.taxa, ids)
+        rare = [self.taxa[4].split('; ')]
+        obs = calculate_tax_rank_table(table, [('s0', rare, []),
+                                               ('s2', [], [])],
+                                       critical_value=0.1)
+        self.assertEqual(sorted(obs), ['s0', 's2'])
+
+        exclude = zeros(cohort.shape, dtype=bool)
+        exclude[4, 0] = True
+        exp = calculate_tax_rank_cohort(cohort, self.taxa, critical_value=0.1,
+                                        exclude=exclude, columns=[0, 2])
+        for id_, (exp_high, exp_low) in zip(['s0', 's2'], exp):
+            self._assert_ranks_equal(obs[id_][0], exp_high)
+            self._assert_ranks_equal(obs[id_][1], exp_low)
+
+    def test_calculate_tax_rank_table_delimiters(self):
+        # QIIME's summarize_taxa joins levels with ';' rather than '; '
+        cohort = column_stack([self.sample, self.pop])
+        ids = ['s%d' % i for i in range(cohort.shape[1])]
+        rare = [self.taxa[4].split('; ')]
+        exp = calculate_tax_rank_table(Table(cohort, self.taxa, ids),
+                                       [('s0', rare, [])],
+                                       critical_value=0.1)
+
+        taxa = [t.replace('; ', ';') for t in self.taxa]
+        obs = calculate_tax_rank_table(Table(cohort, taxa, ids),
+                                       [('s0', rare, [])],
+                                       critical_value=0.1)
+        for o, e in zip(obs['s0'], exp['s0']):
+            self.assertEqual([r[0] for r in o],
+                             [r[0].replace('; ', ';') for r in e])
+            npt.assert_array_equal([r[1:] for r in o], [r[1:] for r in e])
+
+    def test_cohort_statistics_sparse(self):
+        cohort = column_stack([self.sample, self.pop])
+        cohort[cohort < 0] = 0
+        exp = cohort_statistics(cohort)
+
+        block_taxa = agsig.COHORT_BLOCK_TAXA
+        agsig.COHORT_BLOCK_TAXA = 3
+        try:
+            obs = cohort_statistics(csc_matrix(cohort))
+        finally:
+            agsig.COHORT_BLOCK_TAXA = block_taxa
+
+        self.assertEqual(len(obs), len(exp))
+        for o, e in zip(obs[:-1], exp[:-1]):
+            npt.assert_array_equal(o, e)
+        self.assertEqual(obs[-1], cohort.shape[1])
+
+    def test_calculate_tax_rank_table_cohort(self):
+        cohort = column_stack([self.sample, self.pop])
+        ids = ['s%d' % i for i in range(cohort.shape[1])]
+        table = Table(cohort, self.taxa, ids)
+        stats = cohort_statistics(table.matrix_data)
+
+        exp = calculate_tax_rank_table(table, [('s1', [], [])])
+        obs = calculate_tax_rank_table(table, [('s1', [], [])],
+                                       cohort=stats)
+        self.assertEqual(obs, exp)
+        self.assertEqual(calculate_tax_rank_table(table, [], cohort=stats),
+                         {})
+
     def test_convert_taxa(self):
         """Checks that convert_taxa runs sanely"""
         # Sets up test values
@@ -482,6 +604,26 @@ class GenerateOTUSignifiganceTablesTest(TestCase):
                                        format=test_funs)
         self.assertEqual(known_macro, test_macro)
 
+    def test_sample_significance_macros_sample_type(self):
+        """Test the sample type and time macros for each body habitat"""
+        table = Table(array([[0.6, 0.2], [0.4, 0.8]]),
+                      ['k__Bacteria; p__Firmicutes',
+                       'k__Bacteria; p__Bacteroidetes'],
+                      ['a', 'b'])
+        known = {'UBERON:feces': ('fecal', '10:00 am'),
+                 'UBERON:tongue': ('tongue', '10:00 am'),
+                 'UBERON:unknown': ('unknown', 'unknown'),
+                 'None': ('unknown', 'unknown')}
+        for habitat, (sample_type, sample_time) in known.items():
+            mapping = {'a': {'BODY_HABITAT': habitat,
+                             'COLLECTION_DATE': '03/05/2014',
+                             'COLLECTION_TIME': '10:00 AM'}}
+            macros = sample_significance_macros('a', [], [], [], table,
+                                                mapping=mapping)
+            self.assertIn('\\def\\sampletype{%s}' % sample_type, macros)
+            self.assertIn('\\def\\sampledate{March 5, 2014}', macros)
+            self.assertIn('\\def\\sampletime{%s}' % sample_time, macros)
+
     def test_format_date(self):
         """Test formating the date information for a metadata dictionary"""
         # Sets the locations of the time information in the metadata
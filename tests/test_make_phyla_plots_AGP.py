@@ -2,6 +2,9 @@
 
 from __future__ import division
 
+import os
+import shutil
+import tempfile
 from unittest import TestCase, main
 from StringIO import StringIO
 
@@ -15,7 +18,10 @@ from americangut.make_phyla_plots import (map_to_2D_dict,
                                           summarize_common_categories,
                                           calculate_dimensions_rectangle,
                                           calculate_dimensions_bar,
-                                          translate_colors)
+                                          translate_colors,
+                                          plot_sample_pie,
+                                          summarize_barchart_population,
+                                          plot_sample_barchart)
 
 
 __author__ = "Justine Debelius"
@@ -136,6 +142,18 @@ class MakePhylaPlotsAGPTest(TestCase):
         test_dict = map_to_2D_dict(test_map)
         self.assertEqual(test_dict, known_dict)
 
+    def test_map_to_2D_dict_raw_lines(self):
+        """Checks map_to_2D_dict keeps comment and short rows"""
+        test_map = StringIO('#SampleID\tSEX\tAGE\n'
+                            '#a comment\n'
+                            '00010\tmale \n'
+                            '00100\tfemale\t30 \n')
+        known_dict = {'#a comment': {'#SampleID': '#a comment'},
+                      '00010': {'#SampleID': '00010', 'SEX': 'male'},
+                      '00100': {'#SampleID': '00100', 'SEX': 'female',
+                                'AGE': '30'}}
+        self.assertEqual(map_to_2D_dict(test_map), known_dict)
+
     def test_identify_most_common_categories(self):
         """Tests that indentify_most_common_categories is sane"""
         # Sets up known values
@@ -370,6 +388,41 @@ class MakePhylaPlotsAGPTest(TestCase):
         assert_almost_equal(test_table, table_known, decimal=4)
         self.assertEqual(test_common_cats, known_common_cats)
 
+    def test_plot_sample_pie(self):
+        """Checks plot_sample_pie renders a sample"""
+        data = self.otu_table.matrix_data.toarray()
+        taxa = ['; '.join(self.otu_table.metadata(i, axis='observation')
+                          ['taxonomy'])
+                for i in self.otu_table.ids(axis='observation')]
+        tax_table = Table(data / data.sum(axis=0), taxa,
+                          self.otu_table.ids())
+
+        tmp = tempfile.mkdtemp()
+        try:
+            file_out = os.path.join(tmp, 'pie.pdf')
+            self.assertIsNone(plot_sample_pie(tax_table, '00010', file_out))
+            self.assertTrue(os.path.exists(file_out))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_plot_sample_barchart(self):
+        """Checks plot_sample_barchart renders a sample"""
+        categories = ['DIET_TYPE', 'BMI_CAT', 'SEX', 'AGE_CAT']
+        population = summarize_barchart_population(
+            self.otu_table, {c: self.otu_table for c in categories},
+            sample_type='fecal', debug=True)
+        # the groups of the category tables are the sample IDs
+        metadata = dict(zip(categories, ['00100', '00200', '00111', '00112']))
+
+        tmp = tempfile.mkdtemp()
+        try:
+            file_out = os.path.join(tmp, 'barchart.pdf')
+            self.assertIsNone(plot_sample_barchart(population, metadata,
+                                                   '00010', file_out))
+            self.assertTrue(os.path.exists(file_out))
+        finally:
+            shutil.rmtree(tmp)
+
     def test_calculate_dimensions_rectangle(self):
         """Checcks calculate_dimensions_rectangle is sane"""
         # Sets up known values
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import americangut.manifest as agman
+
+
+class ManifestTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.dir, 'manifest.sqlite')
+        self.input = os.path.join(self.dir, 'input.txt')
+        self.output = os.path.join(self.dir, 'output.txt')
+        for path in (self.input, self.output):
+            with open(path, 'w') as fp:
+                fp.write('foo\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fingerprint(self):
+        obs = agman.fingerprint([self.input], ['a'])
+        self.assertEqual(obs, agman.fingerprint([self.input], ['a']))
+        self.assertNotEqual(obs, agman.fingerprint([self.input], ['b']))
+
+        with open(self.input, 'a') as fp:
+            fp.write('bar\n')
+        self.assertNotEqual(obs, agman.fingerprint([self.input], ['a']))
+
+    def test_fingerprint_missing(self):
+        missing = os.path.join(self.dir, 'missing')
+        self.assertEqual(agman.fingerprint([self.input, missing]), None)
+
+    def test_sample_fingerprint(self):
+        digest = agman.fingerprint([self.input])
+        obs = agman.sample_fingerprint(digest, [['k__a'], [1]])
+        self.assertEqual(obs, agman.sample_fingerprint(digest, [['k__a'],
+                                                                [1]]))
+        self.assertNotEqual(obs, agman.sample_fingerprint(digest, [['k__a'],
+                                                                   [2]]))
+        self.assertNotEqual(obs, agman.sample_fingerprint('x', [['k__a'],
+                                                                [1]]))
+        self.assertEqual(agman.sample_fingerprint(None, [['k__a'], [1]]),
+                         None)
+        self.assertEqual(agman.sample_fingerprint(digest, None), None)
+
+    def test_current_ids_no_manifest(self):
+        digest = agman.fingerprint([self.input])
+        obs = agman.current_ids(self.manifest, 'f', {'a': digest})
+        self.assertEqual(obs, set())
+
+    def test_record_and_current_ids(self):
+        digest = agman.fingerprint([self.input])
+        agman.record(self.manifest, 'f', {'a': digest, 'b': 'y', 'c': None},
+                     {'a': [self.output], 'b': [self.output],
+                      'c': [self.output]})
+
+        obs = agman.current_ids(self.manifest, 'f', {'a': digest, 'b': 'y',
+                                                     'c': None, 'd': digest})
+        self.assertEqual(obs, {'a', 'b'})
+
+        # a different function or different inputs are not current
+        self.assertEqual(agman.current_ids(self.manifest, 'g',
+                                           {'a': digest}), set())
+        self.assertEqual(agman.current_ids(self.manifest, 'f',
+                                           {'a': 'x', 'b': digest}), set())
+
+        # missing outputs are not current
+        os.remove(self.output)
+        self.assertEqual(agman.current_ids(self.manifest, 'f',
+                                           {'a': digest}), set())
+
+    def test_forget(self):
+        digest = agman.fingerprint([self.input])
+        digests = {'a': digest, 'b': digest}
+        agman.record(self.manifest, 'f', digests, {'a': [], 'b': []})
+        agman.forget(self.manifest, ['a'])
+        obs = agman.current_ids(self.manifest, 'f', digests)
+        self.assertEqual(obs, {'b'})
+
+
+if __name__ == '__main__':
+    main()
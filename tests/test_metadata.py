@@ -0,0 +1,200 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase, main
+
+import numpy.testing as npt
+import pandas.util.testing as pdt
+
+from americangut.metadata import Metadata, load, query
+
+
+AG_MAPPING_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                               os.pardir, 'data', 'AG_debug',
+                               'test_mapping.txt')
+
+
+class MetadataTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'mapping.txt')
+        with open(self.path, 'w') as fp:
+            fp.write(mapping)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_from_lines(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        self.assertEqual(md.id_column, '#SampleID')
+        self.assertEqual(md.columns, ['BODY_SITE', 'COUNTRY', 'AGE'])
+        self.assertEqual(list(md.sample_ids), ['a', 'b', 'c', 'd'])
+        self.assertEqual(md.comments, ['a comment'])
+        self.assertEqual(len(md), 4)
+
+        # each distinct value is stored once
+        codes, categories = md.column_codes('COUNTRY')
+        self.assertEqual(list(categories), ['USA', 'GAZ:Canada'])
+        self.assertEqual(list(codes), [0, 1, 0, 0])
+
+    def test_from_lines_errors(self):
+        with self.assertRaises(ValueError):
+            Metadata.from_lines(StringIO('\n\n'))
+        with self.assertRaises(ValueError):
+            Metadata.from_lines(StringIO('#SampleID\tX\na\t1\t2\n'))
+
+    def test_from_lines_whitespace(self):
+        md = Metadata.from_lines(StringIO(' #SampleID\tX\tY \n'
+                                          '  # note \n'
+                                          ' a\t1 \t\r\n'
+                                          'b\t2\ty \n'))
+        self.assertEqual(md.id_column, '#SampleID')
+        self.assertEqual(md.columns, ['X', 'Y'])
+        self.assertEqual(md.comments, [' note'])
+        self.assertEqual(md.to_dict(), {'a': {'X': '1 ', 'Y': ''},
+                                        'b': {'X': '2', 'Y': 'y'}})
+
+    def test_from_lines_empty(self):
+        md = Metadata.from_lines(StringIO('#SampleID\tX\tY\n'))
+        self.assertEqual(len(md), 0)
+        self.assertEqual(md.to_dict(), {})
+        self.assertEqual(list(md.column('X')), [])
+
+    def test_lookup(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        self.assertIn('c', md)
+        self.assertNotIn('x', md)
+        self.assertEqual(md['c'], {'BODY_SITE': 'UBERON:skin',
+                                   'COUNTRY': 'USA', 'AGE': ''})
+        with self.assertRaises(KeyError):
+            md.row('x')
+
+    def test_column(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        npt.assert_equal(md.column('AGE'), ['30', '45', '', '30'])
+        npt.assert_equal(md.column('AGE', ['d', 'b']), ['30', '45'])
+        with self.assertRaises(KeyError):
+            md.column('missing')
+        with self.assertRaises(KeyError):
+            md.column('AGE', ['x'])
+
+    def test_to_dict(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        obs = md.to_dict()
+        self.assertEqual(obs['a'], {'BODY_SITE': 'UBERON:feces',
+                                    'COUNTRY': 'USA', 'AGE': '30'})
+        self.assertEqual(len(obs), 4)
+
+        obs = md.to_dict(include_id=True)
+        self.assertEqual(obs['b']['#SampleID'], 'b')
+
+    def test_to_frame(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        obs = md.to_frame()
+        self.assertEqual(obs.index.name, '#SampleID')
+        self.assertEqual(list(obs.columns), ['BODY_SITE', 'COUNTRY', 'AGE'])
+        self.assertEqual(obs.loc['b', 'COUNTRY'], 'GAZ:Canada')
+        self.assertEqual(obs.loc['c', 'AGE'], '')
+
+    def test_mask(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        npt.assert_equal(md.mask(), [True, True, True, True])
+        npt.assert_equal(md.mask({'COUNTRY': 'USA', 'AGE': '30'}),
+                         [True, False, False, True])
+        npt.assert_equal(md.mask({'AGE': ['45', '']}),
+                         [False, True, True, False])
+        npt.assert_equal(md.mask({'AGE': 'unobserved'}),
+                         [False, False, False, False])
+        with self.assertRaises(KeyError):
+            md.mask({'missing': 'x'})
+
+    def test_count(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        self.assertEqual(md.count(), 4)
+        self.assertEqual(md.count({'COUNTRY': 'USA'}), 3)
+        self.assertEqual(md.count(unique='AGE'), 3)
+        self.assertEqual(md.count({'BODY_SITE': 'UBERON:feces'},
+                                  unique='AGE'), 2)
+        self.assertEqual(md.count(by='BODY_SITE'),
+                         {'UBERON:feces': 3, 'UBERON:skin': 1})
+        self.assertEqual(md.count({'COUNTRY': 'USA'}, by='BODY_SITE',
+                                  unique='AGE'),
+                         {'UBERON:feces': 1, 'UBERON:skin': 1})
+        self.assertEqual(md.count({'COUNTRY': 'nowhere'}, by='AGE'), {})
+
+    def test_query(self):
+        md = Metadata.from_lines(StringIO(mapping))
+        obs = query(md, {'usa': {'criteria': {'COUNTRY': 'USA'}},
+                         'usa_ages': {'criteria': {'COUNTRY': 'USA'},
+                                      'unique': 'AGE'},
+                         'sites': {'by': 'BODY_SITE'}})
+        self.assertEqual(obs, {'usa': 3, 'usa_ages': 2,
+                               'sites': {'UBERON:feces': 3,
+                                         'UBERON:skin': 1}})
+
+    def test_load_sidecar(self):
+        exp = Metadata.from_lines(StringIO(mapping))
+        sidecar = Metadata.sidecar_path(self.path)
+
+        obs = load(self.path)
+        self.assertTrue(os.path.exists(sidecar))
+        self.assertEqual(obs.to_dict(), exp.to_dict())
+
+        # the sidecar is used while the file is unchanged
+        st = os.stat(self.path)
+        cached = Metadata.load_sidecar(sidecar, st.st_size, st.st_mtime)
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached.comments, exp.comments)
+        self.assertEqual(cached.id_column, exp.id_column)
+        pdt.assert_frame_equal(cached.to_frame(), exp.to_frame())
+
+        # and ignored once the file changes
+        self.assertIsNone(Metadata.load_sidecar(sidecar, st.st_size + 1,
+                                                st.st_mtime))
+        with open(self.path, 'a') as fp:
+            fp.write('e\tUBERON:feces\tUSA\t50\n')
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+        obs = load(self.path)
+        self.assertEqual(list(obs.column('AGE')), ['30', '45', '', '30', '50'])
+
+    def test_sidecar_size(self):
+        # values are stored once per column, so the sidecar of a real
+        # mapping file is much smaller than the file itself
+        path = os.path.join(self.dir, 'ag_mapping.txt')
+        shutil.copy(AG_MAPPING_FILE, path)
+        exp = load(path)
+
+        size = os.path.getsize(path)
+        self.assertLess(os.path.getsize(Metadata.sidecar_path(path)),
+                        size / 4)
+
+        st = os.stat(path)
+        obs = Metadata.load_sidecar(Metadata.sidecar_path(path), st.st_size,
+                                    st.st_mtime)
+        self.assertEqual(obs.to_dict(), exp.to_dict())
+        npt.assert_equal(obs.sample_ids, exp.sample_ids)
+
+    def test_load_bad_sidecar(self):
+        with open(Metadata.sidecar_path(self.path), 'w') as fp:
+            fp.write('not a sidecar')
+        obs = load(self.path)
+        self.assertEqual(len(obs), 4)
+
+    def test_load_no_cache(self):
+        load(self.path, cache=False)
+        self.assertFalse(os.path.exists(Metadata.sidecar_path(self.path)))
+
+
+mapping = """#SampleID\tBODY_SITE\tCOUNTRY\tAGE
+#a comment
+a\tUBERON:feces\tUSA\t30
+b\tUBERON:feces\tGAZ:Canada\t45
+
+c\tUBERON:skin\tUSA\t
+d\tUBERON:feces\tUSA\t30
+"""
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+from StringIO import StringIO
+from unittest import TestCase, main
+
+import biom
+import numpy as np
+import numpy.testing as npt
+from skbio import DistanceMatrix
+
+import americangut.parallel as agpar
+
+
+def _profiled(ids):
+    return agpar.profile_call('_profiled', 'fecal', ids, _odd_fails, ids)
+
+
+def _odd_fails(ids):
+    return {id_: ['odd'] if int(id_) % 2 else [] for id_ in ids}
+
+
+class ParallelTests(TestCase):
+    def setUp(self):
+        self.table = biom.Table(np.array([[0, 1, 2], [3, 0, 5]]),
+                                ['O1', 'O2'], ['S1', 'S2', 'S3'])
+        self.loaded = []
+
+    def tearDown(self):
+        agpar.clear_artifacts()
+
+    def loader(self, path):
+        self.loaded.append(path)
+        if path == 'missing':
+            raise IOError("missing")
+        return self.table.copy()
+
+    def test_shared_array(self):
+        exp = np.arange(6, dtype=float).reshape(2, 3)
+        obs = agpar._shared_array(exp)
+        npt.assert_array_equal(obs, exp)
+        self.assertFalse(obs.flags.writeable)
+
+    def test_share_table(self):
+        obs = agpar._share(self.table.copy())
+        shared = obs.matrix_data
+        self.assertEqual(shared.getformat(), 'csc')
+        self.assertFalse(shared.data.flags.writeable)
+        npt.assert_array_equal(obs.data('S3'), [2, 5])
+        npt.assert_array_equal(obs.data('O2', axis='observation'), [3, 0, 5])
+        npt.assert_array_equal(list(obs.iter_data(axis='observation')),
+                               [[0, 1, 2], [3, 0, 5]])
+        self.assertEqual(obs, self.table)
+        self.assertEqual(self.table, obs)
+        self.assertEqual(obs, agpar._share(self.table.copy()))
+        self.assertNotEqual(obs, self.table.filter(['S1'], inplace=False))
+
+        # access along either axis leaves the shared matrix in place
+        self.assertIs(obs.matrix_data, shared)
+
+        filtered = obs.filter(['S1'], inplace=False)
+        self.assertIs(type(filtered), biom.Table)
+        npt.assert_array_equal(filtered.data('S1'), [0, 3])
+        npt.assert_array_equal(filtered.data('O2', axis='observation'), [3])
+        self.assertIs(obs.matrix_data, shared)
+
+    def test_share_tuple(self):
+        obs = agpar._share((self.table.copy(), np.arange(3), 'foo'))
+        self.assertIsInstance(obs, tuple)
+        self.assertEqual(obs[0], self.table)
+        npt.assert_array_equal(obs[1], [0, 1, 2])
+        self.assertFalse(obs[1].flags.writeable)
+        self.assertEqual(obs[2], 'foo')
+
+    def test_share_distance_matrix(self):
+        dm = DistanceMatrix([[0, 1], [1, 0]], ['a', 'b'])
+        obs = agpar._share(dm)
+        npt.assert_array_equal(obs['a'], [0, 1])
+        self.assertFalse(obs.data.flags.writeable)
+
+    def test_publish_and_get_artifact(self):
+        unavailable = agpar.publish_artifacts([(self.loader, 'foo'),
+                                               (self.loader, 'missing'),
+                                               (self.loader, 'foo')])
+        self.assertEqual(unavailable, [(self.loader, 'missing')])
+        self.assertEqual(self.loaded, ['foo', 'missing'])
+
+        first = agpar.get_artifact(self.loader, 'foo')
+        second = agpar.get_artifact(self.loader, 'foo')
+        self.assertIs(first, second)
+        self.assertEqual(self.loaded, ['foo', 'missing'])
+
+    def test_get_artifact_not_published(self):
+        agpar.get_artifact(self.loader, 'bar')
+        agpar.get_artifact(self.loader, 'bar')
+        self.assertEqual(self.loaded, ['bar', 'bar'])
+
+    def test_clear_artifacts(self):
+        agpar.publish_artifacts([(self.loader, 'foo')])
+        agpar.clear_artifacts()
+        agpar.get_artifact(self.loader, 'foo')
+        self.assertEqual(self.loaded, ['foo', 'foo'])
+
+    def test_next_chunk_probes_unstarted(self):
+        states = agpar.partition_states([('a', range(100)), ('b', range(3))])
+        state, obs = agpar.next_chunk(states, initial_size=10)
+        self.assertEqual((state['func'], obs), ('a', range(10)))
+        state, obs = agpar.next_chunk(states, initial_size=10)
+        self.assertEqual((state['func'], obs), ('b', range(3)))
+
+        # nothing observed yet, so the default size is used
+        state, obs = agpar.next_chunk(states, initial_size=10)
+        self.assertEqual((state['func'], obs), ('a', range(10, 20)))
+
+    def test_next_chunk_adapts(self):
+        states = agpar.partition_states([('cheap', range(100)),
+                                         ('costly', range(100))])
+        agpar.next_chunk(states, initial_size=10)
+        agpar.next_chunk(states, initial_size=10)
+        states[0]['samples'], states[0]['seconds'] = 10, 1.0
+        states[1]['samples'], states[1]['seconds'] = 10, 20.0
+
+        # the costly partition has the most remaining work, and is sized to
+        # the target duration
+        state, obs = agpar.next_chunk(states, target_seconds=10.0)
+        self.assertEqual((state['func'], obs), ('costly', range(10, 15)))
+
+        # the cheap partition is bound by the maximum size
+        states[1]['offset'] = 100
+        state, obs = agpar.next_chunk(states, target_seconds=10.0,
+                                      max_size=50)
+        self.assertEqual((state['func'], obs), ('cheap', range(10, 60)))
+        state, obs = agpar.next_chunk(states, target_seconds=10.0,
+                                      max_size=50)
+        self.assertEqual((state['func'], obs), ('cheap', range(60, 100)))
+
+        self.assertEqual(agpar.next_chunk(states), (None, None))
+
+    def test_format_progress(self):
+        self.assertEqual(agpar.format_progress(10, 100, 5.0),
+                         '10/100 samples (2.00 samples/s, ETA 0:00:45)')
+        self.assertEqual(agpar.format_progress(0, 100, 0.0),
+                         '0/100 samples (0.00 samples/s, ETA unknown)')
+        self.assertEqual(agpar.format_progress(1, 7201, 1.0),
+                         '1/7201 samples (1.00 samples/s, ETA 2:00:00)')
+
+    def test_dispatcher(self):
+        success, fail, progress = StringIO(), StringIO(), StringIO()
+        partitions = [(_odd_fails, ['1', '2', '3']), (_odd_fails, ['4'])]
+        agpar.dispatcher(success, fail, partitions, progress_fp=progress)
+
+        success = success.getvalue().splitlines()
+        fail = fail.getvalue().splitlines()
+        self.assertEqual(success[0], '#SampleID')
+        self.assertEqual(sorted(success[1:]), ['2', '4'])
+        self.assertEqual(fail[0], '#SampleID\tError(s)')
+        self.assertEqual(sorted(fail[1:]), ['1\todd', '3\todd'])
+        self.assertTrue(progress.getvalue().splitlines()[-1].startswith(
+            '4/4 samples'))
+
+    def test_profile_call(self):
+        del agpar._PROFILE_RECORDS[:]
+        obs = agpar.profile_call('foo', 'oral', ['a', 'b'], sum, [1, 2])
+        self.assertEqual(obs, 3)
+        self.assertEqual(len(agpar._PROFILE_RECORDS), 1)
+        record = agpar._PROFILE_RECORDS[0]
+        self.assertEqual(sorted(record), sorted(agpar._PROFILE_FIELDS))
+        self.assertEqual(record['function'], 'foo')
+        self.assertEqual(record['sample_type'], 'oral')
+        self.assertEqual(record['samples'], 2)
+        self.assertTrue(record['wall_seconds'] >= 0)
+        del agpar._PROFILE_RECORDS[:]
+
+    def test_write_profile(self):
+        records = [{'function': 'a', 'sample_type': 'fecal', 'samples': 2,
+                    'wall_seconds': 1.0, 'cpu_seconds': 0.5,
+                    'max_rss_delta_kb': 10, 'pid': 1},
+                   {'function': 'a', 'sample_type': 'fecal', 'samples': 2,
+                    'wall_seconds': 3.0, 'cpu_seconds': 1.5,
+                    'max_rss_delta_kb': 5, 'pid': 2},
+                   {'function': 'b', 'sample_type': 'oral', 'samples': 1,
+                    'wall_seconds': 1.0, 'cpu_seconds': 1.0,
+                    'max_rss_delta_kb': 0, 'pid': 1}]
+        fp = StringIO()
+        agpar.write_profile(records, fp)
+        obs = [line.split('\t') for line in fp.getvalue().splitlines()]
+        self.assertEqual(obs[0][0], '#function')
+        self.assertEqual(obs[1], ['a', 'fecal', '2', '4', '4.000', '2.000',
+                                  '1.0000', '0.5000', '10'])
+        self.assertEqual(obs[2], ['b', 'oral', '1', '1', '1.000', '1.000',
+                                  '1.0000', '1.0000', '0'])
+
+    def test_dispatcher_profile(self):
+        success, fail, profile = StringIO(), StringIO(), StringIO()
+        partitions = [(_profiled, ['1', '2', '3'])]
+        agpar.dispatcher(success, fail, partitions, profile_fp=profile)
+        obs = profile.getvalue().splitlines()
+        self.assertEqual(len(obs), 2)
+        self.assertEqual(obs[1].split('\t')[:4], ['_profiled', 'fecal', '1',
+                                                  '3'])
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ __maintainer__ = "Sam Way"
 __email__ = "samuel.way@colorado.edu"
 
 from os.path import realpath, dirname, join
+from StringIO import StringIO
 
 from numpy import array, array_equal
 from unittest import TestCase, main
@@ -47,6 +48,20 @@ class TestMappingFileParse(TestCase):
                 self.assertEqual(sample_dict[category],
                                  self.metadata_dict[sample_id][category])
 
+    def test_mapping_file_whitespace(self):
+        # the ends of each line are stripped
+        mapping = StringIO('#SampleID\tTEST_CATEGORY\tAWESOME_CATEGORY\n'
+                           '# a comment \n'
+                           'sample_a\t1\tsuper \n'
+                           ' sample_b\t2 \ttotally\r\n')
+        exp = ({'sample_a': {'TEST_CATEGORY': '1',
+                             'AWESOME_CATEGORY': 'super'},
+                'sample_b': {'TEST_CATEGORY': '2 ',
+                             'AWESOME_CATEGORY': 'totally'}},
+               [' a comment'])
+        obs = parse_mapping_file_to_dict(mapping)
+        self.assertEqual(obs, exp)
+
 
 class TestTaxaSummaryFileParse(TestCase):
     def setUp(self):
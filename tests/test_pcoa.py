@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import matplotlib
+import numpy as np
+import pandas as pd
+from skbio import DistanceMatrix
+
+import americangut.pcoa as agpcoa
+
+
+class PCoATests(TestCase):
+    def setUp(self):
+        self.dm = DistanceMatrix([[0.0, 0.1, 0.4, 0.2],
+                                  [0.1, 0.0, 0.3, 0.5],
+                                  [0.4, 0.3, 0.0, 0.6],
+                                  [0.2, 0.5, 0.6, 0.0]],
+                                 ['a', 'b', 'c', 'd'])
+
+    def test_closest_sample(self):
+        self.assertEqual(agpcoa.closest_sample(self.dm, 'a', 'bcd'), 'b')
+        self.assertEqual(agpcoa.closest_sample(self.dm, 'a', 'cd'), 'd')
+        self.assertEqual(agpcoa.closest_sample(self.dm, 'c', 'abd'), 'b')
+
+    def test_closest_sample_ignores_self(self):
+        self.assertEqual(agpcoa.closest_sample(self.dm, 'a', 'ac'), 'c')
+
+    def test_closest_sample_no_candidates(self):
+        with self.assertRaises(ValueError):
+            agpcoa.closest_sample(self.dm, 'a', ['a', 'x'])
+
+    def test_plot_body_site_missing(self):
+        coords = pd.DataFrame(np.zeros((2, 2)), index=['a', 'b'])
+        mapping = pd.DataFrame({'TITLE_BODY_SITE': ['AGP-FECAL'] * 2},
+                               index=['a', 'b'])
+        with self.assertRaises(ValueError):
+            agpcoa.plot_body_site(coords, mapping, 'x', 'foo.pdf')
+
+    def test_plot_country_missing(self):
+        coords = pd.DataFrame(np.zeros((2, 2)), index=['a', 'b'])
+        mapping = pd.DataFrame({'COUNTRY': ['Malawi'] * 2}, index=['a', 'b'])
+        with self.assertRaises(ValueError):
+            agpcoa.plot_country(coords, mapping, self.dm, 'x', 'foo.pdf')
+
+    def test_plot_body_site(self):
+        ids = list('abcd')
+        coords = pd.DataFrame(np.random.RandomState(0).randn(4, 2),
+                              index=ids)
+        mapping = pd.DataFrame({'TITLE_BODY_SITE': ['AGP-FECAL', 'AGP-ORAL',
+                                                    'HMP-SKIN', 'PGP-FECAL']},
+                               index=ids)
+        tmp = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(tmp, 'body_site.pdf')
+            self.assertIsNone(agpcoa.plot_body_site(coords, mapping, 'b',
+                                                    out_file))
+            self.assertTrue(os.path.exists(out_file))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_plot_gradient(self):
+        ids = list('abcd')
+        coords = pd.DataFrame(np.random.RandomState(0).randn(4, 2),
+                              index=ids)
+        mapping = pd.DataFrame({'AGE': ['30', '45', 'no_data', '60']},
+                               index=ids)
+        tmp = tempfile.mkdtemp()
+        try:
+            for sample in ['a', 'c']:
+                out_file = os.path.join(tmp, '%s.pdf' % sample)
+                self.assertIsNone(agpcoa.plot_gradient(coords, mapping,
+                                                       'AGE', sample,
+                                                       out_file))
+                self.assertTrue(os.path.exists(out_file))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_plot_country(self):
+        ids = list('abcdefgh')
+        coords = pd.DataFrame(np.random.RandomState(0).randn(8, 2),
+                              index=ids)
+        mapping = pd.DataFrame({'COUNTRY': ['USA', 'Malawi'] * 4},
+                               index=ids)
+        dm = DistanceMatrix(np.ones((9, 9)) - np.eye(9), ids + ['x'])
+        tmp = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(tmp, 'country.pdf')
+            line_width = matplotlib.rcParams['lines.linewidth']
+            self.assertIsNone(agpcoa.plot_country(coords, mapping, dm, 'x',
+                                                  out_file))
+            self.assertTrue(os.path.exists(out_file))
+
+            # the settings of later figures are not changed
+            self.assertEqual(matplotlib.rcParams['lines.linewidth'],
+                             line_width)
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,16 @@
 import os
 import shutil
+import tempfile
 from unittest import TestCase, main
 
+import biom
 import numpy as np
 import pandas as pd
 import numpy.testing as npt
 
 import americangut as ag
 import americangut.notebook_environment as agenv
+import americangut.parallel as agpar
 import americangut.per_sample as agps
 
 
@@ -33,6 +36,83 @@ class PerSampleTests(TestCase):
         obs = agps.sample_type_processor(funcs, opts, ids)
         self.assertEqual(obs, exp)
 
+    def test_sample_type_processor_profiling(self):
+        funcs = [lambda a, b: {c: None for c in b}]
+        os.environ['AG_PROFILE'] = 'True'
+        try:
+            del agpar._PROFILE_RECORDS[:]
+            obs = agps.sample_type_processor(funcs, {'sample_type': 'oral'},
+                                             ['a', 'b'])
+        finally:
+            del os.environ['AG_PROFILE']
+
+        self.assertEqual(obs, {'a': [], 'b': []})
+        self.assertEqual(len(agpar._PROFILE_RECORDS), 1)
+        self.assertEqual(agpar._PROFILE_RECORDS[0]['function'], '<lambda>')
+        self.assertEqual(agpar._PROFILE_RECORDS[0]['samples'], 2)
+        del agpar._PROFILE_RECORDS[:]
+
+    def test_sample_type_processor_manifest(self):
+        tmp = tempfile.mkdtemp()
+        table_fp = os.path.join(tmp, 'table.biom')
+        table = biom.Table(np.array([[1, 2], [3, 4]]), ['k__a', 'k__b'],
+                           ['s1', 's2'])
+        with open(table_fp, 'w') as fp:
+            fp.write(table.to_json('test'))
+        for id_ in ['s1', 's2', 's3']:
+            os.mkdir(os.path.join(tmp, id_))
+        opts = {'per-sample': {'results': tmp,
+                               'manifest': os.path.join(tmp, 'm.sqlite')},
+                'taxa': {'notrim': {'L6': {'ag-fecal-biom': table_fp}}},
+                'beta': {'100nt': {'1k': {}}},
+                'sample_type': 'fecal'}
+        calls = []
+
+        def untracked(opts, ids):
+            calls.append(list(ids))
+            return {id_: None for id_ in ids}
+
+        funcs = [agps.taxa_summaries, untracked]
+        obs = agps.sample_type_processor(funcs, opts, ['s1', 's2', 's3'])
+        self.assertEqual(obs, {'s1': [], 's2': [], 's3': ['ID not found']})
+
+        # current outputs are not regenerated, failures are retried
+        summary_fp = os.path.join(tmp, 's1', 's1.txt')
+        with open(summary_fp, 'w') as fp:
+            fp.write('sentinel')
+        obs = agps.sample_type_processor(funcs, opts, ['s1', 's2', 's3'])
+        self.assertEqual(obs, {'s1': [], 's2': [], 's3': ['ID not found']})
+        self.assertEqual(open(summary_fp).read(), 'sentinel')
+        self.assertEqual(calls, [['s1', 's2', 's3'], ['s1', 's2', 's3']])
+
+        # missing outputs are regenerated
+        os.remove(summary_fp)
+        agps.sample_type_processor(funcs, opts, ['s1'])
+        self.assertTrue(open(summary_fp).read().startswith('#taxon'))
+
+        # a new round of samples does not invalidate the summaries, which
+        # only depend on each sample's own values
+        with open(summary_fp, 'w') as fp:
+            fp.write('sentinel')
+        new_round = biom.Table(np.array([[1, 2, 5], [3, 4, 6]]),
+                               ['k__a', 'k__b'], ['s1', 's2', 's3'])
+        with open(table_fp, 'w') as fp:
+            fp.write(new_round.to_json('test'))
+        obs = agps.sample_type_processor(funcs, opts, ['s1', 's3'])
+        self.assertEqual(obs, {'s1': [], 's3': []})
+        self.assertEqual(open(summary_fp).read(), 'sentinel')
+        self.assertTrue(os.path.exists(os.path.join(tmp, 's3', 's3.txt')))
+
+        # but a change to the sample's values does
+        changed = biom.Table(np.array([[1, 2, 5], [4, 4, 6]]),
+                             ['k__a', 'k__b'], ['s1', 's2', 's3'])
+        with open(table_fp, 'w') as fp:
+            fp.write(changed.to_json('test'))
+        agps.sample_type_processor(funcs, opts, ['s1'])
+        self.assertTrue(open(summary_fp).read().startswith('#taxon'))
+
+        shutil.rmtree(tmp)
+
     def test_result_path(self):
         self.assertEqual(agps._result_path(agenv.paths, 'a'),
                          agenv.paths['per-sample']['results'] + '/a')
@@ -64,29 +144,62 @@ class PerSampleTests(TestCase):
         obs = agps.merge_error_reports(*[report_a, report_b, report_c])
         self.assertEqual(obs, exp)
 
-    def test_iter_ids_over_system_call(self):
-        cmd_fmt = "ls %(result_path)s %(id)s"
-        ids = ['/', '/asdasd', '/usr']
-        opts = {'per-sample': {'results': ''}}
+    def test_iter_ids_in_process(self):
+        def loader(opts, ids):
+            return opts['value']
+
+        def render_f(inputs, id_, result_path):
+            if id_ == 'bad':
+                raise ValueError('bad sample')
+            rendered.append((inputs, id_, result_path))
+
+        rendered = []
+        opts = {'per-sample': {'results': 'foo'}, 'value': 'x'}
+        obs = agps._iter_ids_in_process(loader, render_f, ['a', 'bad', 'b'],
+                                        opts)
+        exp = {'a': None, 'bad': 'FAILED (bad sample): render_f bad',
+               'b': None}
+        self.assertEqual(obs, exp)
+        self.assertEqual(rendered, [('x', 'a', 'foo/a'), ('x', 'b', 'foo/b')])
 
-        obs = agps._iter_ids_over_system_call(cmd_fmt, ids, opts)
+    def test_iter_ids_in_process_loader_fails(self):
+        def loader(opts, ids):
+            raise IOError('cannot load')
 
-        # ls behaves differently on BSD and Linux
-        self.assertEqual(obs['/'], None)
-        self.assertTrue(obs['/asdasd'].startswith('FAILED (ls: '))
-        self.assertTrue(obs['/asdasd'].endswith('ls /asdasd /asdasd'))
-        self.assertEqual(obs['/usr'], None)
+        def render_f(inputs, id_, result_path):
+            self.fail("should not render")
+
+        obs = agps._iter_ids_in_process(loader, render_f, ['a', 'b'], {})
+        exp = {'a': 'FAILED (cannot load): loader',
+               'b': 'FAILED (cannot load): loader'}
+        self.assertEqual(obs, exp)
+
+    def test_shared_artifacts(self):
+        opts = agps.create_opts('fecal', 'somepath', gradient_color_by='foo',
+                                barchart_categories=('sex', ))
+        obs = agps.shared_artifacts(opts, opts)
+        self.assertEqual(len(obs), len(set(obs)))
+        self.assertIn((agps.biom.load_table,
+                       opts['otus']['100nt']['ag-biom']), obs)
+        self.assertIn((agps._read_distance_matrix,
+                       opts['beta']['100nt']['1k']['ag-gg-unifrac']), obs)
+        sex_table = opts['collapsed']['100nt']['1k']['ag-fecal-sex-biom']
+        self.assertIn((agps.biom.load_table, sex_table), obs)
+        self.assertIn((agps._read_significance_cohort,
+                       opts['taxa']['notrim']['L6']['ag-fecal-biom']), obs)
+
+    def test_parse_barchart_categories(self):
+        obs = agps._parse_barchart_categories('"SEX:/a/b.biom, AGE_CAT:c"')
+        self.assertEqual(obs, {'SEX': '/a/b.biom', 'AGE_CAT': 'c'})
+        self.assertEqual(agps._parse_barchart_categories('""'), {})
 
     # When the unit test suite is run, we cannot assume that the expected
     # inputs to these methods are available. The intent of these next
-    # tests are to verify that the expected commands for system calls are
-    # being formed as expected indirectly via forcing failures.
+    # tests are to verify that the expected inputs are being loaded
+    # indirectly via forcing failures.
     def test_taxon_significance(self):
-        exp = {'test': ('FAILED (generate_otu_signifigance_tables_AGP.py: '
-                        'error: The supplied taxonomy file does not exist '
-                        'in the path.): '
-                        'generate_otu_signifigance_tables_AGP.py '
-                        '-i bar.biom -o foo/test -s test -m baz')}
+        exp = {'test': ("FAILED ([Errno 2] No such file or directory: "
+                        "'bar.biom'): _load_significance_inputs")}
         ids = ['test']
         opts = {'per-sample': {'results': 'foo'},
                 'taxa': {'notrim': {'L6': {'ag-bar-biom': 'bar.biom'}}},
@@ -97,10 +210,8 @@ class PerSampleTests(TestCase):
         self.assertEqual(obs, exp)
 
     def test_body_site_pcoa(self):
-        exp = {'test': ('FAILED (Error: Invalid value for "--coords": Path '
-                        '"foo" does not exist.): mod2_pcoa.py body_site '
-                        '--coords foo --mapping_file bar --output baz/test '
-                        '--filename figure1.pdf --sample test')}
+        exp = {'test': ("FAILED ([Errno 2] No such file or directory: "
+                        "'foo'): _load_body_site_inputs")}
         ids = ['test']
         opts = {'per-sample': {'results': 'baz'},
                 'beta':
@@ -113,11 +224,8 @@ class PerSampleTests(TestCase):
         self.assertEqual(obs, exp)
 
     def test_countly_pcoa(self):
-        exp = {'test': ('FAILED (Error: Invalid value for "--distmat": Path '
-                        '"foo" does not exist.): mod2_pcoa.py country '
-                        '--distmat foo --coords bar --mapping_file baz '
-                        '--output foobar/test --filename figure2.pdf '
-                        '--sample test')}
+        exp = {'test': ("FAILED ([Errno 2] No such file or directory: "
+                        "'foo'): _load_country_inputs")}
         ids = ['test']
         opts = {'per-sample': {'results': 'foobar'},
                 'beta':
@@ -131,11 +239,8 @@ class PerSampleTests(TestCase):
         self.assertEqual(obs, exp)
 
     def test_gradient_pcoa(self):
-        exp = {'test': ('FAILED (Error: Invalid value for "--coords": Path '
-                        '"foo" does not exist.): mod2_pcoa.py gradient '
-                        '--coords foo --mapping_file bar --output baz/test '
-                        '--filename figure3.pdf --color foobar '
-                        '--sample test')}
+        exp = {'test': ("FAILED ([Errno 2] No such file or directory: "
+                        "'foo'): _load_gradient_inputs")}
         ids = ['test']
         opts = {'per-sample': {'results': 'baz'},
                 'beta': {'100nt': {'1k': {'ag-what-unifrac-pc': 'foo'}}},
@@ -147,9 +252,8 @@ class PerSampleTests(TestCase):
         self.assertEqual(obs, exp)
 
     def test_pie_plot(self):
-        exp = {'test': ('FAILED (make_pie_plot_AGP.py: error: The supplied '
-                        'taxonomy file does not exist in the path.): '
-                        'make_pie_plot_AGP.py -i foo -o bar/test -s test')}
+        exp = {'test': ("FAILED ([Errno 2] No such file or directory: "
+                        "'foo'): _load_pie_inputs")}
         ids = ['test']
         opts = {'per-sample': {'results': 'bar'},
                 'taxa': {'notrim': {'L3': {'ag-tsv': 'foo'}}}}
@@ -157,11 +261,38 @@ class PerSampleTests(TestCase):
         obs = agps.pie_plot(opts, ids)
         self.assertEqual(obs, exp)
 
+    def test_pie_plot_renders(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            table_fp = os.path.join(tmp, 'L3.biom')
+            table = biom.Table(np.array([[0.5, 0.1], [0.3, 0.9], [0.2, 0.0],
+                                         [0.0, 0.0]]),
+                               ['k__Bacteria; p__Firmicutes; c__Clostridia',
+                                'k__Bacteria; p__Bacteroidetes; '
+                                'c__Bacteroidia',
+                                'k__Bacteria; p__Tenericutes; c__Mollicutes',
+                                'k__Bacteria; p__TM7; c__TM7-3'],
+                               ['s1', 's2'])
+            with open(table_fp, 'w') as fp:
+                fp.write(table.to_json('test'))
+            for id_ in ['s1', 's2']:
+                os.mkdir(os.path.join(tmp, id_))
+            opts = {'per-sample': {'results': tmp},
+                    'taxa': {'notrim': {'L3': {'ag-tsv': table_fp}}}}
+
+            obs = agps.pie_plot(opts, ['s1', 's2', 'missing'])
+            self.assertEqual(obs['s1'], None)
+            self.assertEqual(obs['s2'], None)
+            self.assertTrue(obs['missing'].startswith('FAILED'))
+            for id_ in ['s1', 's2']:
+                self.assertTrue(os.path.exists(os.path.join(tmp, id_,
+                                                            'figure2.pdf')))
+        finally:
+            shutil.rmtree(tmp)
+
     def test_bar_chart(self):
-        exp = {'test': ('FAILED (make_phyla_plots_AGP.py: error: The supplied '
-                        'biom table does not exist in the path.): '
-                        'make_phyla_plots_AGP.py -i foo -m baz -o bar/test '
-                        '-c stuff -t what -s test')}
+        exp = {'test': ("FAILED ([Errno 2] No such file or directory: "
+                        "'foo'): _load_barchart_inputs")}
         ids = ['test']
         opts = {'per-sample': {'results': 'bar'},
                 'collapsed':
@@ -267,5 +398,34 @@ class PerSampleTests(TestCase):
         with self.assertRaises(ValueError):
             agps.alpha_plot(opts, ['sample_a', 'sample_b'])
 
+    def test_alpha_plot_missing_alpha(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            alpha_fp = os.path.join(tmp, 'alpha.txt')
+            with open(alpha_fp, 'w') as fp:
+                fp.write('#SampleID\tSIMPLE_BODY_SITE\tshannon_1k\t'
+                         'PD_whole_tree_1k\n'
+                         'a\tFECAL\t4.5\t20.1\n'
+                         'b\tFECAL\t\t18.3\n'
+                         'c\tFECAL\t5.2\tNA\n')
+            os.mkdir(os.path.join(tmp, 'a'))
+            opts = {'collapsed': {'100nt': {'alpha-map': alpha_fp}},
+                    'per-sample': {'results': tmp},
+                    'sample_type': 'fecal'}
+
+            alpha_map = agps._read_alpha_map(alpha_fp)
+            self.assertTrue(pd.isnull(alpha_map.loc[1, 'shannon_1k']))
+            self.assertTrue(pd.isnull(alpha_map.loc[2, 'PD_whole_tree_1k']))
+
+            obs = agps.alpha_plot(opts, ['a'])
+            self.assertEqual(obs, {'a': None})
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'a',
+                                                        'shannon_a.png')))
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'a',
+                                                        'pd_a.png')))
+        finally:
+            shutil.rmtree(tmp)
+
+
 if __name__ == '__main__':
     main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
+import os
+import tempfile
 from StringIO import StringIO
 from unittest import TestCase, main
 from collections import defaultdict
 
+import americangut.util as agu
 from americangut.results_utils import (
     filter_mapping_file, count_unique_sequences_per_otu,
     write_bloom_fasta
@@ -38,6 +41,26 @@ class ResultsUtilsTests(TestCase):
             self.assertEqual(l[test_sbs], 'FECAL')
             self.assertTrue(float(l[test_age]) > 20)
 
+    def test_filter_mapping_file_processes(self):
+        criteria = {'SIMPLE_BODY_SITE': lambda x: x == 'FECAL',
+                    'AGE': lambda x: float(x) > 20}
+        filter_mapping_testdata.seek(0)
+        exp = StringIO()
+        filter_mapping_file(filter_mapping_testdata, exp, dict(criteria))
+
+        chunk_rows = agu.MAPPING_CHUNK_ROWS
+        agu.MAPPING_CHUNK_ROWS = 2
+        try:
+            filter_mapping_testdata.seek(0)
+            obs = StringIO()
+            filter_mapping_file(filter_mapping_testdata, obs, dict(criteria),
+                                processes=2)
+        finally:
+            agu.MAPPING_CHUNK_ROWS = chunk_rows
+
+        self.assertEqual(obs.getvalue(), exp.getvalue())
+        self.assertEqual(len(exp.getvalue().splitlines()), 3)
+
     def test_count_unique_sequences_per_otu(self):
         input_fasta = StringIO(test_fasta)
         otu_map = StringIO(test_otu_map)
@@ -53,6 +76,27 @@ class ResultsUtilsTests(TestCase):
 
         self.assertEqual(expected, result)
 
+    def test_count_unique_sequences_per_otu_processes(self):
+        fd, path = tempfile.mkstemp(suffix='.fna')
+        os.close(fd)
+        try:
+            with open(path, 'w') as fp:
+                fp.write(test_fasta)
+
+            otu_ids = set(['otu1', 'otu2', 'otu3'])
+            exp = count_unique_sequences_per_otu(otu_ids,
+                                                 StringIO(test_otu_map),
+                                                 StringIO(test_fasta))
+            with open(path) as fp:
+                obs = count_unique_sequences_per_otu(otu_ids,
+                                                     StringIO(test_otu_map),
+                                                     fp, processes=3)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(obs, exp)
+        self.assertEqual(obs['otu3'], {'ATGC': 1})
+
 
     def test_write_bloom_fasta(self):
         otu_ids = set(['otu1', 'otu2'])
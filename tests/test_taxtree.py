@@ -2,14 +2,20 @@
 
 from unittest import TestCase, main
 from copy import deepcopy
+from tempfile import mkstemp
+import os
 
 from numpy import array
+import numpy.testing as npt
 from biom import Table
 
 from americangut.taxtree import create_node, add_node, get_node, update_tree, \
         get_rare_unique, traverse, sample_rare_unique, \
+        sample_rare_unique_masks, \
         build_persample_tree_from_taxontable, set_relative_freqs, \
-        update_per_sample_tree
+        update_per_sample_tree, TaxonTrie, build_tree_from_taxontable, \
+        index_taxontable, sample_rare_unique_indexed, sample_observations, \
+        PopulationTree, PerSampleTrees
 
 __author__ = "Daniel McDonald"
 __copyright__ = "Copyright 2013, The American Gut Project"
@@ -60,6 +66,19 @@ class TaxTreeTests(TestCase):
         obs_a = build_persample_tree_from_taxontable(table).next()
         self.assertEqual(obs_a, exp_a)
 
+    def test_per_sample_trees(self):
+        trees = PerSampleTrees(table)
+        self.assertEqual(len(trees), 3)
+        self.assertEqual(trees.sample_tree('a'), self.persample)
+        self.assertEqual(list(trees), list(
+            build_persample_tree_from_taxontable(table)))
+
+        node_ids, counts = trees.sample_counts('b')
+        names = [trees.tree.names[i] for i in node_ids]
+        self.assertEqual(names, ['root', 'k__1', 'p__x', 'c__1', 'c__2',
+                                 'c__', 'p__y', 'c__3', 'c__'])
+        npt.assert_equal(counts, array([41, 41, 15, 2, 5, 8, 26, 11, 15]))
+
     def test_set_relative_freqs(self):
         persample_copy = deepcopy(self.persample)
         self.persample['freq'] = None
@@ -149,6 +168,35 @@ class TaxTreeTests(TestCase):
             self.assertEqual(o[2], e[2])
             self.assertEqual(o[3], e[3])
 
+    def test_sample_rare_unique_masks(self):
+        t = update_tree(None, tax_strings_by_sample)
+        tax_by_sample = {'a':tax_strings_by_sample[0],
+                         'b':tax_strings_by_sample[1],
+                         'c':tax_strings_by_sample[2]}
+        exp = [('a', [False, False, False, False, True],
+                [['k__1','p__x','c__'],['k__1','p__y','c__3']],
+                [['k__1','p__x','c__1'],['k__1','p__x','c__2']]),
+               ('b', [True, True, False, False, True],
+                [['k__1','p__x','c__'],['k__1','p__y','c__3']], []),
+               ('c', [True, True, True, True, True], [], [])]
+
+        obs = sorted(sample_rare_unique_masks(t, table, tax_by_sample, 0.7))
+        self.assertEqual(len(obs), len(exp))
+        for o, e in zip(obs, exp):
+            self.assertEqual(o[0], e[0])
+            npt.assert_array_equal(o[1], e[1])
+            self.assertEqual(o[2], e[2])
+            self.assertEqual(o[3], e[3])
+
+    def test_sample_rare_unique_masks_delimiter(self):
+        t = update_tree(None, tax_strings_by_sample)
+        unspaced = Table(array([[1, 2, 3], [4, 5, 6]]),
+                         ['k__1;p__x;c__1', 'k__1;p__y;c__'],
+                         ['a', 'b', 'c'])
+        obs = dict((o[0], o[1]) for o in sample_rare_unique_masks(
+            t, unspaced, {'a': tax_strings_by_sample[0]}, 0.7))
+        npt.assert_array_equal(obs['a'], [False, True])
+
     def test_create_node(self):
         exp = {'name':'foo','children':[]}
         obs = create_node('foo')
@@ -258,6 +306,157 @@ class TaxTreeTests(TestCase):
         self.assertEqual(obs_rare, exp_rare)
         self.assertEqual(obs_unique, exp_unique)
 
+    def test_taxon_trie_roundtrip(self):
+        exp = update_tree(None, deepcopy(tax_strings_by_sample))
+        trie = TaxonTrie.from_dict(exp)
+        self.assertEqual(trie.to_dict(), exp)
+
+        trie = TaxonTrie()
+        trie.update_population(tax_strings_by_sample)
+        self.assertEqual(trie.to_dict(), exp)
+
+    def test_taxon_trie_find(self):
+        trie = TaxonTrie()
+        trie.update_population(tax_strings_by_sample)
+        node_id = trie.find(['k__1', 'p__y', 'c__3'])
+        self.assertEqual(trie.names[node_id], 'c__3')
+        self.assertEqual(trie.counts[node_id], 2)
+        self.assertEqual(trie.find(['k__1', 'p__z']), None)
+        self.assertEqual(trie.find([]), 0)
+
+        obs = trie.find_all([['k__1'], ['k__2'], ['k__1', 'p__x']])
+        npt.assert_equal(obs, array([1, -1, 2]))
+
+    def test_update_tree_trie(self):
+        trie = TaxonTrie()
+        obs = update_tree(trie, tax_strings_by_sample[:2])
+        self.assertTrue(obs is trie)
+        update_tree(trie, tax_strings_by_sample[2:])
+        self.assertEqual(trie.to_dict(), update_tree(None,
+                                                     tax_strings_by_sample))
+
+        obs_rare, obs_unique = get_rare_unique(trie, sample_taxa, 0.7)
+        self.assertEqual(obs_unique, [['k__1','p__x','c__2']])
+
+    def test_index_taxontable(self):
+        trie, obs_taxa, sample_obs = index_taxontable(presence_table)
+        self.assertEqual(trie.to_dict(),
+                         update_tree(None, tax_strings_by_sample))
+        self.assertEqual(obs_taxa, [['k__1','p__x','c__1'],
+                                    ['k__1','p__x','c__2'],
+                                    ['k__1','p__x','c__'],
+                                    ['k__1','p__y','c__3'],
+                                    ['k__1','p__y','c__']])
+        self.assertEqual(sorted(sample_obs), ['a', 'b', 'c'])
+        npt.assert_equal(sample_obs['a'], array([0, 1, 2, 3]))
+        npt.assert_equal(sample_obs['b'], array([2, 3]))
+        npt.assert_equal(sample_obs['c'], array([4]))
+
+    def test_build_tree_from_taxontable(self):
+        tree, lookup = build_tree_from_taxontable(presence_table)
+        self.assertEqual(tree, update_tree(None, tax_strings_by_sample))
+        self.assertEqual(lookup, {'a': tax_strings_by_sample[0],
+                                  'b': tax_strings_by_sample[1],
+                                  'c': tax_strings_by_sample[2]})
+
+    def test_shared_name_builders_agree(self):
+        # g__Clostridium is the name of a genus in two families
+        taxa = ['k__B; p__F; c__C; o__C; f__Clostridiaceae; g__Clostridium',
+                'k__B; p__F; c__C; o__C; f__Lachnospiraceae; g__Clostridium',
+                'k__B; p__F; c__C; o__C; f__Lachnospiraceae; g__Blautia']
+        table = Table(array([[1, 0, 1],
+                             [1, 1, 0],
+                             [0, 1, 1]]), taxa, ['a', 'b', 'c'])
+        taxa_by_sample = [[t.split('; ') for t, v in zip(taxa, column) if v]
+                          for column in table.matrix_data.toarray().T]
+
+        exp = update_tree(None, taxa_by_sample)
+        tree, _ = build_tree_from_taxontable(table)
+        self.assertEqual(tree, exp)
+        pop = PopulationTree()
+        pop.add_samples(table)
+        self.assertEqual(pop.tree.to_dict(), exp)
+
+        trie = TaxonTrie.from_dict(exp)
+        for family, count in (('f__Clostridiaceae', 2),
+                              ('f__Lachnospiraceae', 2)):
+            node_id = trie.find(['k__B', 'p__F', 'c__C', 'o__C', family,
+                                 'g__Clostridium'])
+            self.assertEqual(trie.counts[node_id], count)
+
+    def test_sample_rare_unique_indexed(self):
+        trie, obs_taxa, sample_obs = index_taxontable(presence_table)
+        exp = [('a', [['k__1','p__x','c__'],['k__1','p__y','c__3']],
+                     [['k__1','p__x','c__1'],['k__1','p__x','c__2']]),
+               ('b', [['k__1','p__x','c__'],['k__1','p__y','c__3']], []),
+               ('c', [], [])]
+        obs = sample_rare_unique_indexed(trie, obs_taxa, sample_obs, 0.7)
+        self.assertEqual(sorted(obs), exp)
+
+        tree = update_tree(None, tax_strings_by_sample[2:])
+        with self.assertRaisesRegexp(ValueError, "p__x doesn't exist!"):
+            list(sample_rare_unique_indexed(tree, obs_taxa, sample_obs, 0.7))
+
+    def test_sample_observations(self):
+        obs_taxa, sample_obs = sample_observations(presence_table, ['b'])
+        self.assertEqual(obs_taxa[3], ['k__1','p__y','c__3'])
+        self.assertEqual(list(sample_obs), ['b'])
+        npt.assert_equal(sample_obs['b'], array([2, 3]))
+
+    def test_population_tree_add_samples(self):
+        exp = update_tree(None, tax_strings_by_sample)
+        pop = PopulationTree()
+        self.assertEqual(pop.add_samples(presence_table, ['a', 'b']),
+                         ['a', 'b'])
+        self.assertEqual(pop.add_samples(presence_table), ['c'])
+        self.assertEqual(pop.add_samples(presence_table), [])
+        self.assertEqual(pop.tree.to_dict(), exp)
+        self.assertEqual(len(pop), 3)
+        self.assertTrue('c' in pop)
+
+    def test_population_tree_remove_samples(self):
+        pop = PopulationTree()
+        pop.add_samples(presence_table)
+        self.assertEqual(pop.remove_samples(['a', 'x']), ['a'])
+        self.assertFalse('a' in pop)
+
+        obs = pop.tree
+        self.assertEqual(obs.counts[0], 2)
+        self.assertEqual(obs.counts[obs.find(['k__1', 'p__x'])], 1)
+        self.assertEqual(obs.counts[obs.find(['k__1', 'p__x', 'c__1'])], 0)
+        self.assertEqual(obs.counts[obs.find(['k__1', 'p__y', 'c__3'])], 1)
+
+        pop.add_samples(presence_table)
+        self.assertEqual(pop.tree.to_dict(),
+                         update_tree(None, tax_strings_by_sample))
+
+    def test_population_tree_save_load(self):
+        pop = PopulationTree()
+        pop.add_samples(presence_table, ['a', 'c'])
+
+        fd, path = mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            pop.save(path)
+            obs = PopulationTree.load(path)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(obs.tree.to_dict(), pop.tree.to_dict())
+        self.assertEqual(sorted(obs.samples), ['a', 'c'])
+        npt.assert_equal(obs.samples['a'], pop.samples['a'])
+
+        obs.add_samples(presence_table)
+        self.assertEqual(obs.tree.to_dict(),
+                         update_tree(None, [tax_strings_by_sample[0],
+                                            tax_strings_by_sample[2],
+                                            tax_strings_by_sample[1]]))
+
+    def test_get_rare_unique_missing(self):
+        t = update_tree(None, tax_strings_by_sample)
+        with self.assertRaisesRegexp(ValueError, "p__z doesn't exist!"):
+            get_rare_unique(t, [['k__1', 'p__z', 'c__1']], 0.7)
+
 tax_strings_by_sample = [
         [
             ['k__1','p__x','c__1'],
@@ -286,6 +485,18 @@ table = Table(array([[1,2,3],
                'k__1; p__y; c__'],
               ['a','b','c'])
 
+presence_table = Table(array([[1,0,0],
+                              [1,0,0],
+                              [1,2,0],
+                              [1,2,0],
+                              [0,0,3]]),
+                       ['k__1; p__x; c__1',
+                        'k__1; p__x; c__2',
+                        'k__1;p__x;c__',
+                        'k__1; p__y; c__3',
+                        'k__1; p__y; c__'],
+                       ['a','b','c'])
+
 sample_taxa = [
         ['k__1','p__x','c__2'],
         ['k__1','p__x','c__'],
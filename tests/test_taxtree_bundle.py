@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import numpy as np
+import numpy.testing as npt
+from biom import Table
+
+from americangut.taxtree import PerSampleTrees
+from americangut.taxtree_bundle import (encode_sample, decode_sample,
+                                        write_bundle, TreeBundle)
+
+
+class TaxTreeBundleTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'trees.bundle')
+        self.table = Table(np.array([[1, 0, 3],
+                                     [4, 5, 0],
+                                     [7, 8, 9],
+                                     [0, 11, 12]]),
+                           ['k__1; p__x; c__1',
+                            'k__1; p__x; c__2',
+                            'k__1; p__y',
+                            'k__2; p__z; c__3'],
+                           ['a', 'b', 'c'])
+        self.trees = PerSampleTrees(self.table)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_encode_decode_sample(self):
+        node_ids, counts = self.trees.sample_nodes('b')
+        obs_ids, obs_counts = decode_sample(encode_sample(node_ids, counts))
+        npt.assert_equal(obs_ids, node_ids)
+        npt.assert_equal(obs_counts, counts)
+
+    def test_write_bundle(self):
+        write_bundle(self.trees, self.path, processes=1)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+        with TreeBundle(self.path) as bundle:
+            self.assertEqual(len(bundle), 3)
+            self.assertEqual(bundle.sample_ids, ['a', 'b', 'c'])
+            self.assertTrue('b' in bundle)
+            self.assertFalse('d' in bundle)
+
+            for sample_id in ['c', 'a', 'b']:
+                self.assertEqual(bundle.sample_tree(sample_id),
+                                 self.trees.sample_tree(sample_id))
+
+    def test_write_bundle_parallel(self):
+        write_bundle(self.trees, self.path, processes=1)
+        with open(self.path, 'rb') as fp:
+            exp = fp.read()
+
+        write_bundle(self.trees, self.path, processes=2)
+        with open(self.path, 'rb') as fp:
+            self.assertEqual(fp.read(), exp)
+
+    def test_sample_nodes_missing(self):
+        write_bundle(self.trees, self.path, processes=1)
+        with TreeBundle(self.path) as bundle:
+            with self.assertRaises(KeyError):
+                bundle.sample_nodes('d')
+
+    def test_not_a_bundle(self):
+        with open(self.path, 'w') as fp:
+            fp.write('foo')
+        with self.assertRaisesRegexp(ValueError, 'not a tree bundle'):
+            TreeBundle(self.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,33 @@
 #!/usr/bin/env python
 
+import gzip
 import os
+import shutil
+import tempfile
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
 import pandas as pd
 
 from StringIO import StringIO
 from unittest import TestCase, main
 
-from numpy import array, nan, arange
+from numpy import array, nan, arange, median, percentile
 from numpy.testing import assert_almost_equal
 from biom import Table
+from scipy.sparse import csr_matrix
 from pandas.util.testing import assert_frame_equal
 
 from americangut.util import (
     slice_mapping_file, parse_mapping_file,
     verify_subset, concatenate_files, trim_fasta, count_samples,
     count_seqs, count_unique_participants, clean_and_reformat_mapping,
-    add_alpha_diversity, get_single_id_lists, collapse_taxonomy, collapse_full
+    add_alpha_diversity, get_single_id_lists, collapse_taxonomy, collapse_full,
+    collapse_taxonomy_levels, sparse_quantiles, summarize_observations,
+    collapse_summaries, fetch_study_details, fetch_samples, fastq_to_fasta,
+    stream_seqs_fasta, from_xmls_to_mapping_file
 )
+import americangut.util as agu
 
 __author__ = "Daniel McDonald"
 __copyright__ = "Copyright 2013, The American Gut Project"
@@ -43,6 +53,17 @@ class UtilTests(TestCase):
         obs = count_samples(iter(test_mapping), criteria={'foo': '2'})
         exp = 2
 
+    def test_count_samples_whitespace(self):
+        test_mapping = ["#SampleID\tfoo\tHOST_SUBJECT_ID",
+                        "A\t1\th1",
+                        "B\t1\th2 \n"]
+        obs = count_samples(iter(test_mapping),
+                            criteria={'HOST_SUBJECT_ID': 'h2'})
+        self.assertEqual(obs, 1)
+        obs = count_unique_participants(iter(test_mapping),
+                                        criteria={'foo': '1'})
+        self.assertEqual(obs, 2)
+
     def test_count_seqs(self):
         test_seqs = [">a b",
                      "aattggcc",
@@ -116,6 +137,14 @@ class UtilTests(TestCase):
         obs = parse_mapping_file(StringIO(test_mapping))
         self.assertEqual(obs, exp)
 
+    def test_parse_mapping_file_raw_lines(self):
+        mapping = "#SampleIDs\tfoo\tbar\n#a comment\na\t1\nb\n"
+        exp = ("#SampleIDs\tfoo\tbar", [['#a comment'],
+                                        ['a', '1'],
+                                        ['b']])
+        obs = parse_mapping_file(StringIO(mapping))
+        self.assertEqual(obs, exp)
+
     def test_concatenate_files(self):
         expected_output = concat_test_input + concat_test_input
 
@@ -245,6 +274,38 @@ class UtilTests(TestCase):
                                               'SKIN', 'test', 'test-SKIN',
                                               'SKIN'])
 
+    def test_clean_and_reformat_mapping_processes(self):
+        """The output and errors do not depend on chunking or processes"""
+        reformat_mapping_testdata.seek(0)
+        exp_out = StringIO()
+        exp_errors = clean_and_reformat_mapping(reformat_mapping_testdata,
+                                                exp_out, 'body_site', 'HMP')
+
+        chunk_rows = agu.MAPPING_CHUNK_ROWS
+        agu.MAPPING_CHUNK_ROWS = 2
+        try:
+            for processes in (1, 2):
+                reformat_mapping_testdata.seek(0)
+                out = StringIO()
+                errors = clean_and_reformat_mapping(reformat_mapping_testdata,
+                                                    out, 'body_site', 'HMP',
+                                                    processes=processes)
+                self.assertEqual(out.getvalue(), exp_out.getvalue())
+                self.assertEqual(errors, exp_errors)
+        finally:
+            agu.MAPPING_CHUNK_ROWS = chunk_rows
+
+        self.assertEqual(exp_errors,
+                         {('unspecified_bodysite', 'unknown'): ['D']})
+
+    def test_map_row_chunks(self):
+        rows = [[i] for i in range(7)]
+        for processes in (1, 2):
+            obs = list(agu.map_row_chunks(len, iter(rows), processes,
+                                          chunk_rows=3))
+            self.assertEqual(obs, [3, 3, 1])
+        self.assertEqual(list(agu.map_row_chunks(len, [])), [])
+
     def test_add_alpha_diversity(self):
         map_ = pd.DataFrame(
             array([
@@ -314,6 +375,32 @@ class UtilTests(TestCase):
                  'unrare': ['A', 'B', 'C', 'D', 'E']}
         self.assertEqual(test, known)
 
+    def test_get_single_id_lists_depths(self):
+        map_ = pd.DataFrame([['x', '50'], ['x', '1500'], ['x', '2000'],
+                             ['y', '150'], ['y', '120'], ['z', '10'],
+                             ['w', 'nan']],
+                            columns=['HOST_SUBJECT_ID', 'depth'],
+                            index=list('ABCDEFG'))
+
+        # depths are ordered numerically, and are kept as given
+        test = get_single_id_lists(map_, ['1000', '100'], seed=0)
+        self.assertEqual(sorted(test), ['100', '1000', 'unrare'])
+        self.assertIn(test['1000'], (['B'], ['C']))
+        self.assertEqual(len(test['100']), 2)
+        self.assertEqual(test['100'][1:], test['1000'])
+        self.assertIn(test['100'][0], ('D', 'E'))
+        self.assertEqual(sorted(test['unrare'][:2]), ['F', 'G'])
+        self.assertEqual(test['unrare'][2:], test['100'])
+
+        # a seed reproduces a draw
+        self.assertEqual(get_single_id_lists(map_, [100, 1000], seed=0),
+                         get_single_id_lists(map_, [100, 1000], seed=0))
+
+        draws = get_single_id_lists(map_, [100, 1000], seed=0, draws=20)
+        self.assertEqual(len(draws), 20)
+        self.assertEqual(set(d[1000][0] for d in draws), set(['B', 'C']))
+        self.assertEqual(set(d[100][0] for d in draws), set(['D', 'E']))
+
     def test_collapse_taxonomy(self):
         obs = collapse_taxonomy(table)
         exp = Table(array([[100.0,  105.0,  110.0,  115.0],
@@ -327,6 +414,24 @@ class UtilTests(TestCase):
                     {'collapsed_ids': ['O2', 'O3', 'O4']}])
         self.assertEqual(obs, exp)
 
+    def test_collapse_taxonomy_levels(self):
+        obs = collapse_taxonomy_levels(table, [0, 1])
+        self.assertEqual(sorted(obs), [0, 1])
+        self.assertEqual(obs[1], collapse_taxonomy(table))
+
+        # levels match Table.collapse, including the order of the taxa
+        for level in obs:
+            exp = table.collapse(
+                lambda id_, md: '; '.join(md['taxonomy'][:level + 1]),
+                axis='observation', norm=False)
+            self.assertEqual(obs[level], exp)
+            self.assertEqual(list(obs[level].ids(axis='observation')),
+                             list(exp.ids(axis='observation')))
+
+        self.assertEqual(list(obs[0].ids(axis='observation')), ['Bacteria'])
+        self.assertEqual(obs[0].metadata(axis='observation')[0],
+                         {'collapsed_ids': observ_ids})
+
     def test_collapse_full(self):
         obs = collapse_full(table)
         exp = Table(array([[0.00769230769231], [0.0282051282051],
@@ -346,6 +451,49 @@ class UtilTests(TestCase):
             obs_meta.append(m)
         self.assertItemsEqual(obs_meta, observ_metadata)
 
+    def test_collapse_full_processes(self):
+        block_rows = agu.SUMMARY_BLOCK_ROWS
+        agu.SUMMARY_BLOCK_ROWS = 3
+        try:
+            obs = collapse_full(table, processes=2)
+        finally:
+            agu.SUMMARY_BLOCK_ROWS = block_rows
+        self.assertEqual(obs, collapse_full(table))
+
+    def test_sparse_quantiles(self):
+        # implicit zeros, explicit zeros and negatives are all ordered
+        dense = array([[0, 0, 5, 1, 0, 2],
+                       [-3, 0, 4, 0, -1, 0],
+                       [0, 0, 0, 0, 0, 0],
+                       [7, 6, 5, 4, 3, 2]], dtype=float)
+        sparse = csr_matrix(dense)
+        sparse.data[sparse.data == 4] = 0
+        dense[dense == 4] = 0
+
+        quantiles = [0, 0.1, 0.25, 0.5, 0.75, 1]
+        obs = sparse_quantiles(sparse, quantiles)
+        exp = percentile(dense, [q * 100 for q in quantiles], axis=1).T
+        assert_almost_equal(obs, exp)
+        assert_almost_equal(sparse_quantiles(sparse, [0.5])[:, 0],
+                            median(dense, axis=1))
+
+    def test_summarize_observations(self):
+        obs = summarize_observations(table, ['mean', 'median', 0.25])
+        dense = table.matrix_data.toarray()
+        exp = pd.DataFrame({'mean': dense.mean(axis=1),
+                            'median': median(dense, axis=1),
+                            0.25: percentile(dense, 25, axis=1)},
+                           index=observ_ids, columns=['mean', 'median', 0.25])
+        assert_frame_equal(obs, exp)
+
+    def test_collapse_summaries(self):
+        obs = collapse_summaries(table, ['median', 'mean'])
+        self.assertEqual(list(obs.ids()), ['median', 'mean'])
+        assert_almost_equal(obs.sum(axis='sample'), [1, 1])
+        median_table = collapse_full(table)
+        assert_almost_equal(obs.data('median'),
+                            median_table.data('average'))
+
 test_mapping = """#SampleIDs\tfoo\tbar
 a\t1\t123123
 b\tyy\txxx
@@ -365,6 +513,166 @@ test_fasta = """>seq1
 >seq3
 012345"""
 
+
+class ENAStandIn(BaseHTTPRequestHandler):
+    """Serve ENA-shaped responses, failing the first request of each path"""
+    failed = set()
+
+    def do_GET(self):
+        if self.path not in self.failed:
+            self.failed.add(self.path)
+            self.send_error(500)
+            return
+
+        host = 'http://%s:%d' % self.server.server_address
+        if self.path.startswith('/warehouse/filereport'):
+            body = 'secondary_sample_accession\tsubmitted_ftp\n'
+            for sample in sorted(ena_fastq):
+                body += '%s\t%s/fastq/%s.fastq.gz\n' % (sample, host, sample)
+        elif self.path.startswith('/view/'):
+            sample = self.path.split('/')[2].split('&')[0]
+            body = ena_xml % sample
+        elif self.path.startswith('/fastq/'):
+            sample = self.path.split('/')[2].split('.')[0]
+            out = StringIO()
+            # two gzip members, as concatenated FASTQ uploads have
+            for half in (ena_fastq[sample][:2], ena_fastq[sample][2:]):
+                with gzip.GzipFile(fileobj=out, mode='w') as fp:
+                    fp.write(''.join(half))
+            body = out.getvalue()
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchTests(TestCase):
+    def setUp(self):
+        ENAStandIn.failed = set()
+        self.server = HTTPServer(('127.0.0.1', 0), ENAStandIn)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.dir = tempfile.mkdtemp()
+        self.environ = os.environ.get('AG_ENA_URL')
+        os.environ['AG_ENA_URL'] = 'http://127.0.0.1:%d' % \
+            self.server.server_address[1]
+        self.retry_wait = agu.RETRY_WAIT
+        agu.RETRY_WAIT = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+        agu.RETRY_WAIT = self.retry_wait
+        if self.environ is None:
+            del os.environ['AG_ENA_URL']
+        else:
+            os.environ['AG_ENA_URL'] = self.environ
+
+    def test_fastq_to_fasta(self):
+        out = StringIO()
+        chunks = ['@a x\nAT', 'GC\n+\nIIII\n@b\nCC\n+', '\nII\n\n']
+        self.assertEqual(fastq_to_fasta(chunks, out), 2)
+        self.assertEqual(out.getvalue(), '>a x\nATGC\n>b\nCC\n')
+
+        with self.assertRaisesRegexp(ValueError, 'Incomplete'):
+            fastq_to_fasta(['@a\nAT\n+\n'], StringIO())
+        with self.assertRaisesRegexp(ValueError, 'Malformed'):
+            fastq_to_fasta(['a\nAT\n+\nII\n'], StringIO())
+
+    def test_stream_seqs_fasta(self):
+        url = '%s/fastq/S1.fastq.gz' % os.environ['AG_ENA_URL']
+        path = os.path.join(self.dir, 'S1.fna')
+        self.assertEqual(stream_seqs_fasta(url, path, chunk_size=7), 4)
+        with open(path) as fp:
+            self.assertEqual(fp.read(), ena_fasta['S1'])
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_fetch_samples(self):
+        details = list(fetch_study_details('ERP0'))
+        self.assertEqual([s for s, _ in details], ['S1', 'S2'])
+
+        self.assertEqual(fetch_samples(self.dir, details, threads=2), 2)
+        for sample in ['S1', 'S2']:
+            base = os.path.join(self.dir, sample, sample)
+            with open(base + '.fna') as fp:
+                self.assertEqual(fp.read(), ena_fasta[sample])
+            with open(base + '.txt') as fp:
+                self.assertEqual(fp.read(), ena_xml % sample)
+
+        # completed samples are not fetched again
+        self.assertEqual(fetch_samples(self.dir, details, threads=2), 0)
+
+    def test_fetch_samples_resume(self):
+        details = list(fetch_study_details('ERP0'))
+
+        # an interrupted fetch of S2 left only a partial temporary file
+        os.mkdir(os.path.join(self.dir, 'S2'))
+        with open(os.path.join(self.dir, 'S2', 'S2.fna.tmp'), 'w') as fp:
+            fp.write('>partial')
+
+        self.assertEqual(fetch_samples(self.dir, details, threads=1), 2)
+        with open(os.path.join(self.dir, 'S2', 'S2.fna')) as fp:
+            self.assertEqual(fp.read(), ena_fasta['S2'])
+
+    def test_from_xmls_to_mapping_file(self):
+        paths = []
+        for i, (barcode, attributes) in enumerate([
+                ('AAAA', [('age', '30'), ('body_site', 'feces')]),
+                ('CCCC', [('age', None), ('country', 'USA')]),
+                ('AAAA', [('age', '31'), ('body_site', 'feces')])]):
+            path = os.path.join(self.dir, '%d.txt' % i)
+            with open(path, 'w') as fp:
+                fp.write(sample_xml(barcode, attributes))
+            paths.append(path)
+
+        exp = ['#SampleID\tAGE\tBODY_SITE\tBarcodeSequence\tCOUNTRY\t'
+               'Description\tLinkerPrimerSequence',
+               'CCCC\tno_data\tno_data\tno_data\tUSA\ta sample\tno_data',
+               'AAAA\t31\tfeces\tno_data\tno_data\ta sample\tno_data']
+
+        chunk_size = agu.XML_CHUNK_SIZE
+        agu.XML_CHUNK_SIZE = 2
+        try:
+            for processes in (1, 2):
+                out = os.path.join(self.dir, 'mapping.txt')
+                from_xmls_to_mapping_file(paths, out, processes=processes)
+                with open(out) as fp:
+                    self.assertEqual(fp.read().splitlines(), exp)
+        finally:
+            agu.XML_CHUNK_SIZE = chunk_size
+
+
+def sample_xml(barcode, attributes):
+    attrs = ''.join('<SAMPLE_ATTRIBUTE><TAG>%s</TAG>%s</SAMPLE_ATTRIBUTE>'
+                    % (t, '<VALUE/>' if v is None else '<VALUE>%s</VALUE>' % v)
+                    for t, v in attributes)
+    return ('<ROOT><SAMPLE><IDENTIFIERS><PRIMARY_ID>x</PRIMARY_ID>'
+            '<EXTERNAL_ID>y</EXTERNAL_ID>'
+            '<SUBMITTER_ID>qiita:%s</SUBMITTER_ID></IDENTIFIERS>'
+            '<DESCRIPTION>a sample</DESCRIPTION>'
+            '<SAMPLE_ATTRIBUTES>%s</SAMPLE_ATTRIBUTES></SAMPLE></ROOT>'
+            % (barcode, attrs))
+
+
+ena_fastq = {'S1': ['@S1_0 a\nACGT\n+\nIIII\n', '@S1_1 b\nGGCC\n+\nIIII\n',
+                    '@S1_2 c\nTTAA\n+\nIIII\n', '@S1_3 d\nCATG\n+\nIIII\n'],
+             'S2': ['@S2_0 a\nAAAA\n+\nIIII\n', '@S2_1 b\nCCCC\n+\nIIII\n',
+                    '@S2_2 c\nGGGG\n+\nIIII\n']}
+ena_fasta = {'S1': '>S1_0 a\nACGT\n>S1_1 b\nGGCC\n>S1_2 c\nTTAA\n>S1_3 d\n'
+                   'CATG\n',
+             'S2': '>S2_0 a\nAAAA\n>S2_1 b\nCCCC\n>S2_2 c\nGGGG\n'}
+ena_xml = '<SAMPLE_SET><SAMPLE alias="%s"></SAMPLE></SAMPLE_SET>\n'
+
 reformat_mapping_testdata = StringIO(
 """#SampleID	COUNTRY	AGE	BODY_SITE	BMI
 A	GAZ:w00t	43.0	UBERON_mucosa_of_tongue	5